@@ -12,6 +12,14 @@ from flask_mail import Mail
 from dotenv import load_dotenv
 from config import config
 from database_adapter import DatabaseAdapter
+from sql_rows import RowJSONProvider
+from visitor_ingest import visitor_ingestor, EVENTO_VISITA, EVENTO_ANALYTICS
+from email_outbox import email_outbox
+from image_reprocess import image_reprocessor
+from firebase_storage import firebase_storage
+from local_storage import LocalStorageBackend
+from cache_utils import shared_snapshot
+import responsive_images
 import logging
 
 # Cargar variables de entorno
@@ -27,6 +35,8 @@ def create_app(config_name='development'):
     load_dotenv()
     
     app = Flask(__name__)
+    # jsonify/tojson serializan las filas del adaptador (Row) como objetos
+    app.json = RowJSONProvider(app)
     
     # Cargar configuración
     app.config.from_object(config[config_name])
@@ -40,6 +50,9 @@ def create_app(config_name='development'):
     
     # Configurar base de datos
     init_db_connection(app)
+    visitor_ingestor.init_app(app, db_adapter)
+    email_outbox.init_app(app, db_adapter)
+    image_reprocessor.init_app(app, db_adapter)
     
     # Registrar Blueprints
     from blueprints.main import main_bp
@@ -48,6 +61,13 @@ def create_app(config_name='development'):
     app.register_blueprint(main_bp)
     app.register_blueprint(admin_bp, url_prefix='/admin')
     
+    # Archivos del almacenamiento local (STORAGE_BACKEND=local, ver local_storage.py)
+    if isinstance(firebase_storage, LocalStorageBackend):
+        @app.route(f"{firebase_storage.url_path}/<path:filename>")
+        def media_file(filename):
+            """Servir un archivo guardado en disco con cabeceras de caché inmutables"""
+            return firebase_storage.serve(filename, app.config.get('STORAGE_X_ACCEL_PREFIX'))
+    
     # Health check endpoint para Docker
     @app.route('/health')
     def health_check():
@@ -82,6 +102,7 @@ def create_app(config_name='development'):
                 'timestamp': datetime.now().isoformat(),
                 'database': 'connected',
                 'database_type': app.config.get('DATABASE_TYPE', 'unknown'),
+                'pool': db_adapter.pool_stats(),
                 'version': '1.0.0'
             }, 200
         except Exception as e:
@@ -92,83 +113,60 @@ def create_app(config_name='development'):
             }, 503
     
     # API Endpoints para Contador de Visitantes
+    def ingest_event(kind, row):
+        """Encolar (modo buffered) o escribir en línea (modo sync) un evento de visitantes
+
+        Devuelve el código HTTP: 202 encolado, 503 descartado por cola llena, 200 escrito.
+        """
+        if visitor_ingestor.buffered:
+            return 202 if visitor_ingestor.submit(kind, row) else 503
+        visitor_ingestor.write(db_adapter.get_db(), [(kind, row)])
+        return 200
+
+    def ingest_dropped_response():
+        """Respuesta cuando la cola está llena: el cliente debe reintentar más tarde"""
+        from flask import jsonify
+        response = jsonify({
+            'success': False,
+            'dropped': True,
+            'error': 'Servicio de registro saturado'
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = str(app.config.get('VISITOR_INGEST_RETRY_AFTER', 5))
+        return response
+
     @app.route('/api/visitor-count', methods=['POST'])
     def register_visitor():
         """Registrar una nueva visita"""
         from flask import request, jsonify
         try:
             data = request.get_json() or {}
+            timestamp = datetime.now()
             
-            # Obtener información del visitante
-            visitor_data = {
-                'timestamp': datetime.now(),
-                'ip_address': request.remote_addr,
-                'user_agent': data.get('userAgent', request.headers.get('User-Agent', '')),
-                'referrer': data.get('referrer', ''),
-                'page': data.get('page', '/'),
-                'session_id': data.get('sessionId', ''),
-                'screen_resolution': data.get('screenResolution', ''),
-                'language': data.get('language', ''),
-                'timezone': data.get('timezone', '')
-            }
-            
-            # Guardar en base de datos
-            db = db_adapter.get_db()
-            cursor = db.cursor()
-            
-            # Crear tabla si no existe solo en SQLite (en MySQL ya existe creada)
-            if app.config.get('DATABASE_TYPE', 'mysql').lower() == 'sqlite':
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS visitor_logs (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        timestamp DATETIME NOT NULL,
-                        ip_address VARCHAR(45),
-                        user_agent TEXT,
-                        referrer TEXT,
-                        page VARCHAR(255),
-                        session_id VARCHAR(100),
-                        screen_resolution VARCHAR(20),
-                        language VARCHAR(10),
-                        timezone VARCHAR(50),
-                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-            
-            # Insertar nueva visita
-            cursor.execute("""
-                INSERT INTO visitor_logs 
-                (timestamp, ip_address, user_agent, referrer, page, session_id, 
-                 screen_resolution, language, timezone)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                visitor_data['timestamp'],
-                visitor_data['ip_address'],
-                visitor_data['user_agent'],
-                visitor_data['referrer'],
-                visitor_data['page'],
-                visitor_data['session_id'],
-                visitor_data['screen_resolution'],
-                visitor_data['language'],
-                visitor_data['timezone']
-            ))
-            
-            # Obtener el ID del visitante insertado (compatible con SQLite y MySQL)
-            visitor_id = db.connection.lastrowid if hasattr(db.connection, 'lastrowid') else None
-            
-            # Obtener total de visitantes
-            cursor.execute("SELECT COUNT(*) as total FROM visitor_logs")
-            result = cursor.fetchone()
-            total_visitors = result['total'] if result else 0
+            # Obtener información del visitante (mismo orden que el INSERT)
+            row = (
+                timestamp,
+                request.remote_addr,
+                data.get('userAgent', request.headers.get('User-Agent', '')),
+                data.get('referrer', ''),
+                data.get('page', '/'),
+                data.get('sessionId', ''),
+                data.get('screenResolution', ''),
+                data.get('language', ''),
+                data.get('timezone', '')
+            )
             
-            db.commit()
-            cursor.close()
+            status = ingest_event(EVENTO_VISITA, row)
+            if status == 503:
+                return ingest_dropped_response()
             
             return jsonify({
                 'success': True,
-                'total_visitors': total_visitors,
-                'visitor_id': visitor_id,
-                'timestamp': visitor_data['timestamp'].isoformat()
-            })
+                'queued': status == 202,
+                'backpressure': visitor_ingestor.backpressure(),
+                'total_visitors': visitor_ingestor.total_visitors(),
+                'timestamp': timestamp.isoformat()
+            }), status
             
         except Exception as e:
             import traceback
@@ -182,71 +180,27 @@ def create_app(config_name='development'):
     @app.route('/api/visitor-stats')
     def get_visitor_stats():
         """Obtener estadísticas de visitantes"""
-        from flask import jsonify
+        from flask import request, jsonify
         try:
-            db = db_adapter.get_db()
-            cursor = db.cursor()
-            # Determinar tipo de base de datos para usar funciones de fecha correctas
-            db_type = app.config.get('DATABASE_TYPE', 'mysql').lower()
-            
-            # Total de visitantes
-            cursor.execute("SELECT COUNT(*) as total FROM visitor_logs")
-            result = cursor.fetchone()
-            total_visitors = result['total'] if result else 0
-            
-            # Visitantes de hoy (MySQL vs SQLite)
-            if db_type == 'sqlite':
-                cursor.execute("""
-                    SELECT COUNT(*) as today FROM visitor_logs 
-                    WHERE DATE(timestamp) = DATE('now')
-                """)
-            else:
-                cursor.execute("""
-                    SELECT COUNT(*) as today FROM visitor_logs 
-                    WHERE DATE(timestamp) = CURDATE()
-                """)
-            result = cursor.fetchone()
-            today_visitors = result['today'] if result else 0
-            
-            # Visitantes únicos (por IP)
-            cursor.execute("SELECT COUNT(DISTINCT ip_address) as unique_count FROM visitor_logs")
-            result = cursor.fetchone()
-            unique_visitors = result['unique_count'] if result else 0
+            def compute():
+                # Agregados materializados: lectura de filas fijas, no del log completo
+                stats = visitor_ingestor.read_stats(db_adapter.get_db(), top_pages=5)
+                return {
+                    'totalVisitors': stats['total'],
+                    'todayVisitors': stats['today'],
+                    'uniqueVisitors': stats['unique'],
+                    'onlineVisitors': stats['online'],
+                    'topPages': stats['top_pages']
+                }
             
-            # Visitantes de la última hora (simulando "en línea") - MySQL vs SQLite
-            if db_type == 'sqlite':
-                cursor.execute("""
-                    SELECT COUNT(DISTINCT session_id) as online FROM visitor_logs 
-                    WHERE timestamp >= datetime('now', '-1 hour')
-                """)
-            else:
-                cursor.execute("""
-                    SELECT COUNT(DISTINCT session_id) as online FROM visitor_logs 
-                    WHERE timestamp >= (NOW() - INTERVAL 1 HOUR)
-                """)
-            result = cursor.fetchone()
-            online_visitors = result['online'] if result else 0
+            # Misma instantánea para todos los clientes; un solo worker la recalcula
+            ttl = app.config.get('VISITOR_STATS_TTL', 15)
+            snapshot = shared_snapshot('visitor_stats', compute, ttl)
             
-            # Páginas más visitadas
-            cursor.execute("""
-                SELECT page, COUNT(*) as visits 
-                FROM visitor_logs 
-                GROUP BY page 
-                ORDER BY visits DESC 
-                LIMIT 5
-            """)
-            top_pages = [{'page': row['page'], 'visits': row['visits']} for row in cursor.fetchall()]
-            
-            cursor.close()
-            
-            return jsonify({
-                'totalVisitors': total_visitors,
-                'todayVisitors': today_visitors,
-                'uniqueVisitors': unique_visitors,
-                'onlineVisitors': online_visitors,
-                'topPages': top_pages,
-                'lastUpdated': datetime.now().isoformat()
-            })
+            response = jsonify(dict(snapshot['payload'], lastUpdated=snapshot['generated_at'].isoformat()))
+            response.set_etag(snapshot['etag'])
+            response.headers['Cache-Control'] = f'public, max-age={ttl}, stale-while-revalidate={ttl * 2}'
+            return response.make_conditional(request)
             
         except Exception as e:
             import traceback
@@ -268,36 +222,7 @@ def create_app(config_name='development'):
         try:
             data = request.get_json() or {}
             
-            db = db_adapter.get_db()
-            cursor = db.cursor()
-            
-            # Crear tabla de analytics si no existe solo en SQLite (en MySQL ya existe creada)
-            if app.config.get('DATABASE_TYPE', 'mysql').lower() == 'sqlite':
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS visitor_analytics (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        timestamp DATETIME NOT NULL,
-                        page VARCHAR(255),
-                        referrer TEXT,
-                        user_agent TEXT,
-                        screen_resolution VARCHAR(20),
-                        language VARCHAR(10),
-                        timezone VARCHAR(50),
-                        is_new_visitor BOOLEAN,
-                        session_id VARCHAR(100),
-                        local_count INTEGER,
-                        ip_address VARCHAR(45),
-                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-            
-            # Insertar datos de analytics
-            cursor.execute("""
-                INSERT INTO visitor_analytics 
-                (timestamp, page, referrer, user_agent, screen_resolution, 
-                 language, timezone, is_new_visitor, session_id, local_count, ip_address)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
+            row = (
                 datetime.fromtimestamp(data.get('timestamp', 0) / 1000),
                 data.get('page', ''),
                 data.get('referrer', ''),
@@ -309,15 +234,17 @@ def create_app(config_name='development'):
                 data.get('sessionId', ''),
                 data.get('localCount', 0),
                 request.remote_addr
-            ))
+            )
             
-            db.commit()
-            cursor.close()
+            status = ingest_event(EVENTO_ANALYTICS, row)
+            if status == 503:
+                return ingest_dropped_response()
             
             return jsonify({
                 'success': True,
+                'queued': status == 202,
                 'message': 'Analytics registrados correctamente'
-            })
+            }), status
             
         except Exception as e:
             print(f"Error registrando analytics: {e}")
@@ -326,6 +253,35 @@ def create_app(config_name='development'):
                 'error': str(e)
             }), 500
     
+    # Estado de la ingesta de visitantes (por worker)
+    @app.route('/health/ingest')
+    def health_check_ingest():
+        """Contadores de la cola de eventos de visitantes de este worker"""
+        return {
+            'status': 'degraded' if visitor_ingestor.backpressure() else 'healthy',
+            'timestamp': datetime.now().isoformat(),
+            'ingest': visitor_ingestor.stats()
+        }, 200
+
+    # Estado de la cola de correos salientes
+    @app.route('/health/email')
+    def health_check_email():
+        """Correos por estado en email_outbox y contadores del hilo de este worker"""
+        try:
+            counts = email_outbox.counts(db_adapter.get_db())
+        except Exception as e:
+            return {
+                'status': 'unhealthy',
+                'timestamp': datetime.now().isoformat(),
+                'error': str(e)
+            }, 503
+        return {
+            'status': 'degraded' if counts.get('fallido') else 'healthy',
+            'timestamp': datetime.now().isoformat(),
+            'outbox': counts,
+            'worker': email_outbox.stats()
+        }, 200
+    
     # Crear directorio de uploads si no existe
     upload_dir = os.path.join(app.root_path, app.config['UPLOAD_FOLDER'])
     os.makedirs(upload_dir, exist_ok=True)
@@ -350,6 +306,10 @@ def create_app(config_name='development'):
                 print(f"DEBUG: URL completa detectada: {url}")
             return url
         
+        # Ruta absoluta del mismo host (p. ej. /media/... del almacenamiento local)
+        if url.startswith('/'):
+            return url
+        
         # Verificar si es una URL de Firebase (más específica)
         firebase_indicators = [
             'firebasestorage.googleapis.com',
@@ -369,6 +329,20 @@ def create_app(config_name='development'):
             print(f"DEBUG: URL estática generada: {static_url}")
         return static_url
 
+    @app.template_filter('firebase_srcset')
+    def firebase_srcset_filter(variantes, content_type=None):
+        """
+        srcset de las variantes responsive de una imagen (columna `variantes`)
+        para un tipo (p. ej. 'image/webp'); sin tipo, el del respaldo JPEG/PNG.
+        Cada URL pasa por firebase_url.
+        """
+        return responsive_images.srcset(variantes, content_type, resolver=firebase_url_filter)
+
+    @app.template_filter('variant_sources')
+    def variant_sources_filter(variantes):
+        """Tipos modernos (AVIF, WebP) con variantes, para los <source> de <picture>"""
+        return responsive_images.tipos_modernos(variantes)
+
     # Formateo ligero para contenidos escritos desde el admin
     # Soporta: ==resaltar==, **negrita**, *cursiva*, __subrayado__
     @app.template_filter('format_admin')
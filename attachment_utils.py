@@ -0,0 +1,185 @@
+"""
+Descarga de adjuntos para los correos de cotización
+
+Las imágenes se descargan en paralelo con un pool de hilos acotado que comparte
+una requests.Session (conexiones keep-alive reutilizadas), con un plazo total
+para todo el lote y un tope de tamaño por archivo que se comprueba mientras se
+lee el stream. Las imágenes subidas por este worker en /api/quote/upload se
+guardan en una caché LRU en memoria y se adjuntan sin volver a descargarlas;
+las del almacenamiento local (STORAGE_BACKEND=local) se leen del disco.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from firebase_storage import firebase_storage
+
+CHUNK_SIZE = 64 * 1024
+
+_lock = threading.Lock()
+_sessions = {}
+_uploads = OrderedDict()
+_uploads_bytes = 0
+
+
+class AdjuntoDemasiadoGrande(Exception):
+    """El archivo supera el tamaño máximo permitido para un adjunto"""
+
+
+def nombre_adjunto(url):
+    """Nombre de archivo del adjunto a partir de su URL"""
+    return url.split('/')[-1].split('?')[0]
+
+
+def get_session(pool_size=4):
+    """Sesión HTTP compartida por proceso (el pool de conexiones no sobrevive al fork)"""
+    pid = os.getpid()
+    session = _sessions.get(pid)
+    if session is None:
+        with _lock:
+            session = _sessions.get(pid)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _sessions.clear()
+                _sessions[pid] = session
+    return session
+
+
+# =====================
+# Caché de subidas recientes
+# =====================
+
+def recordar_subida(url, data, content_type, max_bytes=32 * 1024 * 1024):
+    """Guardar los bytes de una imagen recién subida, acotando la memoria total"""
+    global _uploads_bytes
+    if not url or not data or len(data) > max_bytes:
+        return
+    with _lock:
+        anterior = _uploads.pop(url, None)
+        if anterior is not None:
+            _uploads_bytes -= len(anterior[0])
+        _uploads[url] = (data, content_type, time.monotonic())
+        _uploads_bytes += len(data)
+        while _uploads_bytes > max_bytes:
+            _, (viejo, _, _) = _uploads.popitem(last=False)
+            _uploads_bytes -= len(viejo)
+
+
+def subida_reciente(url, ttl=3600):
+    """Bytes y content-type de una subida reciente, o None"""
+    global _uploads_bytes
+    with _lock:
+        entrada = _uploads.get(url)
+        if entrada is None:
+            return None
+        data, content_type, guardado = entrada
+        if time.monotonic() - guardado > ttl:
+            del _uploads[url]
+            _uploads_bytes -= len(data)
+            return None
+        _uploads.move_to_end(url)
+        return data, content_type
+
+
+def olvidar_subida(url):
+    """Quitar una URL de la caché (p. ej. al eliminar la imagen)"""
+    global _uploads_bytes
+    with _lock:
+        entrada = _uploads.pop(url, None)
+        if entrada is not None:
+            _uploads_bytes -= len(entrada[0])
+
+
+# =====================
+# Descarga en paralelo
+# =====================
+
+def _descargar(session, url, deadline, max_bytes, timeout):
+    """Descargar una URL en streaming, cortando por tamaño o por plazo"""
+    restante = deadline - time.monotonic()
+    if restante <= 0:
+        raise TimeoutError('Plazo agotado antes de empezar la descarga')
+    with session.get(url, stream=True, timeout=min(timeout, restante)) as r:
+        if r.status_code != 200:
+            raise IOError(f'HTTP {r.status_code}')
+        longitud = r.headers.get('Content-Length')
+        if longitud and longitud.isdigit() and int(longitud) > max_bytes:
+            raise AdjuntoDemasiadoGrande(f'{longitud} bytes')
+        partes = []
+        total = 0
+        for parte in r.iter_content(CHUNK_SIZE):
+            total += len(parte)
+            if total > max_bytes:
+                raise AdjuntoDemasiadoGrande(f'más de {max_bytes} bytes')
+            if time.monotonic() > deadline:
+                raise TimeoutError('Plazo agotado durante la descarga')
+            partes.append(parte)
+        return b''.join(partes), r.headers.get('Content-Type', 'image/jpeg')
+
+
+def descargar_adjuntos(urls, max_workers=4, deadline_seconds=20, max_bytes=5 * 1024 * 1024,
+                       timeout=10, cache_ttl=3600):
+    """Obtener los adjuntos de una lista de URLs
+
+    Devuelve (adjuntos, errores): adjuntos es una lista de
+    (nombre, content_type, bytes) en el orden de las URLs y errores un dict
+    {url: mensaje} con las que no se pudieron adjuntar. Nunca espera más de
+    deadline_seconds en total.
+    """
+    resultados = {}
+    errores = {}
+    pendientes = []
+    for url in urls:
+        reciente = subida_reciente(url, ttl=cache_ttl)
+        if reciente is not None:
+            resultados[url] = reciente
+            continue
+        try:
+            local = firebase_storage.read_stored(url)
+        except OSError as e:
+            print(f"Error leyendo adjunto local {url}: {e}")
+            local = None
+        if local is None:
+            pendientes.append(url)
+        elif len(local[0]) > max_bytes:
+            errores[url] = f'más de {max_bytes} bytes'
+        else:
+            resultados[url] = local
+
+    if pendientes:
+        deadline = time.monotonic() + deadline_seconds
+        session = get_session(max_workers)
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(pendientes)),
+                                      thread_name_prefix='quote-attachment')
+        try:
+            futuros = {
+                executor.submit(_descargar, session, url, deadline, max_bytes, timeout): url
+                for url in pendientes
+            }
+            hechos, no_hechos = wait(futuros, timeout=max(deadline - time.monotonic(), 0))
+            for futuro in hechos:
+                url = futuros[futuro]
+                try:
+                    resultados[url] = futuro.result()
+                except Exception as e:
+                    errores[url] = str(e)
+            for futuro in no_hechos:
+                errores[futuros[futuro]] = 'Plazo agotado'
+        finally:
+            # Las descargas rezagadas terminan solas al vencer su plazo
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    adjuntos = [
+        (nombre_adjunto(url), resultados[url][1], resultados[url][0])
+        for url in urls if url in resultados
+    ]
+    return adjuntos, errores
@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, current_app, make_response
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, current_app, make_response, g, Response, stream_with_context
 from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
 from functools import wraps
@@ -6,11 +6,21 @@ import os
 import uuid
 import io
 import csv
+import zlib
 from datetime import datetime
-from PIL import Image, ImageOps
 from jwt_utils import JWTManager, admin_required
-from firebase_storage import upload_file, delete_file, is_firebase_available
+from firebase_storage import upload_file, is_firebase_available
+from upload_pipeline import subir_con_variantes
+from responsive_images import ensure_variantes_column, variantes_json, urls_variantes, cargar_variantes
+from image_reprocess import image_reprocessor
+from storage_refs import borrar_si_no_usada, ensure_hash_column
+import image_processing
+from storage_backend import content_hash
 from database_adapter import get_db
+from cache_utils import invalidate_configuracion, invalidate_contenido
+from visitor_ingest import visitor_ingestor
+from chatbot_engine import invalidate_chatbot
+import chatbot_gpt
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -26,15 +36,26 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def upload_image_with_variants(file, folder, product_category=None):
+    """Subir una imagen con sus variantes responsive; retorna (url, variantes)"""
+    config = current_app.config
+    return subir_con_variantes(
+        file,
+        folder=folder,
+        product_category=product_category,
+        cpu_workers=config.get('IMAGE_PROCESS_WORKERS', 0),
+        io_workers=config.get('STORAGE_IO_WORKERS', 4),
+    )
+
 def save_product_image(file, categoria):
-    """Guardar imagen de producto en Firebase Storage y retornar la URL pública"""
+    """Guardar imagen de producto en Firebase Storage y retornar (URL pública, variantes)"""
     if not file:
         print("Error: No se proporcionó archivo")
-        return None
+        return None, None
         
     if not file.filename:
         print("Error: Archivo sin nombre")
-        return None
+        return None, None
     
     print(f"Procesando archivo: {file.filename}")
     print(f"Tipo de contenido: {file.content_type}")
@@ -42,11 +63,11 @@ def save_product_image(file, categoria):
     if not allowed_file(file.filename):
         print(f"Error: Formato de archivo no permitido: {file.filename}")
         print(f"Extensiones permitidas: {ALLOWED_EXTENSIONS}")
-        return None
+        return None, None
     
     if not is_firebase_available():
         print("Firebase Storage no está disponible")
-        return None
+        return None, None
     
     try:
         # Verificar que el archivo tenga contenido
@@ -56,43 +77,55 @@ def save_product_image(file, categoria):
         
         if file_size == 0:
             print("Error: El archivo está vacío")
-            return None
+            return None, None
         
         print(f"Tamaño del archivo: {file_size} bytes")
         
-        # Validar que es realmente una imagen válida
-        try:
-            file_content = file.read()
-            file.seek(0)  # Reset file pointer
-            
-            from PIL import Image
-            import io
-            img = Image.open(io.BytesIO(file_content))
-            img.verify()  # Verificar que es una imagen válida
-            print(f"Validación de imagen exitosa - Formato: {img.format}, Tamaño: {img.size}")
-            
-            # Reset file pointer again after validation
-            file.seek(0)
-            
-        except Exception as img_error:
-            print(f"Error: Formato de imagen no válido - {img_error}")
-            return None
-        
         # Subir archivo a Firebase Storage con optimización específica por categoría
-        firebase_url = upload_file(file, folder="productos", optimize_image=True, product_category=categoria)
+        # y sus variantes responsive (la imagen se decodifica una sola vez y se
+        # rechaza si no es válida)
+        firebase_url, variantes = upload_image_with_variants(file, "productos", product_category=categoria)
         
         if firebase_url:
             print(f"Imagen subida exitosamente a Firebase: {firebase_url}")
-            return firebase_url
+            return firebase_url, variantes
         else:
             print("Error al subir imagen a Firebase Storage")
-            return None
+            return None, None
             
     except Exception as e:
         print(f"Error procesando imagen: {e}")
         import traceback
         traceback.print_exc()
-        return None
+        return None, None
+
+# Rutas que escriben pero no afectan el contenido de las páginas públicas
+NON_CONTENT_ENDPOINTS = {
+    'admin.login', 'admin.logout', 'admin.refresh_token',
+    'admin.reset_password_request', 'admin.reset_password', 'admin.change_password',
+    'admin.marcar_contacto_leido', 'admin.eliminar_contacto',
+    'admin.visitor_logs_cleanup',
+    # El reproceso invalida la caché él mismo a medida que cambia imágenes
+    'admin.reprocess_images',
+}
+
+@admin_bp.after_request
+def invalidate_public_pages(response):
+    """Incrementar la versión de contenido tras cualquier mutación del admin
+
+    Invalida las páginas públicas cacheadas (cache_utils.cached_page) en todos los workers.
+    """
+    if request.method in ('POST', 'PUT', 'PATCH', 'DELETE') \
+            and request.endpoint not in NON_CONTENT_ENDPOINTS \
+            and response.status_code < 500 and 'db' in g:
+        try:
+            db = get_db()
+            # Descartar escrituras no confirmadas por la ruta (se perderían igual al cerrar)
+            db.rollback()
+            invalidate_contenido(db, commit=True)
+        except Exception as e:
+            print(f"Error invalidando caché de páginas: {e}")
+    return response
 
 def login_required(f):
     """Decorador para requerir login en rutas de admin"""
@@ -119,24 +152,8 @@ def medios():
         db = get_db()
         cursor = db.cursor()
         
-        cursor.execute('SELECT * FROM medios ORDER BY fecha_subida DESC')
-        files_data = cursor.fetchall()
-        
-        # Convertir a lista de diccionarios para facilitar el uso en template
-        files = []
-        for file_data in files_data:
-            file_dict = {
-                    'id': file_data['id'],
-                    'name': file_data['nombre'],
-                    'filename': file_data['filename'],
-                    'type': file_data['tipo'],
-                    'category': file_data.get('categoria', 'general'),
-                    'size': file_data['tamano'],
-                    'description': file_data['descripcion'],
-                    'path': file_data['ruta'],
-                    'upload_date': file_data['fecha_subida']
-                }
-            files.append(file_dict)
+        cursor.execute_named('medios.admin')
+        files = cursor.fetchall()
         
         return render_template('admin/medios.html', files=files)
         
@@ -186,8 +203,29 @@ def upload_media_file():
         else:
             file_type = 'other'
         
-        # Subir archivo a Firebase Storage
-        firebase_url = upload_file(file, folder=folder_name, optimize_image=(file_type == 'image'))
+        db = get_db()
+        cursor = db.cursor()
+        ensure_variantes_column(cursor, current_app.config['DATABASE_TYPE'], 'medios')
+        ensure_hash_column(cursor, current_app.config['DATABASE_TYPE'])
+        
+        # Un archivo idéntico ya subido (mismo contenido y misma carpeta/procesado)
+        # reutiliza su URL y variantes sin optimizar ni subir nada
+        file_data = file.read()
+        file.seek(0)
+        hash_contenido = content_hash(file_data, folder_name + '|' + image_processing.processing_profile(
+            file.content_type, folder_name, file_type == 'image'))
+        cursor.execute("SELECT ruta, variantes FROM medios WHERE hash_contenido = %s LIMIT 1", (hash_contenido,))
+        existente = cursor.fetchone()
+        
+        # Subir archivo a Firebase Storage (las imágenes con sus variantes responsive)
+        variantes = None
+        if existente:
+            firebase_url, variantes = existente['ruta'], cargar_variantes(existente['variantes'])
+            print(f"Archivo idéntico ya subido, se reutiliza {firebase_url}")
+        elif file_type == 'image':
+            firebase_url, variantes = upload_image_with_variants(file, folder_name)
+        else:
+            firebase_url = upload_file(file, folder=folder_name, optimize_image=False)
         
         if not firebase_url:
             flash('Error al subir archivo a Firebase Storage', 'error')
@@ -203,13 +241,11 @@ def upload_media_file():
         file.seek(0)
         
         # Guardar en base de datos con la URL de Firebase
-        db = get_db()
-        cursor = db.cursor()
-        
         cursor.execute("""
-                INSERT INTO medios (nombre, filename, tipo, categoria, tamano, descripcion, ruta)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, (file_name, file.filename, file_type, category, file_size, description, firebase_url))
+                INSERT INTO medios (nombre, filename, tipo, categoria, tamano, descripcion, ruta, variantes, hash_contenido)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (file_name, file.filename, file_type, category, file_size, description, firebase_url,
+                  variantes_json(variantes), hash_contenido))
         
         db.commit()
         flash('Archivo subido exitosamente a Firebase Storage', 'success')
@@ -228,8 +264,8 @@ def delete_media_file(file_id):
         db = get_db()
         cursor = db.cursor()
         
-        # Obtener información del archivo
-        cursor.execute("SELECT filename, ruta FROM medios WHERE id = %s", (file_id,))
+        # Obtener información del archivo (SELECT * por si aún no existe la columna variantes)
+        cursor.execute("SELECT * FROM medios WHERE id = %s", (file_id,))
         
         file_data = cursor.fetchone()
         if not file_data:
@@ -238,10 +274,11 @@ def delete_media_file(file_id):
         filename = file_data['filename']
         firebase_url = file_data['ruta']
         
-        # Eliminar archivo de Firebase Storage
+        # Eliminar archivo de Firebase Storage (si ningún otro registro comparte el mismo contenido)
         if firebase_url:
             if is_firebase_available():
-                success = delete_file(firebase_url)
+                success = borrar_si_no_usada(cursor, firebase_url, urls_variantes(file_data.get('variantes')),
+                                             excluir=('medios', file_id))
                 if not success:
                     return jsonify({'success': False, 'message': 'Error al eliminar archivo de Firebase Storage'})
             else:
@@ -279,17 +316,20 @@ def delete_multiple_media_files():
         
         for file_id in file_ids:
             # Obtener información del archivo
-            cursor.execute("SELECT filename, ruta FROM medios WHERE id = %s", (file_id,))
+            cursor.execute("SELECT * FROM medios WHERE id = %s", (file_id,))
             
             file_data = cursor.fetchone()
             if file_data:
                 filename = file_data['filename']
                 firebase_url = file_data['ruta']
                 
-                # Eliminar archivo de Firebase Storage
+                # Eliminar archivo de Firebase Storage (si ningún otro registro lo comparte)
                 firebase_success = True
                 if firebase_url:
-                    firebase_success = delete_file(firebase_url)
+                    firebase_success = borrar_si_no_usada(
+                        cursor, firebase_url, urls_variantes(file_data.get('variantes')),
+                        excluir=('medios', file_id)
+                    )
                 
                 if firebase_success:
                     # Eliminar de base de datos solo si se eliminó de Firebase exitosamente
@@ -318,27 +358,10 @@ def filter_medios_by_category(category):
         cursor = db.cursor()
         
         if category == 'all':
-            cursor.execute('SELECT * FROM medios ORDER BY fecha_subida DESC')
+            cursor.execute_named('medios.admin')
         else:
-            cursor.execute('SELECT * FROM medios WHERE categoria = %s ORDER BY fecha_subida DESC', (category,))
-        
-        files_data = cursor.fetchall()
-        
-        # Convertir a lista de diccionarios
-        files = []
-        for file_data in files_data:
-            file_dict = {
-                    'id': file_data['id'],
-                    'name': file_data['nombre'],
-                    'filename': file_data['filename'],
-                    'type': file_data['tipo'],
-                    'category': file_data.get('categoria', 'general'),
-                    'size': file_data['tamano'],
-                    'description': file_data['descripcion'],
-                    'path': file_data['ruta'],
-                    'upload_date': file_data['fecha_subida']
-                }
-            files.append(file_dict)
+            cursor.execute_named('medios.admin', (category,), filtros=('categoria',))
+        files = cursor.fetchall()
         
         return jsonify({'success': True, 'files': files})
         
@@ -366,6 +389,61 @@ def update_file_category(file_id):
         print(f"Error al actualizar categoría: {e}")
         return jsonify({'success': False, 'message': 'Error al actualizar categoría'})
 
+def csv_chunks(cursor, gzip_output=False, chunk_bytes=65536):
+    """CSV de un cursor ya ejecutado, por bloques de ~chunk_bytes (gzip opcional)
+
+    Las filas se escriben a medida que se leen (iterrows), así que solo hay en
+    memoria un bloque del archivo. Cierra el cursor al terminar o si el
+    cliente corta la descarga.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # wbits=31: flujo gzip (cabecera y CRC) en lugar de zlib
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip_output else None
+
+    def take():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+
+    try:
+        writer.writerow([col[0] for col in cursor.description])
+        for row in cursor.iterrows():
+            writer.writerow(row)
+            if buffer.tell() >= chunk_bytes:
+                chunk = take()
+                if chunk:
+                    yield chunk
+        chunk = take()
+        if compressor:
+            chunk += compressor.flush()
+        if chunk:
+            yield chunk
+    except Exception as e:
+        # La respuesta ya empezó: solo queda registrar el error (el archivo queda incompleto)
+        current_app.logger.exception('Error exportando CSV de visitantes: %s', e)
+    finally:
+        cursor.close()
+
+def visitor_log_filters(start_date, end_date, page, q):
+    """Filtros activos y sus parámetros para las consultas visitor_logs.* (ver sql_queries.py)"""
+    filtros = []
+    params = []
+    if start_date:
+        filtros.append('desde')
+        params.append(f"{start_date} 00:00:00")
+    if end_date:
+        filtros.append('hasta')
+        params.append(f"{end_date} 23:59:59")
+    if page:
+        filtros.append('pagina')
+        params.append(f"%{page}%")
+    if q:
+        filtros.append('texto')
+        params.extend([f"%{q}%", f"%{q}%", f"%{q}%"])
+    return filtros, params
+
 @admin_bp.route('/visitor-logs')
 @login_required
 def visitor_logs():
@@ -381,80 +459,16 @@ def visitor_logs():
         db = get_db()
         cursor = db.cursor()
 
-        # Determinar tipo de base de datos
-        db_type = current_app.config.get('DATABASE_TYPE', 'mysql').lower()
-
-        # Estadísticas
-        cursor.execute("SELECT COUNT(*) as total FROM visitor_logs")
-        total_row = cursor.fetchone()
-        total_visitors = total_row['total'] if total_row else 0
+        # Estadísticas desde los agregados materializados (ver visitor_stats.py)
+        rollups = visitor_ingestor.read_stats(db, top_pages=10)
 
-        if db_type == 'sqlite':
-            cursor.execute("""
-                SELECT COUNT(*) as today FROM visitor_logs
-                WHERE DATE(timestamp) = DATE('now')
-            """)
-        else:
-            cursor.execute("""
-                SELECT COUNT(*) as today FROM visitor_logs
-                WHERE DATE(timestamp) = CURDATE()
-            """)
-        today_row = cursor.fetchone()
-        today_visitors = today_row['today'] if today_row else 0
-
-        cursor.execute("SELECT COUNT(DISTINCT ip_address) as unique_count FROM visitor_logs")
-        unique_row = cursor.fetchone()
-        unique_visitors = unique_row['unique_count'] if unique_row else 0
-
-        if db_type == 'sqlite':
-            cursor.execute("""
-                SELECT COUNT(DISTINCT session_id) as online FROM visitor_logs
-                WHERE timestamp >= datetime('now', '-1 hour')
-            """)
-        else:
-            cursor.execute("""
-                SELECT COUNT(DISTINCT session_id) as online FROM visitor_logs
-                WHERE timestamp >= (NOW() - INTERVAL 1 HOUR)
-            """)
-        online_row = cursor.fetchone()
-        online_visitors = online_row['online'] if online_row else 0
-
-        # Construir consulta base para logs
-        query = "SELECT id, timestamp, page, ip_address, referrer, user_agent, session_id, language, screen_resolution, timezone FROM visitor_logs"
-        conditions = []
-        params = []
-
-        if start_date:
-            conditions.append("timestamp >= %s")
-            params.append(f"{start_date} 00:00:00")
-        if end_date:
-            conditions.append("timestamp <= %s")
-            params.append(f"{end_date} 23:59:59")
-        if page:
-            conditions.append("page LIKE %s")
-            params.append(f"%{page}%")
-        if q:
-            conditions.append("(ip_address LIKE %s OR session_id LIKE %s OR user_agent LIKE %s)")
-            params.extend([f"%{q}%", f"%{q}%", f"%{q}%"])
-
-        if conditions:
-            query += " WHERE " + " AND ".join(conditions)
-
-        query += " ORDER BY timestamp DESC LIMIT %s"
+        # Consulta precompilada con los filtros activos
+        filtros, params = visitor_log_filters(start_date, end_date, page, q)
         params.append(limit)
-
-        cursor.execute(query, params)
+        cursor.execute_named('visitor_logs.listar', params, filtros=filtros)
         logs = cursor.fetchall()
 
-        # Top páginas
-        cursor.execute("""
-            SELECT page, COUNT(*) as visits
-            FROM visitor_logs
-            GROUP BY page
-            ORDER BY visits DESC
-            LIMIT 10
-        """)
-        top_pages = cursor.fetchall()
+        top_pages = rollups['top_pages']
 
         # Países a partir de language (ej: es-CO -> CO) o timezone
         country_counts = {}
@@ -492,10 +506,10 @@ def visitor_logs():
         cursor.close()
 
         stats = {
-            'total': total_visitors,
-            'today': today_visitors,
-            'unique': unique_visitors,
-            'online': online_visitors
+            'total': rollups['total'],
+            'today': rollups['today'],
+            'unique': rollups['unique'],
+            'online': rollups['online']
         }
 
         filters = {
@@ -544,46 +558,28 @@ def visitor_logs_export():
         q = request.args.get('q')
 
         db = get_db()
-        cursor = db.cursor()
-
-        query = "SELECT id, timestamp, page, ip_address, referrer, user_agent, session_id, language, screen_resolution, timezone FROM visitor_logs"
-        conditions = []
-        params = []
-
-        if start_date:
-            conditions.append("timestamp >= %s")
-            params.append(f"{start_date} 00:00:00")
-        if end_date:
-            conditions.append("timestamp <= %s")
-            params.append(f"{end_date} 23:59:59")
-        if page:
-            conditions.append("page LIKE %s")
-            params.append(f"%{page}%")
-        if q:
-            conditions.append("(ip_address LIKE %s OR session_id LIKE %s OR user_agent LIKE %s)")
-            params.extend([f"%{q}%", f"%{q}%", f"%{q}%"]) 
-
-        if conditions:
-            query += " WHERE " + " AND ".join(conditions)
-        query += " ORDER BY timestamp DESC"
-
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        cursor.close()
+        filtros, params = visitor_log_filters(start_date, end_date, page, q)
 
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['id','timestamp','page','ip_address','referrer','user_agent','session_id','language','screen_resolution','timezone'])
-        for r in rows:
-            writer.writerow([
-                r.get('id'), r.get('timestamp'), r.get('page'), r.get('ip_address'),
-                r.get('referrer'), r.get('user_agent'), r.get('session_id'), r.get('language'),
-                r.get('screen_resolution'), r.get('timezone')
-            ])
-
-        resp = make_response(output.getvalue())
+        # Cursor sin buffer: las filas salen del servidor a medida que se escriben
+        cursor = db.cursor(streaming=True)
+        try:
+            cursor.execute_named('visitor_logs.exportar', params, filtros=filtros)
+        except Exception:
+            cursor.close()
+            raise
+
+        gzip_output = (current_app.config.get('VISITOR_EXPORT_GZIP', True)
+                       and 'gzip' in request.accept_encodings)
+        chunks = csv_chunks(cursor, gzip_output, current_app.config.get('VISITOR_EXPORT_CHUNK_BYTES', 65536))
+        resp = Response(stream_with_context(chunks), mimetype='text/csv')
         resp.headers['Content-Type'] = 'text/csv; charset=utf-8'
         resp.headers['Content-Disposition'] = 'attachment; filename="visitor_logs.csv"'
+        resp.headers['Cache-Control'] = 'no-store'
+        resp.headers['Vary'] = 'Accept-Encoding'
+        # Sin buffer en nginx: cada bloque llega al cliente en cuanto se genera
+        resp.headers['X-Accel-Buffering'] = 'no'
+        if gzip_output:
+            resp.headers['Content-Encoding'] = 'gzip'
         return resp
     except Exception as e:
         current_app.logger.exception('Error exportando CSV de visitantes: %s', e)
@@ -597,19 +593,13 @@ def visitor_logs_cleanup():
     try:
         db = get_db()
         cursor = db.cursor()
-        db_type = current_app.config.get('DATABASE_TYPE', 'mysql').lower()
 
         payload = request.get_json(silent=True) or {}
         days = int(payload.get('days', 90))
         if days <= 0 or days > 3650:
             return jsonify({'success': False, 'message': 'Valor de días inválido'}), 400
 
-        if db_type == 'sqlite':
-            delete_query = "DELETE FROM visitor_logs WHERE timestamp < datetime('now', ? || ' day')"
-            cursor.execute(delete_query, (f'-{days}',))
-        else:
-            delete_query = "DELETE FROM visitor_logs WHERE timestamp < (NOW() - INTERVAL %s DAY)"
-            cursor.execute(delete_query, (days,))
+        cursor.execute_named('visitor_logs.limpiar', (days,))
 
         db.commit()
         cursor.close()
@@ -634,9 +624,9 @@ def login():
             user = cursor.fetchone()
             
             if user:
-                user_id = user['id'] if isinstance(user, dict) else user[0]
-                user_username = user['username'] if isinstance(user, dict) else user[1]
-                password_hash = user['password_hash'] if isinstance(user, dict) else user[2]
+                user_id = user['id']
+                user_username = user['username']
+                password_hash = user['password_hash']
                 
                 if check_password_hash(password_hash, password):
                     # Generar tokens JWT
@@ -866,6 +856,7 @@ def nuevo_producto():
             
             # Manejar la imagen
             imagen_filename = None
+            imagen_variantes = None
             if 'imagen' in request.files:
                 file = request.files['imagen']
                 if file.filename != '':
@@ -878,19 +869,20 @@ def nuevo_producto():
                         flash('El archivo es demasiado grande. Máximo 5MB permitido.', 'error')
                         return render_template('admin/nuevo_producto.html')
                     
-                    imagen_filename = save_product_image(file, categoria)
+                    imagen_filename, imagen_variantes = save_product_image(file, categoria)
                     if not imagen_filename:
                         flash('Formato de imagen no válido. Use JPG, PNG o GIF.', 'error')
                         return render_template('admin/nuevo_producto.html')
             
             db = get_db()
             cursor = db.cursor()
+            ensure_variantes_column(cursor, current_app.config['DATABASE_TYPE'], 'productos')
             
             # Insertar producto con o sin imagen
             cursor.execute("""
-                    INSERT INTO productos (nombre, descripcion, precio, categoria, imagen, activo)
-                    VALUES (%s, %s, %s, %s, %s, TRUE)
-                """, (nombre, descripcion, precio, categoria, imagen_filename))
+                    INSERT INTO productos (nombre, descripcion, precio, categoria, imagen, variantes, activo)
+                    VALUES (%s, %s, %s, %s, %s, %s, TRUE)
+                """, (nombre, descripcion, precio, categoria, imagen_filename, variantes_json(imagen_variantes)))
             
             db.commit()
             flash('Producto creado exitosamente', 'success')
@@ -1039,6 +1031,8 @@ def configuracion():
                         ON DUPLICATE KEY UPDATE valor = VALUES(valor)
                     """, (clave, valor))
             
+            # Invalidar la configuración en memoria de todos los workers
+            invalidate_configuracion(db)
             db.commit()
             flash('Configuración actualizada exitosamente', 'success')
             
@@ -1104,14 +1098,7 @@ def editar_servicio(servicio_id):
                 cursor.execute("SELECT imagen FROM servicios WHERE id = %s", (servicio_id,))
                 row = cursor.fetchone()
                 if row:
-                    # Soporta row como dict o tupla
-                    if isinstance(row, dict):
-                        previous_media_url = row.get('imagen')
-                    else:
-                        try:
-                            previous_media_url = row[4] if len(row) > 4 else None
-                        except Exception:
-                            previous_media_url = None
+                    previous_media_url = row['imagen']
             except Exception as qerr:
                 print(f"No se pudo obtener medio anterior del servicio {servicio_id}: {qerr}")
             
@@ -1136,7 +1123,8 @@ def editar_servicio(servicio_id):
                     if previous_media_url and is_firebase_available():
                         try:
                             if previous_media_url != media_url:
-                                deleted = delete_file(previous_media_url)
+                                deleted = borrar_si_no_usada(cursor, previous_media_url,
+                                                             excluir=('servicios', servicio_id))
                                 if not deleted:
                                     print(f"Advertencia: No se pudo eliminar el medio anterior en Firebase del servicio {servicio_id}")
                         except Exception as derr:
@@ -1177,20 +1165,14 @@ def eliminar_servicio(servicio_id):
             cursor.execute("SELECT imagen FROM servicios WHERE id = %s", (servicio_id,))
             row = cursor.fetchone()
             if row:
-                if isinstance(row, dict):
-                    imagen_url = row.get('imagen')
-                else:
-                    try:
-                        imagen_url = row[4] if len(row) > 4 else None
-                    except Exception:
-                        imagen_url = None
+                imagen_url = row['imagen']
         except Exception as qerr:
             print(f"No se pudo obtener imagen del servicio {servicio_id} antes de eliminar: {qerr}")
 
         # Intentar eliminar archivo en Firebase si existe
         if imagen_url and is_firebase_available():
             try:
-                firebase_deleted = delete_file(imagen_url)
+                firebase_deleted = borrar_si_no_usada(cursor, imagen_url, excluir=('servicios', servicio_id))
                 if not firebase_deleted:
                     print(f"Advertencia: No se pudo eliminar el archivo en Firebase para servicio {servicio_id}")
             except Exception as derr:
@@ -1239,20 +1221,21 @@ def editar_producto(producto_id):
 
             # Obtener URL de imagen anterior para eliminarla si se reemplaza
             imagen_anterior_url = None
+            variantes_anteriores = None
             try:
                 db_prev = get_db()
                 cur_prev = db_prev.cursor()
-                cur_prev.execute("SELECT imagen FROM productos WHERE id = %s", (producto_id,))
+                cur_prev.execute("SELECT * FROM productos WHERE id = %s", (producto_id,))
                 producto_prev = cur_prev.fetchone()
                 if producto_prev:
-                    imagen_anterior_url = producto_prev['imagen'] if isinstance(producto_prev, dict) else (
-                        producto_prev[4] if len(producto_prev) > 4 else None
-                    )
+                    imagen_anterior_url = producto_prev['imagen']
+                    variantes_anteriores = producto_prev.get('variantes')
             except Exception as e_prev:
                 print(f"No se pudo obtener imagen anterior del producto {producto_id}: {e_prev}")
 
             # Manejar la imagen
             imagen_filename = None
+            imagen_variantes = None
             if 'imagen' in request.files:
                 file = request.files['imagen']
                 if file.filename != '':
@@ -1265,7 +1248,7 @@ def editar_producto(producto_id):
                         flash('El archivo es demasiado grande. Máximo 5MB permitido.', 'error')
                         return redirect(url_for('admin.productos'))
 
-                    imagen_filename = save_product_image(file, categoria)
+                    imagen_filename, imagen_variantes = save_product_image(file, categoria)
                     if not imagen_filename:
                         flash('Formato de imagen no válido. Use JPG, PNG o GIF.', 'error')
                         return redirect(url_for('admin.productos'))
@@ -1273,7 +1256,10 @@ def editar_producto(producto_id):
                     if imagen_anterior_url and is_firebase_available():
                         try:
                             if imagen_anterior_url != imagen_filename:
-                                success_del = delete_file(imagen_anterior_url)
+                                success_del = borrar_si_no_usada(
+                                    get_db().cursor(), imagen_anterior_url, urls_variantes(variantes_anteriores),
+                                    excluir=('productos', producto_id)
+                                )
                                 if not success_del:
                                     print(f"Advertencia: No se pudo eliminar la imagen anterior en Firebase del producto {producto_id}")
                         except Exception as del_err:
@@ -1284,10 +1270,13 @@ def editar_producto(producto_id):
 
             # Actualizar producto con o sin imagen
             if imagen_filename:
+                ensure_variantes_column(cursor, current_app.config['DATABASE_TYPE'], 'productos')
                 cursor.execute("""
-                        UPDATE productos SET nombre = %s, categoria = %s, descripcion = %s, precio = %s, imagen = %s
+                        UPDATE productos SET nombre = %s, categoria = %s, descripcion = %s, precio = %s, imagen = %s,
+                        variantes = %s
                         WHERE id = %s
-                    """, (nombre, categoria, descripcion, precio, imagen_filename, producto_id))
+                    """, (nombre, categoria, descripcion, precio, imagen_filename,
+                          variantes_json(imagen_variantes), producto_id))
             else:
                 cursor.execute("""
                         UPDATE productos SET nombre = %s, categoria = %s, descripcion = %s, precio = %s
@@ -1313,7 +1302,7 @@ def eliminar_producto(producto_id):
         cursor = db.cursor()
         
         # Obtener información del producto antes de eliminarlo
-        cursor.execute("SELECT nombre, imagen FROM productos WHERE id = %s", (producto_id,))
+        cursor.execute("SELECT * FROM productos WHERE id = %s", (producto_id,))
         producto_data = cursor.fetchone()
         
         if not producto_data:
@@ -1326,7 +1315,8 @@ def eliminar_producto(producto_id):
         # Eliminar imagen de Firebase Storage si existe
         firebase_success = True
         if imagen_url and is_firebase_available():
-            firebase_success = delete_file(imagen_url)
+            firebase_success = borrar_si_no_usada(cursor, imagen_url, urls_variantes(producto_data.get('variantes')),
+                                                  excluir=('productos', producto_id))
             if not firebase_success:
                 print(f"Advertencia: No se pudo eliminar la imagen de Firebase para el producto {producto_nombre}")
         
@@ -1463,7 +1453,7 @@ def ensure_nosotros_tables(cursor):
             try:
                 cursor.execute("PRAGMA table_info(institucional_secciones)")
                 cols = cursor.fetchall()
-                col_names = [c['name'] if isinstance(c, dict) else c[1] for c in cols]
+                col_names = [c['name'] for c in cols]
                 if 'imagen' not in col_names:
                     cursor.execute("ALTER TABLE institucional_secciones ADD COLUMN imagen TEXT")
             except Exception as col_err:
@@ -1572,15 +1562,10 @@ def admin_nosotros():
                             prev = cursor.fetchone()
                             prev_url = None
                             if prev:
-                                if isinstance(prev, dict):
-                                    prev_url = prev.get('imagen')
-                                else:
-                                    try:
-                                        prev_url = prev[0]
-                                    except Exception:
-                                        prev_url = None
+                                prev_url = prev['imagen']
                             if prev_url and prev_url != imagen_url and is_firebase_available():
-                                delete_file(prev_url)
+                                row_id = row['id']
+                                borrar_si_no_usada(cursor, prev_url, excluir=('institucional_secciones', row_id))
                         except Exception as del_err:
                             print(f"Advertencia al eliminar imagen anterior ({clave}): {del_err}")
 
@@ -1680,16 +1665,10 @@ def nosotros_quienes_somos():
                 # Eliminar imagen anterior si se sube una nueva
                 if imagen_url:
                     try:
-                        prev_url = None
-                        if isinstance(row, dict):
-                            prev_url = row.get('imagen')
-                        else:
-                            try:
-                                prev_url = row[1]
-                            except Exception:
-                                prev_url = None
+                        prev_url = row['imagen']
                         if prev_url and prev_url != imagen_url and is_firebase_available():
-                            delete_file(prev_url)
+                            row_id = row['id']
+                            borrar_si_no_usada(cursor, prev_url, excluir=('institucional_secciones', row_id))
                     except Exception as del_err:
                         print(f"Advertencia al eliminar imagen anterior ({clave}): {del_err}")
 
@@ -1814,120 +1793,36 @@ def nueva_pregunta():
     
     return render_template('admin/quiz_form.html')
 
-def reprocess_product_image(firebase_url, categoria=None):
-    """Reprocesar una imagen existente en Firebase Storage con optimización específica por categoría"""
-    if not firebase_url or not is_firebase_available():
-        return False
-    
-    try:
-        import requests
-        from io import BytesIO
-        
-        # Descargar imagen desde Firebase
-        response = requests.get(firebase_url)
-        if response.status_code != 200:
-            return False
-        
-        # Usar la nueva función de optimización por categoría
-        from firebase_storage import FirebaseStorageManager
-        storage_manager = FirebaseStorageManager()
-        
-        # Aplicar optimización específica por categoría
-        if categoria:
-            optimized_data = storage_manager._optimize_product_image_by_category(response.content, categoria)
-            print(f"Aplicando optimización específica para categoría: {categoria}")
-        else:
-            # Fallback a optimización estándar si no hay categoría
-            optimized_data = storage_manager._optimize_image(response.content)
-            print("Aplicando optimización estándar (sin categoría especificada)")
-        
-        # Crear un archivo temporal en memoria con los datos optimizados
-        img_buffer = BytesIO(optimized_data)
-        
-        # Crear un objeto de archivo simulado para upload_file
-        from werkzeug.datastructures import FileStorage
-        temp_file = FileStorage(
-            stream=img_buffer,
-            filename='reprocessed_image.jpg',
-            content_type='image/jpeg'
-        )
-        
-        # Subir imagen reprocesada a Firebase (reemplazará la existente)
-        # No aplicar optimización adicional ya que ya fue optimizada específicamente por categoría
-        new_url = upload_file(temp_file, folder='productos', optimize_image=False)
-        
-        # Eliminar la imagen original de Firebase si la nueva subida fue exitosa
-        if new_url and new_url != firebase_url:
-            delete_file(firebase_url)
-            return new_url
-        
-        return firebase_url if new_url else False
-            
-    except Exception as e:
-        print(f"Error reprocesando imagen {image_filename}: {e}")
-        return False
-
-@admin_bp.route('/reprocess-images')
+@admin_bp.route('/reprocess-images', methods=['POST'])
 @login_required
 def reprocess_images():
-    """Reprocesar todas las imágenes de productos para asegurar tamaño correcto"""
+    """Iniciar (o retomar) el reproceso de imágenes de productos en segundo plano"""
     try:
         if not is_firebase_available():
-            flash('Firebase Storage no está disponible', 'error')
-            return redirect(url_for('admin.productos'))
+            return jsonify({'success': False, 'message': 'Firebase Storage no está disponible'})
         
         db = get_db()
-        cursor = db.cursor()
-        
-        # Obtener todos los productos con imágenes
-        cursor.execute("SELECT id, nombre, imagen, categoria FROM productos WHERE imagen IS NOT NULL AND imagen != ''")
-        productos = cursor.fetchall()
+        trabajo_id = image_reprocessor.start_job(db)
+        if trabajo_id is None:
+            return jsonify({'success': False, 'message': 'No se encontraron imágenes de Firebase para reprocesar'})
         
-        if not productos:
-            flash('No se encontraron productos con imágenes para reprocesar', 'info')
-            return redirect(url_for('admin.productos'))
-        
-        processed_count = 0
-        updated_count = 0
-        
-        # Reprocesar cada imagen
-        for producto in productos:
-            producto_id = producto['id'] if isinstance(producto, dict) else producto[0]
-            producto_nombre = producto['nombre'] if isinstance(producto, dict) else producto[1]
-            imagen_url = producto['imagen'] if isinstance(producto, dict) else producto[2]
-            categoria = producto['categoria'] if isinstance(producto, dict) else producto[3]
-            
-            # Solo procesar URLs de Firebase
-            if imagen_url and imagen_url.startswith('https://'):
-                print(f"Reprocesando imagen del producto: {producto_nombre} (Categoría: {categoria})")
-                result = reprocess_product_image(imagen_url, categoria)
-                
-                if result and result != imagen_url:
-                    # Actualizar la URL en la base de datos
-                    cursor.execute("UPDATE productos SET imagen = %s WHERE id = %s", (result, producto_id))
-                    updated_count += 1
-                    print(f"Imagen actualizada para {producto_nombre}: {result}")
-                elif result:
-                    print(f"Imagen reprocesada para {producto_nombre} (misma URL)")
-                
-                processed_count += 1
-            else:
-                print(f"Saltando imagen local para {producto_nombre}: {imagen_url}")
-        
-        # Confirmar cambios en la base de datos
-        if updated_count > 0:
-            db.commit()
-        
-        if processed_count > 0:
-            flash(f'Se reprocesaron {processed_count} imágenes exitosamente. {updated_count} URLs actualizadas.', 'success')
-        else:
-            flash('No se encontraron imágenes de Firebase para reprocesar', 'info')
+        return jsonify({'success': True, 'progreso': image_reprocessor.progress(db, trabajo_id)})
         
     except Exception as e:
-        print(f"Error reprocesando imágenes: {e}")
-        flash('Error al reprocesar las imágenes', 'error')
-    
-    return redirect(url_for('admin.productos'))
+        print(f"Error iniciando el reproceso de imágenes: {e}")
+        return jsonify({'success': False, 'message': 'Error al iniciar el reproceso de imágenes'}), 500
+
+@admin_bp.route('/reprocess-images/estado')
+@login_required
+def reprocess_images_status():
+    """Progreso del último reproceso de imágenes (lo consulta la página de productos)"""
+    try:
+        trabajo_id = request.args.get('id', type=int)
+        progreso = image_reprocessor.progress(get_db(), trabajo_id)
+        return jsonify({'success': True, 'progreso': progreso})
+    except Exception as e:
+        print(f"Error consultando el reproceso de imágenes: {e}")
+        return jsonify({'success': False, 'message': 'Error al consultar el progreso'}), 500
 
 @admin_bp.route('/quiz/editar/<int:id>', methods=['GET', 'POST'])
 @login_required
@@ -2045,7 +1940,8 @@ def chatbot():
         
         return render_template('admin/chatbot.html', 
                              preguntas=preguntas, 
-                             configuracion=configuracion)
+                             configuracion=configuracion,
+                             gpt_cache=chatbot_gpt.stats())
         
     except Exception as e:
         print(f"Error al cargar chatbot: {e}")
@@ -2074,6 +1970,7 @@ def nueva_pregunta_chatbot():
             VALUES (%s, %s, %s)
         """, (pregunta, respuesta, activo))
         
+        invalidate_chatbot(db)
         db.commit()
         flash('Pregunta agregada exitosamente', 'success')
         
@@ -2275,6 +2172,7 @@ def editar_pregunta_chatbot(pregunta_id):
                 WHERE id = %s
             """, (pregunta, respuesta, activo, pregunta_id))
         
+        invalidate_chatbot(db)
         db.commit()
         flash('Pregunta actualizada exitosamente', 'success')
         
@@ -2294,6 +2192,7 @@ def eliminar_pregunta_chatbot(pregunta_id):
         
         cursor.execute("DELETE FROM chatbot_preguntas WHERE id = %s", (pregunta_id,))
         
+        invalidate_chatbot(db)
         db.commit()
         flash('Pregunta eliminada exitosamente', 'success')
         
@@ -2313,6 +2212,7 @@ def toggle_pregunta_chatbot(pregunta_id):
         
         cursor.execute("UPDATE chatbot_preguntas SET activo = NOT activo WHERE id = %s", (pregunta_id,))
         
+        invalidate_chatbot(db)
         db.commit()
         flash('Estado de la pregunta actualizado', 'success')
         
@@ -2351,6 +2251,7 @@ def configuracion_chatbot():
             """, (nombre_bot, mensaje_bienvenida, mensaje_no_entendido, 
                   recaptcha_site_key, recaptcha_secret_key, openai_api_key, usar_gpt, 1))
         
+        invalidate_chatbot(db)
         db.commit()
         flash('Configuración del chatbot actualizada exitosamente', 'success')
         
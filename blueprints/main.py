@@ -1,9 +1,15 @@
-from flask import Blueprint, render_template, request, jsonify, send_file, flash, redirect, url_for, current_app, g
+from flask import Blueprint, render_template, request, jsonify, send_file, flash, redirect, url_for, current_app, g, Response, stream_with_context
 import os
+import json
 import requests
-from openai import OpenAI
 from flask_mail import Message
-from firebase_storage import upload_file, delete_file, is_firebase_available
+from firebase_storage import is_firebase_available
+from cache_utils import get_configuracion, cached_page, skip_page_cache
+from chatbot_engine import get_index as get_chatbot_index
+import chatbot_gpt
+from email_outbox import email_outbox
+from attachment_utils import recordar_subida, olvidar_subida
+from upload_pipeline import subir_archivos
 
 main_bp = Blueprint('main', __name__)
 
@@ -32,6 +38,7 @@ def inject_recaptcha():
     }
 
 @main_bp.route('/')
+@cached_page
 def index():
     """Página de inicio moderna con todo el contenido"""
     try:
@@ -39,23 +46,22 @@ def index():
         cursor = db.cursor()
         
         # Obtener todos los servicios activos
-        cursor.execute("SELECT * FROM servicios WHERE activo = TRUE ORDER BY nombre")
+        cursor.execute_named('servicios.activos')
         servicios = cursor.fetchall()
         
         # Obtener todos los productos activos agrupados por categoría
-        cursor.execute("SELECT * FROM productos WHERE activo = TRUE ORDER BY categoria, nombre")
+        cursor.execute_named('productos.activos')
         productos_raw = cursor.fetchall()
         
         # Obtener testimonios
-        cursor.execute("SELECT * FROM testimonios WHERE activo = TRUE ORDER BY id DESC")
+        cursor.execute_named('testimonios.activos')
         testimonios = cursor.fetchall()
         
-        # Obtener configuración de la empresa
-        cursor.execute("SELECT clave, valor FROM configuracion")
-        config_raw = cursor.fetchall()
+        # Configuración de la empresa (instantánea en memoria)
+        configuracion = get_configuracion()
         
         # Obtener imágenes del carrusel
-        cursor.execute("SELECT * FROM medios WHERE categoria = 'carousel' ORDER BY fecha_subida DESC")
+        cursor.execute_named('medios.por_categoria', ('carousel',))
         carousel_images = cursor.fetchall()
         
         # Debug: Log de las URLs del carrusel
@@ -65,18 +71,11 @@ def index():
         # Agrupar productos por categoría
         productos = {}
         for producto in productos_raw:
-            categoria = producto['categoria'] if isinstance(producto, dict) else producto[4]
+            categoria = producto['categoria']
             if categoria not in productos:
                 productos[categoria] = []
             productos[categoria].append(producto)
         
-        # Convertir configuración a diccionario
-        configuracion = {}
-        for config in config_raw:
-            clave = config['clave'] if isinstance(config, dict) else config[0]
-            valor = config['valor'] if isinstance(config, dict) else config[1]
-            configuracion[clave] = valor
-        
         return render_template('sitio/inicio.html', 
                              servicios=servicios, 
                              productos=productos, 
@@ -85,6 +84,7 @@ def index():
                              carousel_images=carousel_images)
     except Exception as e:
         print(f"Error al cargar página de inicio: {e}")
+        skip_page_cache()
         return render_template('sitio/inicio.html', 
                              servicios=[], 
                              productos={}, 
@@ -95,69 +95,42 @@ def index():
 # Nuevas páginas solicitadas
 
 @main_bp.route('/blog-mantenimiento-tanques-agua/')
+@cached_page
 def blog_mantenimiento():
     """Blog sobre mantenimiento de tanques de agua en Valledupar"""
     try:
-        db = get_db()
-        cursor = db.cursor()
-        
-        # Obtener configuración de la empresa
-        cursor.execute("SELECT clave, valor FROM configuracion")
-        config_raw = cursor.fetchall()
-        
-        # Convertir configuración a diccionario
-        configuracion = {}
-        for config in config_raw:
-            clave = config['clave'] if isinstance(config, dict) else config[0]
-            valor = config['valor'] if isinstance(config, dict) else config[1]
-            configuracion[clave] = valor
+        # Configuración de la empresa (instantánea en memoria)
+        configuracion = get_configuracion()
         
         return render_template('sitio/blog_mantenimiento.html', configuracion=configuracion)
     except Exception as e:
         print(f"Error al cargar configuración: {e}")
+        skip_page_cache()
         return render_template('sitio/blog_mantenimiento.html', configuracion={})
 
 @main_bp.route('/limpieza-tanques-elevados-valledupar-dh2o-colombia/')
+@cached_page
 def limpieza_tanques_elevados():
     """Página sobre limpieza de tanques elevados en Valledupar"""
     try:
         db = get_db()
         cursor = db.cursor()
         
-        # Obtener configuración de la empresa
-        cursor.execute("SELECT clave, valor FROM configuracion")
-        config_raw = cursor.fetchall()
-        
-        # Convertir configuración a diccionario
-        configuracion = {}
-        for config in config_raw:
-            clave = config['clave'] if isinstance(config, dict) else config[0]
-            valor = config['valor'] if isinstance(config, dict) else config[1]
-            configuracion[clave] = valor
+        # Configuración de la empresa (instantánea en memoria)
+        configuracion = get_configuracion()
         
         # Obtener medios (imágenes y videos) para la galería, excluyendo las imágenes del carrusel
-        cursor.execute("SELECT * FROM medios WHERE tipo IN ('image', 'video') AND categoria != 'carousel' ORDER BY fecha_subida DESC")
-        medios_raw = cursor.fetchall()
-        
-        # Convertir medios a lista de diccionarios
-        medios = []
-        for medio in medios_raw:
-            medio_dict = {
-                    'id': medio['id'],
-                    'nombre': medio['nombre'],
-                    'filename': medio['filename'],
-                    'tipo': medio['tipo'],
-                    'descripcion': medio['descripcion'] if 'descripcion' in medio else '',
-                    'ruta': medio['ruta'] if 'ruta' in medio else f'uploads/{medio["filename"]}'
-                }
-            medios.append(medio_dict)
+        cursor.execute_named('medios.galeria')
+        medios = cursor.fetchall()
         
         return render_template('sitio/limpieza_tanques_elevados.html', configuracion=configuracion, medios=medios)
     except Exception as e:
         print(f"Error al cargar configuración y medios: {e}")
+        skip_page_cache()
         return render_template('sitio/limpieza_tanques_elevados.html', configuracion={}, medios=[])
 
 @main_bp.route('/accesorios-tanques-elevados/')
+@cached_page
 def accesorios_tanques():
     """Página de accesorios y productos para tanques elevados"""
     try:
@@ -165,7 +138,7 @@ def accesorios_tanques():
         cursor = db.cursor()
         
         # Obtener todos los productos activos agrupados por categoría
-        cursor.execute("SELECT * FROM productos WHERE activo = TRUE ORDER BY categoria, nombre")
+        cursor.execute_named('productos.activos')
         
         productos_raw = cursor.fetchall()
         
@@ -178,31 +151,11 @@ def accesorios_tanques():
             productos_por_categoria[categoria].append(producto)
         
         # Obtener medios de la categoría accesorios
-        cursor.execute("SELECT * FROM medios WHERE categoria = 'accesorios' ORDER BY fecha_subida DESC")
-        medios_raw = cursor.fetchall()
-        
-        # Procesar medios para la plantilla
-        medios = []
-        for medio in medios_raw:
-            if isinstance(medio, dict):
-                medio_dict = {
-                    'id': medio['id'],
-                    'titulo': medio.get('nombre', ''),
-                    'descripcion': medio.get('descripcion', ''),
-                    'ruta': medio.get('ruta', '')
-                }
-            medios.append(medio_dict)
+        cursor.execute_named('medios.por_categoria', ('accesorios',))
+        medios = cursor.fetchall()
         
-        # Obtener configuración de la empresa
-        cursor.execute("SELECT clave, valor FROM configuracion")
-        config_raw = cursor.fetchall()
-        
-        # Convertir configuración a diccionario
-        configuracion = {}
-        for config in config_raw:
-            clave = config['clave'] if isinstance(config, dict) else config[0]
-            valor = config['valor'] if isinstance(config, dict) else config[1]
-            configuracion[clave] = valor
+        # Configuración de la empresa (instantánea en memoria)
+        configuracion = get_configuracion()
         
         return render_template('sitio/accesorios_tanques_elevados.html', 
                              productos_por_categoria=productos_por_categoria,
@@ -211,12 +164,14 @@ def accesorios_tanques():
         
     except Exception as e:
         print(f"Error en accesorios: {e}")
+        skip_page_cache()
         return render_template('sitio/accesorios_tanques_elevados.html', 
                              productos_por_categoria={},
                              configuracion={},
                              medios=[])
 
 @main_bp.route('/nosotros')
+@cached_page
 def nosotros():
     """Página institucional 'Nosotros' con secciones administrables"""
     try:
@@ -255,40 +210,30 @@ def nosotros():
                 """
             )
 
-        # Configuración general del sitio
-        cursor.execute("SELECT clave, valor FROM configuracion")
-        config_raw = cursor.fetchall()
-        configuracion = {}
-        for config in config_raw:
-            clave = config['clave'] if isinstance(config, dict) else config[0]
-            valor = config['valor'] if isinstance(config, dict) else config[1]
-            configuracion[clave] = valor
+        # Configuración general del sitio (instantánea en memoria)
+        configuracion = get_configuracion()
 
         # Secciones activas
-        cursor.execute("SELECT * FROM institucional_secciones WHERE activo = TRUE ORDER BY orden, id")
+        cursor.execute_named('institucional.activas')
         secciones = cursor.fetchall()
 
         return render_template('sitio/nosotros.html', configuracion=configuracion, secciones=secciones)
     except Exception as e:
         print(f"Error al cargar página Nosotros: {e}")
+        skip_page_cache()
         return render_template('sitio/nosotros.html', configuracion={}, secciones=[])
 
 
 @main_bp.route('/nosotros/<slug>')
+@cached_page
 def nosotros_section(slug):
     """Subpágina para una sección específica de 'Nosotros' (ej. quienes-somos)."""
     try:
         db = get_db()
         cursor = db.cursor()
 
-        # Configuración general del sitio
-        cursor.execute("SELECT clave, valor FROM configuracion")
-        config_raw = cursor.fetchall()
-        configuracion = {}
-        for config in config_raw:
-            clave = config['clave'] if isinstance(config, dict) else config[0]
-            valor = config['valor'] if isinstance(config, dict) else config[1]
-            configuracion[clave] = valor
+        # Configuración general del sitio (instantánea en memoria)
+        configuracion = get_configuracion()
 
         # Normalizar clave (permitir guiones en la URL) y alias amigables
         section_key = (slug or '').replace('-', '_')
@@ -308,42 +253,45 @@ def nosotros_section(slug):
         section_key = alias_map.get(section_key, section_key)
 
         # Cargar todas las secciones activas para subnav
-        cursor.execute("SELECT * FROM institucional_secciones WHERE activo = TRUE ORDER BY orden, id")
+        cursor.execute_named('institucional.activas')
         secciones = cursor.fetchall()
 
         # Casos combinados
         if section_key == 'mision_vision':
-            cursor.execute("SELECT * FROM institucional_secciones WHERE clave IN ('mision','vision') AND activo = TRUE ORDER BY orden, id")
+            cursor.execute_named('institucional.por_claves', ('mision', 'vision'))
             mv_sections = cursor.fetchall()
             return render_template('sitio/nosotros_mision_vision.html', configuracion=configuracion, secciones=secciones, mv_sections=mv_sections)
 
         if section_key == 'certificaciones':
-            cursor.execute("SELECT * FROM institucional_secciones WHERE clave = 'certificaciones' AND activo = TRUE")
+            cursor.execute_named('institucional.por_clave', ('certificaciones',))
             certificaciones = cursor.fetchone()
-            cursor.execute("SELECT * FROM institucional_secciones WHERE clave = 'cobertura_regional' AND activo = TRUE")
+            cursor.execute_named('institucional.por_clave', ('cobertura_regional',))
             cobertura = cursor.fetchone()
             return render_template('sitio/nosotros_certificaciones.html', configuracion=configuracion, secciones=secciones, certificaciones=certificaciones, cobertura=cobertura)
 
         if section_key == 'compromiso_ambiental_seguridad_calidad':
-            cursor.execute("SELECT * FROM institucional_secciones WHERE clave IN ('compromiso_ambiental','seguridad_calidad') AND activo = TRUE ORDER BY orden, id")
+            cursor.execute_named('institucional.por_claves', ('compromiso_ambiental', 'seguridad_calidad'))
             cs_sections = cursor.fetchall()
             return render_template('sitio/nosotros_compromiso_seguridad.html', configuracion=configuracion, secciones=secciones, cs_sections=cs_sections)
 
         # Buscar la sección solicitada
-        cursor.execute("SELECT * FROM institucional_secciones WHERE clave = %s AND activo = TRUE", (section_key,))
+        cursor.execute_named('institucional.por_clave', (section_key,))
         seccion = cursor.fetchone()
 
         if not seccion:
-            # Fallback: 404 amigable dentro del template
+            # Fallback: 404 amigable dentro del template (no se cachea: slugs arbitrarios)
+            skip_page_cache()
             return render_template('sitio/nosotros_section.html', configuracion=configuracion, secciones=secciones, seccion=None, section_key=section_key)
 
         return render_template('sitio/nosotros_section.html', configuracion=configuracion, secciones=secciones, seccion=seccion, section_key=section_key)
     except Exception as e:
         print(f"Error al cargar subpágina Nosotros '{slug}': {e}")
+        skip_page_cache()
         return render_template('sitio/nosotros_section.html', configuracion={}, secciones=[], seccion=None, section_key=slug)
 
 
 @main_bp.route('/educagua-dh2o-educacion-agua-potable-valledupar/')
+@cached_page
 def educagua():
     """Página educativa sobre agua potable - EducAgua DH2O"""
     try:
@@ -351,39 +299,18 @@ def educagua():
         cursor = db.cursor()
         
         # Obtener preguntas activas del quiz ordenadas
-        cursor.execute("SELECT * FROM quiz_preguntas WHERE activo = TRUE ORDER BY orden, id")
-        
-        preguntas_data = cursor.fetchall()
+        cursor.execute_named('quiz.preguntas_activas')
         
-        # Convertir a lista de diccionarios
-        preguntas = []
-        for pregunta in preguntas_data:
-            preguntas.append({
-                    'id': pregunta['id'],
-                    'pregunta': pregunta['pregunta'],
-                    'opcion_a': pregunta['opcion_a'],
-                    'opcion_b': pregunta['opcion_b'],
-                    'opcion_c': pregunta['opcion_c'],
-                    'respuesta_correcta': pregunta['respuesta_correcta'],
-                    'explicacion': pregunta['explicacion'],
-                    'orden': pregunta['orden']
-                })
-        
-        # Obtener configuración de la empresa
-        cursor.execute("SELECT clave, valor FROM configuracion")
-        config_raw = cursor.fetchall()
+        preguntas = cursor.fetchall()
         
-        # Convertir configuración a diccionario
-        configuracion = {}
-        for config in config_raw:
-            clave = config['clave'] if isinstance(config, dict) else config[0]
-            valor = config['valor'] if isinstance(config, dict) else config[1]
-            configuracion[clave] = valor
+        # Configuración de la empresa (instantánea en memoria)
+        configuracion = get_configuracion()
         
         return render_template('sitio/educagua.html', preguntas=preguntas, configuracion=configuracion)
         
     except Exception as e:
         print(f"Error al cargar preguntas del quiz: {e}")
+        skip_page_cache()
         # En caso de error, usar preguntas por defecto
         preguntas_default = [
             {
@@ -456,11 +383,7 @@ def redirect_tiktok():
 def redirect_app():
     """Redirección a la aplicación DH2O"""
     try:
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute("SELECT valor FROM configuracion WHERE clave = 'app_url'")
-        result = cursor.fetchone()
-        app_url = result[0] if result else 'https://app.dh2o.com.co/login/'
+        app_url = get_configuracion().get('app_url') or 'https://app.dh2o.com.co/login/'
         return redirect(app_url, code=301)
     except Exception as e:
         print(f"Error al obtener URL de la app: {e}")
@@ -557,7 +480,7 @@ def cotizar_servicio():
         servicio = cursor.fetchone()
         
         if servicio:
-            precio_base = float(servicio['precio_base'] if isinstance(servicio, dict) else servicio[0])
+            precio_base = float(servicio['precio_base'])
         else:
             # Precios por defecto si no se encuentra en la BD
             precios_base = {
@@ -612,17 +535,8 @@ def chatbot_opciones_rapidas():
                 LIMIT 4
             """)
         
-        opciones = cursor.fetchall()
-        
-        # Convertir a lista de diccionarios
-        opciones_list = []
-        for opcion in opciones:
-            opciones_list.append({
-                'pregunta': opcion['pregunta'] if isinstance(opcion, dict) else opcion[0],
-                'respuesta': opcion['respuesta'] if isinstance(opcion, dict) else opcion[1]
-            })
-        
-        return jsonify(opciones_list)
+        # Las filas se serializan como objetos {pregunta, respuesta} (ver sql_rows.RowJSONProvider)
+        return jsonify(cursor.fetchall())
         
     except Exception as e:
         print(f"Error obteniendo opciones rápidas: {e}")
@@ -650,127 +564,101 @@ def verificar_recaptcha(token):
         print(f"Error verificando reCAPTCHA: {e}")
         return True  # En caso de error, permitir acceso
 
-@main_bp.route('/api/chatbot/mensaje', methods=['POST'])
-def chatbot_mensaje():
-    """Procesar mensaje del chatbot"""
-    try:
-        data = request.get_json()
-        mensaje_usuario = data.get('mensaje', '').strip().lower()
-        session_id = data.get('session_id', '')
-        recaptcha_token = data.get('recaptcha_token', '')
-        
-        if not mensaje_usuario:
+MENSAJE_NO_ENTENDIDO = "Lo siento, no entiendo tu pregunta. 🤔 ¿Podrías reformularla o elegir una de las opciones disponibles%s También puedes contactarnos directamente por WhatsApp."
+
+
+def _mensaje_no_entendido(config):
+    """Mensaje por defecto cuando no hay respuesta"""
+    if config and config['mensaje_no_entendido']:
+        return config['mensaje_no_entendido']
+    return MENSAJE_NO_ENTENDIDO
+
+
+def _validar_mensaje_chatbot(data, mensaje_usuario):
+    """Respuesta de error si el mensaje no es válido (None si se puede procesar)"""
+    if not mensaje_usuario:
+        return jsonify({
+            'success': False,
+            'mensaje': 'Mensaje vacío'
+        }), 400
+    
+    # Verificar reCAPTCHA si está presente
+    recaptcha_token = data.get('recaptcha_token', '')
+    if recaptcha_token:
+        if not verificar_recaptcha(recaptcha_token):
             return jsonify({
                 'success': False,
-                'mensaje': 'Mensaje vacío'
+                'mensaje': 'Verificación de seguridad fallida. Por favor, intenta nuevamente.'
             }), 400
-        
-        # Verificar reCAPTCHA si está presente
-        if recaptcha_token:
-            if not verificar_recaptcha(recaptcha_token):
-                return jsonify({
-                    'success': False,
-                    'mensaje': 'Verificación de seguridad fallida. Por favor, intenta nuevamente.'
-                }), 400
-        
+    return None
+
+
+def _respuesta_local(mensaje_usuario):
+    """Respuesta desde las preguntas del chatbot y configuración activa
+
+    Primero palabra clave literal y después similitud BM25 (ver chatbot_engine.py).
+    """
+    indice = get_chatbot_index()
+    pregunta = indice.buscar(mensaje_usuario)
+    if not pregunta:
+        # Sin palabra clave literal: pregunta más parecida por BM25 si supera el umbral
+        pregunta, _ = indice.buscar_similar(
+            mensaje_usuario, current_app.config.get('CHATBOT_MIN_SCORE', 0.35)
+        )
+    respuesta = pregunta['respuesta'] if pregunta else None
+    return respuesta, indice.config
+
+
+def _usar_gpt(config):
+    return bool(config and config['usar_gpt'] and config['openai_api_key'])
+
+
+def _guardar_conversacion(session_id, mensaje, respuesta):
+    """Registrar la conversación (los errores no afectan a la respuesta)"""
+    try:
         db = get_db()
         cursor = db.cursor()
+        user_agent = request.headers.get('User-Agent', '')
+        ip_usuario = request.remote_addr
         
-        # Buscar respuesta en la base de datos
-        respuesta_encontrada = None
-        pregunta_id = None
-        
-        # Buscar por palabras clave
         cursor.execute("""
-                SELECT id, pregunta, respuesta, palabras_clave 
-                FROM chatbot_preguntas 
-                WHERE activo = TRUE
-            """)
+            INSERT INTO chatbot_conversaciones 
+            (session_id, mensaje_usuario, respuesta_bot, ip_usuario, user_agent)
+            VALUES (%s, %s, %s, %s, %s)
+        """, (session_id, mensaje, respuesta, ip_usuario, user_agent))
         
-        preguntas = cursor.fetchall()
+        db.commit()
+    except Exception as e:
+        print(f"Error guardando conversación: {e}")
+
+
+@main_bp.route('/api/chatbot/mensaje', methods=['POST'])
+def chatbot_mensaje():
+    """Procesar mensaje del chatbot"""
+    try:
+        data = request.get_json()
+        mensaje_usuario = data.get('mensaje', '').strip().lower()
+        session_id = data.get('session_id', '')
         
-        # Buscar coincidencias
-        for pregunta in preguntas:
-            pregunta_id_temp = pregunta['id'] if isinstance(pregunta, dict) else pregunta[0]
-            pregunta_texto = pregunta['pregunta'] if isinstance(pregunta, dict) else pregunta[1]
-            respuesta_texto = pregunta['respuesta'] if isinstance(pregunta, dict) else pregunta[2]
-            palabras_clave = pregunta['palabras_clave'] if isinstance(pregunta, dict) else pregunta[3]
-            
-            # Verificar si alguna palabra clave coincide
-            if palabras_clave:
-                palabras = [p.strip().lower() for p in palabras_clave.split(',')]
-                for palabra in palabras:
-                    if palabra in mensaje_usuario:
-                        respuesta_encontrada = respuesta_texto
-                        pregunta_id = pregunta_id_temp
-                        break
-                
-                if respuesta_encontrada:
-                    break
+        error = _validar_mensaje_chatbot(data, mensaje_usuario)
+        if error:
+            return error
+        
+        # Buscar respuesta en el índice de preguntas del worker
+        respuesta_encontrada, config = _respuesta_local(mensaje_usuario)
         
         # Si no se encontró respuesta, verificar si usar GPT o mensaje por defecto
         if not respuesta_encontrada:
-            # Obtener configuración del chatbot
-            cursor.execute("SELECT mensaje_no_entendido, openai_api_key, usar_gpt FROM chatbot_configuracion WHERE activo = TRUE LIMIT 1")
-            
-            config = cursor.fetchone()
-            
-            # Intentar usar GPT si está habilitado
-            if config and config['usar_gpt'] and config['openai_api_key']:  # usar_gpt y openai_api_key
+            if _usar_gpt(config):
                 try:
-                    client = OpenAI(api_key=config['openai_api_key'])
-                    
-                    # Crear contexto sobre DH2OCOL
-                    contexto = """Eres TanquiBot, el asistente virtual de DH2OCOL, una empresa especializada en:
-- Limpieza y mantenimiento de tanques de agua
-- Venta de tanques elevados y subterráneos
-- Accesorios para tanques de agua
-- Servicios de educación sobre agua potable (EducAgua)
-- Ubicada en Valledupar, Colombia
-
-Responde de manera amigable y profesional. Si la pregunta no está relacionada con nuestros servicios, 
-redirige cortésmente hacia nuestros servicios o sugiere contactar por WhatsApp."""
-                    
-                    response = client.chat.completions.create(
-                        model="gpt-3.5-turbo",
-                        messages=[
-                            {"role": "system", "content": contexto},
-                            {"role": "user", "content": data.get('mensaje', '')}
-                        ],
-                        max_tokens=200,
-                        temperature=0.7
-                    )
-                    
-                    respuesta_encontrada = response.choices[0].message.content
-                    
+                    # Respuesta cacheada si el mensaje (normalizado) ya se respondió
+                    respuesta_encontrada = chatbot_gpt.responder(data.get('mensaje', ''), config['openai_api_key'])
                 except Exception as e:
                     print(f"Error con OpenAI: {e}")
-                    # Si falla GPT, usar mensaje por defecto
-                    if config:
-                        respuesta_encontrada = config['mensaje_no_entendido'] if config['mensaje_no_entendido'] else "Lo siento, no entiendo tu pregunta. 🤔 ¿Podrías reformularla o elegir una de las opciones disponibles%s También puedes contactarnos directamente por WhatsApp."
-                    else:
-                        respuesta_encontrada = "Lo siento, no entiendo tu pregunta. 🤔 ¿Podrías reformularla o elegir una de las opciones disponibles%s También puedes contactarnos directamente por WhatsApp."
-            else:
-                # Usar mensaje por defecto
-                if config:
-                    respuesta_encontrada = config['mensaje_no_entendido'] if config['mensaje_no_entendido'] else "Lo siento, no entiendo tu pregunta. 🤔 ¿Podrías reformularla o elegir una de las opciones disponibles%s También puedes contactarnos directamente por WhatsApp."
-                else:
-                    respuesta_encontrada = "Lo siento, no entiendo tu pregunta. 🤔 ¿Podrías reformularla o elegir una de las opciones disponibles%s También puedes contactarnos directamente por WhatsApp."
+            if not respuesta_encontrada:
+                respuesta_encontrada = _mensaje_no_entendido(config)
         
-        # Guardar conversación
-        try:
-            user_agent = request.headers.get('User-Agent', '')
-            ip_usuario = request.remote_addr
-            
-            cursor.execute("""
-                INSERT INTO chatbot_conversaciones 
-                (session_id, mensaje_usuario, respuesta_bot, ip_usuario, user_agent)
-                VALUES (%s, %s, %s, %s, %s)
-            """, (session_id, data.get('mensaje', ''), respuesta_encontrada, ip_usuario, user_agent))
-            
-            db.commit()
-        except Exception as e:
-            print(f"Error guardando conversación: {e}")
+        _guardar_conversacion(session_id, data.get('mensaje', ''), respuesta_encontrada)
         
         return jsonify({
             'success': True,
@@ -784,6 +672,71 @@ redirige cortésmente hacia nuestros servicios o sugiere contactar por WhatsApp.
             'error': 'Error interno del servidor'
         }), 500
 
+
+def _evento_sse(evento, payload):
+    """Formatear un evento server-sent events"""
+    return f"event: {evento}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+@main_bp.route('/api/chatbot/mensaje/stream', methods=['POST'])
+def chatbot_mensaje_stream():
+    """Procesar mensaje del chatbot enviando la respuesta por server-sent events
+
+    Las respuestas locales o cacheadas se envían en un único evento; las de GPT
+    se reenvían fragmento a fragmento mientras la llamada a la API corre en un
+    hilo aparte (ver chatbot_gpt.stream_respuesta).
+    """
+    try:
+        data = request.get_json()
+        mensaje_usuario = data.get('mensaje', '').strip().lower()
+        session_id = data.get('session_id', '')
+        
+        error = _validar_mensaje_chatbot(data, mensaje_usuario)
+        if error:
+            return error
+        
+        respuesta_local, config = _respuesta_local(mensaje_usuario)
+    except Exception as e:
+        print(f"Error procesando mensaje del chatbot: {e}")
+        return jsonify({
+            'success': False,
+            'error': 'Error interno del servidor'
+        }), 500
+    
+    mensaje_original = data.get('mensaje', '')
+    
+    @stream_with_context
+    def generar():
+        respuesta = respuesta_local
+        if not respuesta and _usar_gpt(config):
+            respuesta = chatbot_gpt.buscar_en_cache(mensaje_original)
+            if not respuesta:
+                fragmentos = []
+                try:
+                    for fragmento in chatbot_gpt.stream_respuesta(mensaje_original, config['openai_api_key']):
+                        fragmentos.append(fragmento)
+                        yield _evento_sse('delta', {'texto': fragmento})
+                    respuesta = ''.join(fragmentos)
+                    if respuesta:
+                        chatbot_gpt.guardar_en_cache(mensaje_original, respuesta)
+                except Exception as e:
+                    print(f"Error con OpenAI (stream): {e}")
+                    respuesta = ''.join(fragmentos)
+                if fragmentos:
+                    _guardar_conversacion(session_id, mensaje_original, respuesta)
+                    yield _evento_sse('done', {'respuesta': respuesta})
+                    return
+        if not respuesta:
+            respuesta = _mensaje_no_entendido(config)
+        yield _evento_sse('delta', {'texto': respuesta})
+        _guardar_conversacion(session_id, mensaje_original, respuesta)
+        yield _evento_sse('done', {'respuesta': respuesta})
+    
+    return Response(generar(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @main_bp.route('/politica-tratamiento-datos')
 def politica_tratamiento_datos():
     """Servir el PDF de Política de Tratamiento de Datos"""
@@ -812,57 +765,42 @@ def politica_tratamiento_datos():
 # === Páginas de Políticas ===
 
 @main_bp.route('/terminos-de-uso')
+@cached_page
 def terminos_uso():
     """Página de Términos de Uso"""
     try:
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute("SELECT clave, valor FROM configuracion")
-        config_raw = cursor.fetchall()
-        configuracion = {}
-        for config in config_raw:
-            clave = config['clave'] if isinstance(config, dict) else config[0]
-            valor = config['valor'] if isinstance(config, dict) else config[1]
-            configuracion[clave] = valor
+        # Configuración de la empresa (instantánea en memoria)
+        configuracion = get_configuracion()
         return render_template('sitio/terminos_uso.html', configuracion=configuracion)
     except Exception as e:
         print(f"Error al cargar Términos de Uso: {e}")
+        skip_page_cache()
         return render_template('sitio/terminos_uso.html', configuracion={})
 
 @main_bp.route('/politicas-de-privacidad')
+@cached_page
 def politicas_privacidad():
     """Página de Políticas de Privacidad"""
     try:
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute("SELECT clave, valor FROM configuracion")
-        config_raw = cursor.fetchall()
-        configuracion = {}
-        for config in config_raw:
-            clave = config['clave'] if isinstance(config, dict) else config[0]
-            valor = config['valor'] if isinstance(config, dict) else config[1]
-            configuracion[clave] = valor
+        # Configuración de la empresa (instantánea en memoria)
+        configuracion = get_configuracion()
         return render_template('sitio/politicas_privacidad.html', configuracion=configuracion)
     except Exception as e:
         print(f"Error al cargar Políticas de Privacidad: {e}")
+        skip_page_cache()
         return render_template('sitio/politicas_privacidad.html', configuracion={})
 
 @main_bp.route('/politicas-de-cookies')
+@cached_page
 def politicas_cookies():
     """Página de Políticas de Cookies"""
     try:
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute("SELECT clave, valor FROM configuracion")
-        config_raw = cursor.fetchall()
-        configuracion = {}
-        for config in config_raw:
-            clave = config['clave'] if isinstance(config, dict) else config[0]
-            valor = config['valor'] if isinstance(config, dict) else config[1]
-            configuracion[clave] = valor
+        # Configuración de la empresa (instantánea en memoria)
+        configuracion = get_configuracion()
         return render_template('sitio/politicas_cookies.html', configuracion=configuracion)
     except Exception as e:
         print(f"Error al cargar Políticas de Cookies: {e}")
+        skip_page_cache()
         return render_template('sitio/politicas_cookies.html', configuracion={})
 
 # ============================
@@ -873,16 +811,8 @@ def politicas_cookies():
 def quote_params():
     """Obtener parámetros de precios desde configuración para permitir ajuste en Admin"""
     try:
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute("SELECT clave, valor FROM configuracion WHERE clave LIKE 'quote_%'")
-        rows = cursor.fetchall()
-        params = {}
-        for row in rows:
-            if isinstance(row, dict):
-                params[row['clave']] = row['valor']
-            else:
-                params[row[0]] = row[1]
+        # Los parámetros viven en configuracion con prefijo quote_ (misma instantánea en memoria)
+        params = {clave: valor for clave, valor in get_configuracion().items() if clave.startswith('quote_')}
         return jsonify({ 'success': True, 'params': params })
     except Exception as e:
         print(f"Error obteniendo parámetros de cotización: {e}")
@@ -899,19 +829,34 @@ def quote_upload():
             return jsonify({ 'success': True, 'urls': [] })
         # Usar carpeta de destino (por defecto 'cotizaciones')
         folder = request.form.get('folder') or 'cotizaciones'
-        urls = []
-        for f in files:
-            url = upload_file(f, folder=folder, optimize_image=True)
-            if url:
-                urls.append(url)
-        return jsonify({ 'success': True, 'urls': urls })
+        # Recordar los bytes subidos: el correo de la cotización los adjunta sin volver a descargarlos
+        cache_bytes = current_app.config.get('QUOTE_UPLOAD_CACHE_BYTES', 32 * 1024 * 1024)
+
+        def recordar(url, data, content_type):
+            recordar_subida(url, data, content_type, max_bytes=cache_bytes)
+
+        # Optimización en paralelo (procesos) y subida en paralelo (hilos); ver upload_pipeline.py
+        config = current_app.config
+        resultados = subir_archivos(
+            files, folder=folder, optimize_image=True,
+            deadline_seconds=config.get('QUOTE_UPLOAD_DEADLINE', 25),
+            cpu_workers=config.get('IMAGE_PROCESS_WORKERS', 2),
+            io_workers=config.get('STORAGE_IO_WORKERS', 4),
+            on_upload=recordar
+        )
+        urls = [r['url'] for r in resultados if r['url']]
+        errors = [
+            { 'index': i, 'filename': r['filename'], 'error': r['error'] }
+            for i, r in enumerate(resultados) if r['error']
+        ]
+        return jsonify({ 'success': True, 'urls': urls, 'errors': errors })
     except Exception as e:
         print(f"Error subiendo imágenes de cotización: {e}")
         return jsonify({ 'success': False, 'message': 'Error al subir imágenes' }), 500
 
 @main_bp.route('/api/quote/delete', methods=['POST'])
 def quote_delete():
-    """Eliminar una imagen subida a Firebase (por URL pública)"""
+    """Descartar una imagen de la cotización (por URL pública) sin borrar el blob compartido"""
     try:
         if not is_firebase_available():
             return jsonify({ 'success': False, 'message': 'Firebase no disponible' }), 503
@@ -919,8 +864,12 @@ def quote_delete():
         url = data.get('url') or ''
         if not url:
             return jsonify({ 'success': False, 'message': 'URL requerida' }), 400
-        ok = delete_file(url)
-        return jsonify({ 'success': bool(ok) })
+        # Las imágenes de cotización se nombran por contenido: la misma foto subida
+        # por otro visitante (o pendiente de envío en email_outbox) tiene la misma
+        # URL y ningún registro la referencia, así que no se borra el blob. Las
+        # huérfanas de cotizaciones/ las elimina la regla de ciclo de vida del bucket.
+        olvidar_subida(url)
+        return jsonify({ 'success': True })
     except Exception as e:
         print(f"Error eliminando imagen de cotización: {e}")
         return jsonify({ 'success': False, 'message': 'Error al eliminar imagen' }), 500
@@ -1065,24 +1014,9 @@ def quote_email():
         )
         msg.body = resumen_texto
 
-        # Adjuntar imágenes descargándolas desde las URLs (si existen)
-        for u in image_urls:
-            try:
-                r = requests.get(u, timeout=10)
-                if r.status_code == 200:
-                    # Inferir nombre
-                    nombre = u.split('/')[-1].split('?')[0]
-                    content_type = r.headers.get('Content-Type', 'image/jpeg')
-                    msg.attach(filename=nombre, content_type=content_type, data=r.content)
-            except Exception as e:
-                print(f"No se pudo adjuntar imagen {u}: {e}")
-
-        # Enviar usando la extensión registrada para evitar importaciones circulares
-        mail_ext = current_app.extensions.get('mail')
-        if not mail_ext:
-            raise RuntimeError('Extensión de mail no inicializada')
-        mail_ext.send(msg)
+        # Encolar: el hilo de envío descarga y adjunta las imágenes de las URLs
+        email_outbox.enqueue(msg, adjuntos_urls=image_urls, tipo='cotizacion')
         return jsonify({ 'success': True })
     except Exception as e:
-        print(f"Error enviando correo de cotización: {e}")
+        print(f"Error encolando correo de cotización: {e}")
         return jsonify({ 'success': False, 'message': 'Error al enviar correo' }), 500
\ No newline at end of file
@@ -0,0 +1,388 @@
+"""
+Utilidades de caché en memoria para DH2OCOL
+Cada worker de Gunicorn mantiene su propia copia; la invalidación entre
+workers se coordina con sellos de versión guardados en la base de datos
+(tabla cache_versiones).
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import current_app, g, request, session
+
+# Claves de versión conocidas
+VERSION_CONFIGURACION = 'configuracion'
+VERSION_CONTENIDO = 'contenido'
+VERSION_CHATBOT = 'chatbot'
+
+_lock = threading.Lock()
+_versions_state = {'versions': {}, 'checked_at': None}
+_config_state = {'data': None, 'version': None, 'loaded_at': 0.0}
+_page_cache = OrderedDict()
+_snapshots = {}
+_snapshot_locks = {}
+_tables_ready = set()
+
+
+def _db_type():
+    return current_app.config.get('DATABASE_TYPE', 'mysql').lower()
+
+
+def ensure_version_table(cursor):
+    """Crear la tabla de sellos de versión si no existe (una vez por proceso)"""
+    db_type = _db_type()
+    if db_type in _tables_ready:
+        return
+    if db_type == 'sqlite':
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache_versiones (
+                clave VARCHAR(50) PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0,
+                actualizado DATETIME
+            )
+            """
+        )
+    else:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache_versiones (
+                clave VARCHAR(50) PRIMARY KEY,
+                version BIGINT NOT NULL DEFAULT 0,
+                actualizado DATETIME NULL
+            )
+            """
+        )
+    _tables_ready.add(db_type)
+
+
+def ensure_snapshot_table(cursor):
+    """Crear la tabla de instantáneas compartidas si no existe (una vez por proceso)"""
+    db_type = _db_type()
+    if ('cache_snapshots', db_type) in _tables_ready:
+        return
+    if db_type == 'sqlite':
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache_snapshots (
+                clave VARCHAR(50) PRIMARY KEY,
+                payload TEXT,
+                generado DATETIME,
+                lease_until DATETIME
+            )
+            """
+        )
+    else:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache_snapshots (
+                clave VARCHAR(50) PRIMARY KEY,
+                payload MEDIUMTEXT NULL,
+                generado DATETIME NULL,
+                lease_until DATETIME NULL
+            )
+            """
+        )
+    _tables_ready.add(('cache_snapshots', db_type))
+
+
+def get_versions(force=False):
+    """Obtener los sellos de versión {clave: (version, actualizado)}
+
+    Se consultan en la base de datos como mucho cada CACHE_VERSION_CHECK_SECONDS;
+    entre tanto se sirven desde memoria sin tocar la base de datos.
+    """
+    interval = current_app.config.get('CACHE_VERSION_CHECK_SECONDS', 5)
+    now = time.monotonic()
+    checked_at = _versions_state['checked_at']
+    if not force and checked_at is not None and now - checked_at < interval:
+        return _versions_state['versions']
+
+    try:
+        cursor = current_app.get_db().cursor()
+        ensure_version_table(cursor)
+        cursor.execute("SELECT clave, version, actualizado FROM cache_versiones")
+        versions = {
+            row['clave']: (row['version'], row['actualizado'])
+            for row in cursor.fetchall()
+        }
+    except Exception as e:
+        print(f"Error leyendo versiones de caché: {e}")
+        # Conservar las versiones conocidas y reintentar en el próximo intervalo
+        versions = _versions_state['versions']
+
+    with _lock:
+        _versions_state['versions'] = versions
+        _versions_state['checked_at'] = now
+    return versions
+
+
+def get_version(clave):
+    """Versión actual de una clave (0 si nunca se ha modificado)"""
+    return get_versions().get(clave, (0, None))[0]
+
+
+def bump_version(db, clave, commit=False):
+    """Incrementar el sello de versión de una clave para invalidar todos los workers
+
+    Se ejecuta con la conexión de la petición, normalmente antes del commit
+    de la escritura que provoca la invalidación.
+    """
+    cursor = db.cursor()
+    ensure_version_table(cursor)
+    now = datetime.now()
+    cursor.execute(
+        "UPDATE cache_versiones SET version = version + 1, actualizado = %s WHERE clave = %s",
+        (now, clave)
+    )
+    if not cursor.rowcount:
+        try:
+            cursor.execute(
+                "INSERT INTO cache_versiones (clave, version, actualizado) VALUES (%s, %s, %s)",
+                (clave, 1, now)
+            )
+        except Exception:
+            # Otro worker insertó la fila en paralelo: basta con incrementarla
+            cursor.execute(
+                "UPDATE cache_versiones SET version = version + 1, actualizado = %s WHERE clave = %s",
+                (now, clave)
+            )
+    if commit:
+        db.commit()
+
+    # Este worker no espera al siguiente intervalo para ver el cambio
+    with _lock:
+        _versions_state['checked_at'] = None
+
+
+def _load_configuracion():
+    cursor = current_app.get_db().cursor()
+    cursor.execute("SELECT clave, valor FROM configuracion")
+    return {row['clave']: row['valor'] for row in cursor.fetchall()}
+
+
+def get_configuracion():
+    """Instantánea de la tabla configuracion como diccionario {clave: valor}
+
+    Se recarga cuando cambia su sello de versión o expira CONFIG_CACHE_TTL.
+    El diccionario es compartido: tratarlo como solo lectura.
+    """
+    version = get_version(VERSION_CONFIGURACION)
+    ttl = current_app.config.get('CONFIG_CACHE_TTL', 300)
+    now = time.monotonic()
+
+    data = _config_state['data']
+    if data is not None and _config_state['version'] == version and now - _config_state['loaded_at'] < ttl:
+        return data
+
+    try:
+        data = _load_configuracion()
+    except Exception as e:
+        if _config_state['data'] is None:
+            raise
+        print(f"Error recargando configuración, se usa la copia en memoria: {e}")
+        return _config_state['data']
+
+    with _lock:
+        _config_state['data'] = data
+        _config_state['version'] = version
+        _config_state['loaded_at'] = now
+    return data
+
+
+def invalidate_configuracion(db, commit=False):
+    """Invalidar la configuración en memoria de todos los workers"""
+    with _lock:
+        _config_state['data'] = None
+    bump_version(db, VERSION_CONFIGURACION, commit=commit)
+
+
+# =====================
+# Caché de páginas públicas renderizadas
+# =====================
+
+def _as_datetime(value):
+    """Normalizar la marca de tiempo de una versión (SQLite la devuelve como texto)"""
+    if isinstance(value, datetime):
+        return value
+    if value:
+        try:
+            return datetime.fromisoformat(str(value))
+        except ValueError:
+            return None
+    return None
+
+
+def skip_page_cache():
+    """Marcar la respuesta actual como no cacheable (p. ej. página de respaldo por error)"""
+    g.page_cache_skip = True
+
+
+def invalidate_contenido(db, commit=False):
+    """Invalidar las páginas públicas cacheadas en todos los workers"""
+    bump_version(db, VERSION_CONTENIDO, commit=commit)
+
+
+def _page_response(entry):
+    """Construir la respuesta desde una entrada de caché, atendiendo peticiones condicionales"""
+    response = current_app.response_class(entry['body'], mimetype=entry['mimetype'])
+    response.set_etag(entry['etag'])
+    if entry['last_modified']:
+        response.last_modified = entry['last_modified']
+    response.headers['Cache-Control'] = 'public, max-age=0, must-revalidate'
+    return response.make_conditional(request)
+
+
+def cached_page(view):
+    """Cachear el HTML renderizado de una página pública
+
+    La clave incluye la ruta y las versiones de contenido y configuración, de modo
+    que cualquier modificación desde el admin invalida las páginas en todos los
+    workers. Las visitas repetidas no tocan la base de datos ni Jinja, y responden
+    304 cuando el navegador ya tiene la misma versión (ETag / Last-Modified).
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        config = current_app.config
+        # Los mensajes flash dependen de la sesión del visitante: no cachear
+        if not config.get('PAGE_CACHE_ENABLED', True) or request.method != 'GET' or session.get('_flashes'):
+            return view(*args, **kwargs)
+
+        versions = get_versions()
+        contenido_version, contenido_ts = versions.get(VERSION_CONTENIDO, (0, None))
+        config_version, config_ts = versions.get(VERSION_CONFIGURACION, (0, None))
+        stamp = (contenido_version, config_version)
+        key = request.full_path
+        now = time.monotonic()
+
+        with _lock:
+            entry = _page_cache.get(key)
+            if entry is not None:
+                if entry['stamp'] == stamp and now - entry['stored_at'] < config.get('PAGE_CACHE_TTL', 3600):
+                    _page_cache.move_to_end(key)
+                else:
+                    entry = None
+        if entry is not None:
+            return _page_response(entry)
+
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code != 200 or response.mimetype != 'text/html' or g.get('page_cache_skip'):
+            return response
+
+        body = response.get_data()
+        timestamps = [ts for ts in (_as_datetime(contenido_ts), _as_datetime(config_ts)) if ts]
+        entry = {
+            'body': body,
+            'mimetype': response.mimetype,
+            'etag': hashlib.sha1(body).hexdigest(),
+            'last_modified': max(timestamps) if timestamps else datetime.now(),
+            'stamp': stamp,
+            'stored_at': now,
+        }
+        with _lock:
+            _page_cache[key] = entry
+            _page_cache.move_to_end(key)
+            while len(_page_cache) > config.get('PAGE_CACHE_MAX_ENTRIES', 256):
+                _page_cache.popitem(last=False)
+        return _page_response(entry)
+
+    return wrapper
+
+
+# =====================
+# Instantáneas compartidas con recálculo único (single-flight)
+# =====================
+
+def _snapshot_entry(payload, generated_at, ttl):
+    body = json.dumps(payload, sort_keys=True, default=str)
+    generated_at = _as_datetime(generated_at) or datetime.now()
+    # La copia local caduca según la edad real de la instantánea (como mucho se
+    # reintenta una vez por segundo si otro worker tiene el recálculo en curso)
+    age = max((datetime.now() - generated_at).total_seconds(), 0)
+    return {
+        'payload': payload,
+        'generated_at': generated_at,
+        'etag': hashlib.sha1(body.encode('utf-8')).hexdigest(),
+        'loaded_at': time.monotonic() - min(age, max(ttl - 1, 0)),
+    }
+
+
+def _refresh_snapshot(clave, compute, ttl):
+    """Obtener la instantánea de la base de datos o recalcularla si nadie lo está haciendo
+
+    Solo el worker que consigue el "lease" de la fila recalcula; los demás
+    devuelven la última instantánea guardada aunque esté vencida.
+    """
+    db = current_app.get_db()
+    cursor = db.cursor()
+    try:
+        ensure_snapshot_table(cursor)
+        cursor.execute("SELECT payload, generado FROM cache_snapshots WHERE clave = %s", (clave,))
+        row = cursor.fetchone()
+        now = datetime.now()
+        stored = None
+        if row and row['payload']:
+            stored = _snapshot_entry(json.loads(row['payload']), row['generado'], ttl)
+            if (now - stored['generated_at']).total_seconds() < ttl:
+                return stored
+
+        insert_ignore = 'INSERT OR IGNORE' if _db_type() == 'sqlite' else 'INSERT IGNORE'
+        cursor.execute(f"{insert_ignore} INTO cache_snapshots (clave) VALUES (%s)", (clave,))
+        lease = current_app.config.get('SNAPSHOT_LEASE_SECONDS', 30)
+        cursor.execute(
+            "UPDATE cache_snapshots SET lease_until = %s "
+            "WHERE clave = %s AND (lease_until IS NULL OR lease_until < %s)",
+            (now + timedelta(seconds=lease), clave, now)
+        )
+        claimed = cursor.rowcount == 1
+        db.commit()
+        if not claimed and stored is not None:
+            return stored
+
+        payload = compute()
+        generated_at = datetime.now()
+        cursor.execute(
+            "UPDATE cache_snapshots SET payload = %s, generado = %s, lease_until = NULL WHERE clave = %s",
+            (json.dumps(payload, default=str), generated_at, clave)
+        )
+        db.commit()
+        return _snapshot_entry(payload, generated_at, ttl)
+    finally:
+        cursor.close()
+
+
+def shared_snapshot(clave, compute, ttl):
+    """Resultado compartido por todos los clientes y workers durante ttl segundos
+
+    Devuelve un diccionario con payload, generated_at y etag. Dentro del worker
+    solo un hilo refresca a la vez (el resto sirve la copia anterior); entre
+    workers se coordina con la tabla cache_snapshots.
+    """
+    entry = _snapshots.get(clave)
+    if entry is not None and time.monotonic() - entry['loaded_at'] < ttl:
+        return entry
+
+    with _lock:
+        refresh_lock = _snapshot_locks.setdefault(clave, threading.Lock())
+    # Si ya hay copia y otro hilo está refrescando, no esperar: servir la anterior
+    if not refresh_lock.acquire(blocking=entry is None):
+        return entry
+    try:
+        entry = _snapshots.get(clave)
+        if entry is not None and time.monotonic() - entry['loaded_at'] < ttl:
+            return entry
+        try:
+            entry = _refresh_snapshot(clave, compute, ttl)
+        except Exception as e:
+            if entry is None:
+                raise
+            print(f"Error refrescando instantánea '{clave}', se sirve la anterior: {e}")
+            return entry
+        _snapshots[clave] = entry
+        return entry
+    finally:
+        refresh_lock.release()
@@ -0,0 +1,316 @@
+"""
+Motor de coincidencias del chatbot TanquiBot
+
+Las palabras clave de chatbot_preguntas se compilan una sola vez por worker en
+un autómata Aho-Corasick sobre texto normalizado (minúsculas y sin tildes). Cada
+mensaje se recorre una única vez, sin depender del número de preguntas ni de
+palabras clave.
+
+Si ninguna palabra clave aparece literalmente, un índice BM25 (con raíces y
+palabras vacías del español) ordena las preguntas por similitud con el mensaje
+y se responde localmente cuando la confianza supera CHATBOT_MIN_SCORE; solo por
+debajo de ese umbral se recurre a GPT.
+
+El índice se reconstruye solo cuando el admin modifica las preguntas o la
+configuración del chatbot (sello de versión 'chatbot').
+"""
+
+import math
+import re
+import threading
+import unicodedata
+from collections import deque
+
+from flask import current_app
+
+from cache_utils import VERSION_CHATBOT, bump_version, get_version
+
+_lock = threading.Lock()
+_state = {'index': None, 'version': None}
+
+
+def normalizar(texto):
+    """Minúsculas y sin tildes/diacríticos ("Tanqué" -> "tanque")"""
+    if not texto:
+        return ''
+    descompuesto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+class AhoCorasick:
+    """Autómata de búsqueda simultánea de varias palabras en un texto
+
+    Cada palabra lleva un rango (posición de su pregunta en la tabla); la
+    búsqueda devuelve el menor rango encontrado, es decir, la primera pregunta
+    que coincide, igual que el recorrido secuencial original.
+    """
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.best = [None]
+
+    def add(self, palabra, rango):
+        nodo = 0
+        for caracter in palabra:
+            siguiente = self.goto[nodo].get(caracter)
+            if siguiente is None:
+                siguiente = len(self.goto)
+                self.goto[nodo][caracter] = siguiente
+                self.goto.append({})
+                self.fail.append(0)
+                self.best.append(None)
+            nodo = siguiente
+        if self.best[nodo] is None or rango < self.best[nodo]:
+            self.best[nodo] = rango
+
+    def build(self):
+        """Calcular enlaces de fallo y propagar el mejor rango por ellos"""
+        cola = deque(self.goto[0].values())
+        while cola:
+            nodo = cola.popleft()
+            for caracter, hijo in self.goto[nodo].items():
+                cola.append(hijo)
+                fallo = self.fail[nodo]
+                while fallo and caracter not in self.goto[fallo]:
+                    fallo = self.fail[fallo]
+                self.fail[hijo] = self.goto[fallo].get(caracter, 0)
+                heredado = self.best[self.fail[hijo]]
+                if heredado is not None and (self.best[hijo] is None or heredado < self.best[hijo]):
+                    self.best[hijo] = heredado
+
+    def search(self, texto):
+        """Menor rango de todas las palabras contenidas en el texto (None si ninguna)"""
+        goto, fail, best = self.goto, self.fail, self.best
+        nodo = 0
+        encontrado = None
+        for caracter in texto:
+            while nodo and caracter not in goto[nodo]:
+                nodo = fail[nodo]
+            nodo = goto[nodo].get(caracter, 0)
+            rango = best[nodo]
+            if rango is not None and (encontrado is None or rango < encontrado):
+                encontrado = rango
+                if encontrado == 0:
+                    break
+        return encontrado
+
+
+# =====================
+# Recuperación por similitud (BM25)
+# =====================
+
+STOPWORDS = frozenset(normalizar(p) for p in """
+a al algo algun alguna algunas alguno algunos ante antes aqui asi aun bien cada como con
+contra cual cuales cuando de del desde donde dos el ella ellas ello ellos en entre era eran
+es esa esas ese eso esos esta estan estar estas este esto estos fue fueron ha han hasta hay
+hola la las le les lo los mas me mi mis mucho muy nada ni no nos nosotros o os otra otro
+para pero poco por porque puede pueden puedo que quien se sea ser si sin sobre son su sus
+tambien te tengo tiene tienen todo todos tu tus un una unas uno unos usted ustedes vosotros
+y ya yo quiero quisiera saber favor gracias buenas buenos dias tardes noches
+""".split())
+
+_TOKEN_RE = re.compile(r"[a-z0-9ñ]+")
+
+# Sufijos ordenados de más largo a más corto (variante ligera del stemmer español)
+_SUFIJOS = (
+    'amientos', 'imientos', 'amiento', 'imiento', 'aciones', 'uciones', 'adoras', 'adores',
+    'ancias', 'encias', 'mente', 'acion', 'ucion', 'adora', 'ador', 'ancia', 'encia',
+    'ables', 'ibles', 'able', 'ible', 'istas', 'ista', 'osos', 'osas', 'oso', 'osa',
+    'ando', 'iendo', 'aron', 'ieron', 'ados', 'idos', 'adas', 'idas', 'ado', 'ido', 'ada', 'ida',
+    'amos', 'emos', 'imos', 'ar', 'er', 'ir', 'an', 'en', 'es', 'os', 'as', 's', 'a', 'o', 'e',
+)
+
+
+def raiz(palabra):
+    """Raíz aproximada de una palabra ya normalizada ("limpiezas" -> "limpiez")"""
+    for sufijo in _SUFIJOS:
+        if palabra.endswith(sufijo) and len(palabra) - len(sufijo) >= 3:
+            return palabra[:-len(sufijo)]
+    return palabra
+
+
+def tokenizar(texto):
+    """Raíces de las palabras significativas de un texto"""
+    return [
+        raiz(token)
+        for token in _TOKEN_RE.findall(normalizar(texto))
+        if token not in STOPWORDS and len(token) > 1
+    ]
+
+
+class BM25Index:
+    """Índice BM25 con listas de postings precalculadas
+
+    Cada posting guarda ya el peso final idf * tf * (k1 + 1) / (tf + k1 * norm),
+    así puntuar un mensaje es sumar los pesos de sus términos: el coste depende
+    de los postings consultados, no del número total de preguntas.
+    """
+
+    def __init__(self, documentos, k1=1.5, b=0.75):
+        self.total = len(documentos)
+        longitudes = [len(doc) for doc in documentos]
+        media = (sum(longitudes) / self.total) if self.total else 0.0
+
+        frecuencias = {}
+        for doc_id, doc in enumerate(documentos):
+            conteo = {}
+            for termino in doc:
+                conteo[termino] = conteo.get(termino, 0) + 1
+            for termino, tf in conteo.items():
+                frecuencias.setdefault(termino, []).append((doc_id, tf))
+
+        self.idf = {}
+        self.postings = {}
+        for termino, docs in frecuencias.items():
+            idf = self._idf(len(docs))
+            self.idf[termino] = idf
+            self.postings[termino] = [
+                (doc_id, idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * longitudes[doc_id] / (media or 1))))
+                for doc_id, tf in docs
+            ]
+        self.k1 = k1
+
+    def _idf(self, df):
+        return math.log(1 + (self.total - df + 0.5) / (df + 0.5))
+
+    def buscar(self, terminos):
+        """Mejor documento y confianza en [0, 1)
+
+        La confianza divide la puntuación entre el máximo alcanzable por los
+        términos del mensaje (cada uno aportando idf * (k1 + 1)), de modo que el
+        umbral no depende del tamaño del índice ni de la longitud del mensaje.
+        """
+        if not terminos or not self.total:
+            return None, 0.0
+        puntuaciones = {}
+        maximo = 0.0
+        for termino in set(terminos):
+            maximo += self.idf.get(termino, self._idf(0)) * (self.k1 + 1)
+            for doc_id, peso in self.postings.get(termino, ()):
+                puntuaciones[doc_id] = puntuaciones.get(doc_id, 0.0) + peso
+        if not puntuaciones:
+            return None, 0.0
+        doc_id = max(puntuaciones, key=lambda d: (puntuaciones[d], -d))
+        return doc_id, puntuaciones[doc_id] / maximo
+
+
+class ChatbotIndex:
+    """Índice inmutable de preguntas activas y configuración del chatbot"""
+
+    def __init__(self, preguntas, config=None):
+        self.preguntas = preguntas
+        self.config = config
+        self.automata = AhoCorasick()
+        for rango, pregunta in enumerate(preguntas):
+            for palabra in (pregunta.get('palabras_clave') or '').split(','):
+                palabra = normalizar(palabra.strip())
+                if palabra:
+                    self.automata.add(palabra, rango)
+        self.automata.build()
+        # Pregunta y palabras clave pesan el doble que la respuesta
+        self.bm25 = BM25Index([
+            tokenizar(pregunta.get('pregunta')) * 2
+            + tokenizar((pregunta.get('palabras_clave') or '').replace(',', ' ')) * 2
+            + tokenizar(pregunta.get('respuesta'))
+            for pregunta in preguntas
+        ])
+
+    def buscar(self, mensaje):
+        """Primera pregunta (en orden de la tabla) con alguna palabra clave en el mensaje"""
+        rango = self.automata.search(normalizar(mensaje))
+        if rango is None:
+            return None
+        return self.preguntas[rango]
+
+    def buscar_similar(self, mensaje, min_score):
+        """Pregunta más parecida según BM25 si su confianza alcanza min_score"""
+        doc_id, confianza = self.bm25.buscar(tokenizar(mensaje))
+        if doc_id is None or confianza < min_score:
+            return None, confianza
+        return self.preguntas[doc_id], confianza
+
+
+def _cargar_indice():
+    cursor = current_app.get_db().cursor()
+    try:
+        cursor.execute("""
+                SELECT id, pregunta, respuesta, palabras_clave
+                FROM chatbot_preguntas
+                WHERE activo = TRUE
+                ORDER BY id
+            """)
+        preguntas = [dict(row) for row in cursor.fetchall()]
+        cursor.execute("SELECT mensaje_no_entendido, openai_api_key, usar_gpt FROM chatbot_configuracion WHERE activo = TRUE LIMIT 1")
+        config = cursor.fetchone()
+    finally:
+        cursor.close()
+    return ChatbotIndex(preguntas, dict(config) if config else None)
+
+
+def get_index():
+    """Índice del worker, reconstruido si cambió el sello de versión 'chatbot'"""
+    version = get_version(VERSION_CHATBOT)
+    index = _state['index']
+    if index is not None and _state['version'] == version:
+        return index
+    with _lock:
+        if _state['index'] is not None and _state['version'] == version:
+            return _state['index']
+        index = _cargar_indice()
+        _state['index'] = index
+        _state['version'] = version
+    return index
+
+
+def invalidate_chatbot(db, commit=False):
+    """Forzar la reconstrucción del índice en todos los workers"""
+    with _lock:
+        _state['index'] = None
+    bump_version(db, VERSION_CHATBOT, commit=commit)
+
+
+if __name__ == '__main__':
+    # Microbenchmark: recorrido secuencial original vs autómata con 10k preguntas
+    import random
+    import time
+
+    random.seed(7)
+    vocabulario = ['tanque', 'limpieza', 'precio', 'cotizacion', 'agua', 'valledupar',
+                   'mantenimiento', 'accesorio', 'flotador', 'tapa', 'educagua', 'horario']
+    preguntas = []
+    for i in range(10000):
+        palabras = [f"{random.choice(vocabulario)}{i}", f"clave{i}", f"termino {i}"]
+        preguntas.append({'id': i + 1, 'respuesta': f"respuesta {i}", 'palabras_clave': ', '.join(palabras)})
+    mensajes = [f"hola, quisiera saber sobre clave{random.randrange(10000)} por favor" for _ in range(200)]
+    mensajes += ["un mensaje que no coincide con ninguna pregunta registrada"] * 50
+
+    def recorrido_original(mensaje):
+        for pregunta in preguntas:
+            for palabra in [p.strip().lower() for p in pregunta['palabras_clave'].split(',')]:
+                if palabra in mensaje:
+                    return pregunta
+        return None
+
+    inicio = time.perf_counter()
+    indice = ChatbotIndex(preguntas)
+    construccion = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    esperado = [recorrido_original(m.lower()) for m in mensajes]
+    t_original = (time.perf_counter() - inicio) / len(mensajes)
+
+    inicio = time.perf_counter()
+    obtenido = [indice.buscar(m) for m in mensajes]
+    t_indice = (time.perf_counter() - inicio) / len(mensajes)
+
+    inicio = time.perf_counter()
+    for m in mensajes:
+        indice.buscar_similar(m, 0.35)
+    t_bm25 = (time.perf_counter() - inicio) / len(mensajes)
+
+    assert [p and p['id'] for p in esperado] == [p and p['id'] for p in obtenido]
+    print(f"Construcción del índice: {construccion * 1000:.1f} ms")
+    print(f"Recorrido original: {t_original * 1000:.3f} ms/mensaje")
+    print(f"Aho-Corasick:       {t_indice * 1000:.3f} ms/mensaje ({t_original / t_indice:.0f}x)")
+    print(f"BM25 (similitud):   {t_bm25 * 1000:.3f} ms/mensaje")
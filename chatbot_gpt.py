@@ -0,0 +1,270 @@
+"""
+Respuestas de GPT para TanquiBot con caché
+
+Las respuestas se guardan en una caché LRU con caducidad (TTL) por worker,
+indexada por el mensaje normalizado (minúsculas, sin tildes ni puntuación), y
+opcionalmente en la tabla chatbot_gpt_cache para compartirlas entre workers y
+reinicios. El cliente de OpenAI se crea una vez por proceso con un timeout
+explícito en lugar de uno nuevo por mensaje.
+"""
+
+import hashlib
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from openai import OpenAI
+
+from chatbot_engine import normalizar
+
+CONTEXTO = """Eres TanquiBot, el asistente virtual de DH2OCOL, una empresa especializada en:
+- Limpieza y mantenimiento de tanques de agua
+- Venta de tanques elevados y subterráneos
+- Accesorios para tanques de agua
+- Servicios de educación sobre agua potable (EducAgua)
+- Ubicada en Valledupar, Colombia
+
+Responde de manera amigable y profesional. Si la pregunta no está relacionada con nuestros servicios,
+redirige cortésmente hacia nuestros servicios o sugiere contactar por WhatsApp."""
+
+_NO_ALFANUMERICO = re.compile(r"[^a-z0-9ñ]+")
+
+_lock = threading.Lock()
+_cache = OrderedDict()
+_clients = {}
+_tables_ready = set()
+_counters = {'hits': 0, 'db_hits': 0, 'misses': 0, 'errors': 0}
+
+
+def clave_mensaje(mensaje):
+    """Clave de caché: mensaje sin tildes, mayúsculas, puntuación ni espacios repetidos"""
+    texto = _NO_ALFANUMERICO.sub(' ', normalizar(mensaje)).strip()
+    return hashlib.sha1(texto.encode('utf-8')).hexdigest()
+
+
+def _count(nombre):
+    with _lock:
+        _counters[nombre] += 1
+
+
+def get_client(api_key):
+    """Cliente de OpenAI reutilizable (uno por proceso, clave, URL base y timeout)
+
+    OPENAI_BASE_URL permite apuntar a un servidor compatible (p. ej. un stub
+    local para pruebas).
+    """
+    config = current_app.config
+    timeout = config.get('CHATBOT_GPT_TIMEOUT', 15)
+    base_url = config.get('OPENAI_BASE_URL') or None
+    key = (os.getpid(), api_key, base_url, timeout)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = OpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=1)
+                _clients[key] = client
+    return client
+
+
+# =====================
+# Persistencia opcional en base de datos
+# =====================
+
+def _persistencia_activa():
+    return current_app.config.get('CHATBOT_GPT_CACHE_PERSIST', True)
+
+
+def _ensure_table(cursor):
+    """Crear la tabla de respuestas cacheadas si no existe (una vez por proceso)"""
+    db_type = current_app.config.get('DATABASE_TYPE', 'mysql').lower()
+    if db_type in _tables_ready:
+        return
+    # Mismo DDL en MySQL y SQLite
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chatbot_gpt_cache (
+            clave CHAR(40) PRIMARY KEY,
+            mensaje TEXT,
+            respuesta TEXT NOT NULL,
+            creado DATETIME NOT NULL
+        )
+    """)
+    _tables_ready.add(db_type)
+
+
+def _leer_db(db, clave, ttl):
+    cursor = db.cursor()
+    try:
+        _ensure_table(cursor)
+        cursor.execute(
+            "SELECT respuesta FROM chatbot_gpt_cache WHERE clave = %s AND creado >= %s",
+            (clave, datetime.now() - timedelta(seconds=ttl))
+        )
+        row = cursor.fetchone()
+        return row['respuesta'] if row else None
+    finally:
+        cursor.close()
+
+
+def _guardar_db(db, clave, mensaje, respuesta):
+    cursor = db.cursor()
+    try:
+        _ensure_table(cursor)
+        cursor.execute(
+            "REPLACE INTO chatbot_gpt_cache (clave, mensaje, respuesta, creado) VALUES (%s, %s, %s, %s)",
+            (clave, mensaje, respuesta, datetime.now())
+        )
+        db.commit()
+    finally:
+        cursor.close()
+
+
+# =====================
+# Caché
+# =====================
+
+def buscar_en_cache(mensaje, db=None):
+    """Respuesta cacheada para el mensaje (memoria y, si no está, base de datos)"""
+    config = current_app.config
+    ttl = config.get('CHATBOT_GPT_CACHE_TTL', 86400)
+    clave = clave_mensaje(mensaje)
+    now = time.monotonic()
+
+    with _lock:
+        entrada = _cache.get(clave)
+        if entrada is not None:
+            if now - entrada[1] < ttl:
+                _cache.move_to_end(clave)
+                _counters['hits'] += 1
+                return entrada[0]
+            del _cache[clave]
+
+    if _persistencia_activa():
+        try:
+            respuesta = _leer_db(db or current_app.get_db(), clave, ttl)
+        except Exception as e:
+            print(f"Error leyendo caché de GPT: {e}")
+            respuesta = None
+        if respuesta:
+            _guardar_memoria(clave, respuesta)
+            _count('db_hits')
+            return respuesta
+
+    _count('misses')
+    return None
+
+
+def _guardar_memoria(clave, respuesta):
+    max_entries = current_app.config.get('CHATBOT_GPT_CACHE_SIZE', 500)
+    with _lock:
+        _cache[clave] = (respuesta, time.monotonic())
+        _cache.move_to_end(clave)
+        while len(_cache) > max_entries:
+            _cache.popitem(last=False)
+
+
+def guardar_en_cache(mensaje, respuesta, db=None):
+    """Guardar una respuesta de GPT en memoria y, si está activo, en la base de datos"""
+    clave = clave_mensaje(mensaje)
+    _guardar_memoria(clave, respuesta)
+    if _persistencia_activa():
+        try:
+            _guardar_db(db or current_app.get_db(), clave, mensaje, respuesta)
+        except Exception as e:
+            print(f"Error guardando caché de GPT: {e}")
+
+
+# =====================
+# Respuestas
+# =====================
+
+def mensajes_para(mensaje):
+    """Conversación enviada a la API"""
+    return [
+        {"role": "system", "content": CONTEXTO},
+        {"role": "user", "content": mensaje}
+    ]
+
+
+def responder(mensaje, api_key):
+    """Respuesta de GPT para el mensaje, desde la caché si ya se respondió antes"""
+    respuesta = buscar_en_cache(mensaje)
+    if respuesta:
+        return respuesta
+
+    try:
+        response = get_client(api_key).chat.completions.create(
+            model=current_app.config.get('CHATBOT_GPT_MODEL', 'gpt-3.5-turbo'),
+            messages=mensajes_para(mensaje),
+            max_tokens=200,
+            temperature=0.7
+        )
+    except Exception:
+        _count('errors')
+        raise
+
+    respuesta = response.choices[0].message.content
+    if respuesta:
+        guardar_en_cache(mensaje, respuesta)
+    return respuesta
+
+
+def stream_respuesta(mensaje, api_key):
+    """Generador con los fragmentos de texto de GPT a medida que llegan
+
+    La llamada a la API (y la lectura de su stream) corre en un hilo aparte que
+    deja los fragmentos en una cola; el worker que atiende la petición solo los
+    reenvía. No consulta ni actualiza la caché: lo hace el llamador.
+    """
+    client = get_client(api_key)
+    timeout = current_app.config.get('CHATBOT_GPT_TIMEOUT', 15)
+    model = current_app.config.get('CHATBOT_GPT_MODEL', 'gpt-3.5-turbo')
+    fragmentos = queue.Queue()
+
+    def consumir():
+        try:
+            stream = client.chat.completions.create(
+                model=model,
+                messages=mensajes_para(mensaje),
+                max_tokens=200,
+                temperature=0.7,
+                stream=True
+            )
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    fragmentos.put(('texto', chunk.choices[0].delta.content))
+            fragmentos.put(('fin', None))
+        except Exception as e:
+            fragmentos.put(('error', e))
+
+    threading.Thread(target=consumir, name='chatbot-gpt-stream', daemon=True).start()
+
+    while True:
+        try:
+            tipo, valor = fragmentos.get(timeout=timeout)
+        except queue.Empty:
+            _count('errors')
+            raise TimeoutError('Tiempo de espera agotado esperando a OpenAI')
+        if tipo == 'texto':
+            yield valor
+        elif tipo == 'fin':
+            return
+        else:
+            _count('errors')
+            raise valor
+
+
+def stats():
+    """Contadores de la caché de este worker"""
+    with _lock:
+        data = dict(_counters)
+        data['size'] = len(_cache)
+    consultas = data['hits'] + data['db_hits'] + data['misses']
+    data['hit_rate'] = round(100.0 * (data['hits'] + data['db_hits']) / consultas, 1) if consultas else 0.0
+    data['persist'] = _persistencia_activa()
+    return data
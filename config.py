@@ -20,10 +20,82 @@ class Config:
     DB_PASSWORD = os.environ.get('DB_PASSWORD')
     DB_NAME = os.environ.get('DB_NAME')
     DB_PORT = int(os.environ.get('DB_PORT', 3306))
+
+    # Pool de conexiones por proceso (evita un handshake TCP+auth por petición)
+    DB_POOL_ENABLED = os.environ.get('DB_POOL_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_POOL_MAX_LIFETIME = int(os.environ.get('DB_POOL_MAX_LIFETIME', 1800))  # segundos
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 10))  # espera máxima por conexión libre
+    DB_POOL_PING_INTERVAL = int(os.environ.get('DB_POOL_PING_INTERVAL', 0))  # 0 = verificar siempre
     
     # Configuración SQLite (para desarrollo)
     SQLITE_DB_PATH = os.environ.get('SQLITE_DB_PATH', 'dh2ocol_dev.db')
     
+    # Cachés en memoria por worker (ver cache_utils.py)
+    CACHE_VERSION_CHECK_SECONDS = int(os.environ.get('CACHE_VERSION_CHECK_SECONDS', 5))
+    CONFIG_CACHE_TTL = int(os.environ.get('CONFIG_CACHE_TTL', 300))
+    PAGE_CACHE_ENABLED = os.environ.get('PAGE_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 3600))
+    PAGE_CACHE_MAX_ENTRIES = int(os.environ.get('PAGE_CACHE_MAX_ENTRIES', 256))
+    VISITOR_STATS_TTL = int(os.environ.get('VISITOR_STATS_TTL', 15))  # instantánea de /api/visitor-stats
+    SNAPSHOT_LEASE_SECONDS = int(os.environ.get('SNAPSHOT_LEASE_SECONDS', 30))
+
+    # Chatbot: confianza mínima (0-1) para responder localmente por similitud antes de usar GPT
+    CHATBOT_MIN_SCORE = float(os.environ.get('CHATBOT_MIN_SCORE', 0.35))
+    # Respuestas de GPT (ver chatbot_gpt.py)
+    CHATBOT_GPT_MODEL = os.environ.get('CHATBOT_GPT_MODEL', 'gpt-3.5-turbo')
+    OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL')  # vacío = API oficial
+    CHATBOT_GPT_TIMEOUT = float(os.environ.get('CHATBOT_GPT_TIMEOUT', 15))  # segundos
+    CHATBOT_GPT_CACHE_SIZE = int(os.environ.get('CHATBOT_GPT_CACHE_SIZE', 500))
+    CHATBOT_GPT_CACHE_TTL = int(os.environ.get('CHATBOT_GPT_CACHE_TTL', 86400))
+    CHATBOT_GPT_CACHE_PERSIST = os.environ.get('CHATBOT_GPT_CACHE_PERSIST', 'true').lower() in ('1', 'true', 'yes')
+
+    # Ingesta de eventos de visitantes (ver visitor_ingest.py): 'buffered' o 'sync'
+    VISITOR_INGEST_MODE = os.environ.get('VISITOR_INGEST_MODE', 'buffered').lower()
+    VISITOR_INGEST_QUEUE_SIZE = int(os.environ.get('VISITOR_INGEST_QUEUE_SIZE', 10000))
+    VISITOR_INGEST_BATCH_SIZE = int(os.environ.get('VISITOR_INGEST_BATCH_SIZE', 200))
+    VISITOR_INGEST_FLUSH_INTERVAL = float(os.environ.get('VISITOR_INGEST_FLUSH_INTERVAL', 2.0))  # segundos
+    VISITOR_INGEST_HIGH_WATER = float(os.environ.get('VISITOR_INGEST_HIGH_WATER', 0.8))  # fracción de la cola
+    VISITOR_INGEST_RETRY_AFTER = int(os.environ.get('VISITOR_INGEST_RETRY_AFTER', 5))
+
+    # Exportación CSV de visitantes (ver admin.visitor_logs_export): gzip si el cliente lo acepta
+    VISITOR_EXPORT_GZIP = os.environ.get('VISITOR_EXPORT_GZIP', 'true').lower() in ('1', 'true', 'yes')
+    VISITOR_EXPORT_CHUNK_BYTES = int(os.environ.get('VISITOR_EXPORT_CHUNK_BYTES', 65536))
+
+    # Cola de correos salientes (ver email_outbox.py)
+    EMAIL_OUTBOX_ENABLED = os.environ.get('EMAIL_OUTBOX_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    EMAIL_OUTBOX_POLL_INTERVAL = float(os.environ.get('EMAIL_OUTBOX_POLL_INTERVAL', 10))  # segundos
+    EMAIL_OUTBOX_BATCH_SIZE = int(os.environ.get('EMAIL_OUTBOX_BATCH_SIZE', 10))
+    EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('EMAIL_OUTBOX_MAX_ATTEMPTS', 6))  # luego queda 'fallido'
+    EMAIL_OUTBOX_BACKOFF_BASE = int(os.environ.get('EMAIL_OUTBOX_BACKOFF_BASE', 30))  # segundos, se duplica por intento
+    EMAIL_OUTBOX_BACKOFF_MAX = int(os.environ.get('EMAIL_OUTBOX_BACKOFF_MAX', 3600))
+    EMAIL_OUTBOX_LEASE_SECONDS = int(os.environ.get('EMAIL_OUTBOX_LEASE_SECONDS', 300))  # recuperar envíos colgados
+    # Adjuntos de cotizaciones (ver attachment_utils.py)
+    QUOTE_ATTACHMENT_WORKERS = int(os.environ.get('QUOTE_ATTACHMENT_WORKERS', 4))
+    QUOTE_ATTACHMENT_DEADLINE = float(os.environ.get('QUOTE_ATTACHMENT_DEADLINE', 20))  # segundos para todo el lote
+    QUOTE_ATTACHMENT_MAX_BYTES = int(os.environ.get('QUOTE_ATTACHMENT_MAX_BYTES', 5 * 1024 * 1024))  # por archivo
+    QUOTE_UPLOAD_CACHE_BYTES = int(os.environ.get('QUOTE_UPLOAD_CACHE_BYTES', 32 * 1024 * 1024))
+    QUOTE_UPLOAD_CACHE_TTL = int(os.environ.get('QUOTE_UPLOAD_CACHE_TTL', 3600))
+    # Subida concurrente de imágenes (ver upload_pipeline.py); 0 procesos = optimizar en los hilos
+    IMAGE_PROCESS_WORKERS = int(os.environ.get('IMAGE_PROCESS_WORKERS', 2 if (os.cpu_count() or 1) > 1 else 0))
+    STORAGE_IO_WORKERS = int(os.environ.get('STORAGE_IO_WORKERS', 4))
+    QUOTE_UPLOAD_DEADLINE = float(os.environ.get('QUOTE_UPLOAD_DEADLINE', 25))  # segundos (por debajo del timeout de gunicorn)
+    # Backend de almacenamiento: 'firebase' o 'local' (ver firebase_storage.create_storage_backend);
+    # se elige al importar firebase_storage, estas claves solo lo documentan
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'firebase')
+    LOCAL_STORAGE_ROOT = os.environ.get('LOCAL_STORAGE_ROOT')  # por defecto ./media
+    LOCAL_STORAGE_URL = os.environ.get('LOCAL_STORAGE_URL', '/media')
+    # Location 'internal' de nginx con alias a LOCAL_STORAGE_ROOT; vacío = servir con send_file
+    STORAGE_X_ACCEL_PREFIX = os.environ.get('STORAGE_X_ACCEL_PREFIX')
+    # Reproceso de imágenes de productos en segundo plano (ver image_reprocess.py)
+    REPROCESS_WORKERS = int(os.environ.get('REPROCESS_WORKERS', 4))
+    REPROCESS_BATCH_SIZE = int(os.environ.get('REPROCESS_BATCH_SIZE', 8))
+    REPROCESS_POLL_INTERVAL = float(os.environ.get('REPROCESS_POLL_INTERVAL', 30))  # segundos
+    REPROCESS_LEASE_SECONDS = int(os.environ.get('REPROCESS_LEASE_SECONDS', 300))  # retomar productos de un worker caído
+    REPROCESS_MAX_ATTEMPTS = int(os.environ.get('REPROCESS_MAX_ATTEMPTS', 3))  # luego queda en 'error'
+    REPROCESS_ITEM_DEADLINE = float(os.environ.get('REPROCESS_ITEM_DEADLINE', 60))  # segundos por imagen
+    REPROCESS_DOWNLOAD_TIMEOUT = float(os.environ.get('REPROCESS_DOWNLOAD_TIMEOUT', 30))
+
     # Configuración de sesiones
     PERMANENT_SESSION_LIFETIME = timedelta(hours=2)
     SESSION_COOKIE_SECURE = False  # True en producción con HTTPS
@@ -58,6 +130,9 @@ class Config:
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME', SMTP_USERNAME)
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD', SMTP_PASSWORD)
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER', EMAIL_FROM)
+    # Reutilizar una conexión SMTP por worker (ver mail_transport.py)
+    MAIL_KEEPALIVE = os.environ.get('MAIL_KEEPALIVE', 'true').lower() in ('1', 'true', 'yes')
+    MAIL_KEEPALIVE_IDLE = int(os.environ.get('MAIL_KEEPALIVE_IDLE', 30))  # segundos sin uso antes de renovarla
     
     # Configuración del sitio web
     WEBSITE_URL = os.environ.get('WEBSITE_URL')
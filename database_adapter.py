@@ -6,8 +6,153 @@ Maneja conexiones tanto a SQLite (desarrollo) como MySQL (producción)
 import sqlite3
 import pymysql
 import os
+import threading
+import time
+from collections import deque
 from flask import g, current_app
 from contextlib import contextmanager
+from sql_dialect import traducir_a_sqlite
+from sql_rows import row_class
+import sql_queries
+
+# Filas por lote al recorrer un resultado con iterrows() (fetchmany)
+FETCH_BATCH_SIZE = 1000
+
+
+class PoolExhaustedError(Exception):
+    """No hay conexiones libres en el pool dentro del tiempo de espera"""
+
+
+class ConnectionPool:
+    """Pool de conexiones acotado, propio de cada proceso (worker de Gunicorn)
+
+    - Tamaño máximo de conexiones abiertas (en uso + libres)
+    - Verificación de salud al entregar una conexión reutilizada
+    - Vida máxima por conexión para forzar reconexiones periódicas
+    - Rollback al devolver la conexión para no arrastrar transacciones abiertas
+    """
+
+    def __init__(self, factory, ping, max_size=5, max_lifetime=1800, timeout=10, ping_interval=0):
+        self._factory = factory
+        self._ping = ping
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self._cond = threading.Condition()
+        self._reset_state()
+
+    def _reset_state(self):
+        """Reiniciar estado interno (también tras un fork del proceso)"""
+        self._pid = os.getpid()
+        # Cada elemento: (conexión, creada_en, devuelta_en)
+        self._idle = deque()
+        self._size = 0
+        self._stats = {
+            'created': 0,
+            'reused': 0,
+            'discarded': 0,
+            'health_check_failures': 0,
+            'waits': 0,
+            'timeouts': 0,
+        }
+
+    def _check_fork(self):
+        """Las conexiones heredadas del proceso padre no se comparten: se descartan"""
+        if self._pid != os.getpid():
+            self._reset_state()
+
+    def _close_quietly(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def acquire(self):
+        """Obtener una conexión (reutilizada si hay alguna libre y sana)"""
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            self._check_fork()
+            while True:
+                while self._idle:
+                    connection, created_at, released_at = self._idle.pop()
+                    now = time.monotonic()
+                    if now - created_at > self.max_lifetime:
+                        self._discard(connection)
+                        continue
+                    if now - released_at >= self.ping_interval:
+                        try:
+                            self._ping(connection)
+                        except Exception:
+                            self._stats['health_check_failures'] += 1
+                            self._discard(connection)
+                            continue
+                    self._stats['reused'] += 1
+                    return connection, created_at
+
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolExhaustedError(
+                        f'No hay conexiones disponibles (máximo {self.max_size})'
+                    )
+                self._stats['waits'] += 1
+                self._cond.wait(remaining)
+
+        # Abrir la conexión fuera del lock para no bloquear a otros hilos
+        try:
+            connection = self._factory()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats['created'] += 1
+        return connection, time.monotonic()
+
+    def release(self, connection, created_at):
+        """Devolver una conexión al pool dejando limpio su estado transaccional"""
+        try:
+            connection.rollback()
+        except Exception:
+            with self._cond:
+                self._discard(connection)
+                self._cond.notify()
+            return
+
+        with self._cond:
+            if self._pid != os.getpid():
+                # Conexión creada antes del fork: no pertenece a este proceso
+                return
+            if time.monotonic() - created_at > self.max_lifetime:
+                self._discard(connection)
+            else:
+                self._idle.append((connection, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def _discard(self, connection):
+        """Cerrar una conexión y liberar su cupo (llamar con el lock tomado)"""
+        self._close_quietly(connection)
+        self._size -= 1
+        self._stats['discarded'] += 1
+
+    def stats(self):
+        """Estadísticas del pool para diagnóstico"""
+        with self._cond:
+            self._check_fork()
+            idle = len(self._idle)
+            return {
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': idle,
+                'in_use': self._size - idle,
+                **self._stats,
+            }
 
 
 class DatabaseAdapter:
@@ -15,6 +160,8 @@ class DatabaseAdapter:
     
     def __init__(self, app=None):
         self.app = app
+        self._pools = {}
+        self._pools_lock = threading.Lock()
         if app is not None:
             self.init_app(app)
     
@@ -22,40 +169,98 @@ class DatabaseAdapter:
         """Inicializar el adaptador con la aplicación Flask"""
         app.teardown_appcontext(self.close_db)
         app.get_db = self.get_db
+        # Consultas con nombre listas antes de la primera petición (ver sql_queries.py)
+        sql_queries.compilar(app.config.get('DATABASE_TYPE', 'mysql'))
     
     def get_db(self):
         """Obtener conexión a la base de datos según la configuración"""
         if 'db' not in g:
-            db_type = current_app.config.get('DATABASE_TYPE', 'mysql')
-            if db_type == 'sqlite':
-                g.db = self._get_sqlite_connection()
-            else:
-                g.db = self._get_mysql_connection()
+            g.db = self.connect(current_app.config)
         return g.db
+
+    def connect(self, config):
+        """Obtener un wrapper de conexión (del pool si está habilitado)"""
+        db_type = config.get('DATABASE_TYPE', 'mysql')
+        if db_type == 'sqlite':
+            factory, ping, wrapper_class = self._sqlite_factory(config), self._ping_sqlite, SQLiteWrapper
+        else:
+            factory, ping, wrapper_class = self._mysql_factory(config), self._ping_mysql, MySQLWrapper
+
+        if not config.get('DB_POOL_ENABLED', True):
+            return wrapper_class(factory())
+
+        pool = self._get_pool(config, factory, ping)
+        connection, created_at = pool.acquire()
+        return wrapper_class(connection, pool=pool, created_at=created_at)
+
+    def _pool_key(self, config):
+        """Clave del pool según destino de la conexión"""
+        if config.get('DATABASE_TYPE', 'mysql') == 'sqlite':
+            return ('sqlite', config.get('SQLITE_DB_PATH', 'dh2ocol_dev.db'))
+        return ('mysql', config.get('DB_HOST'), config.get('DB_PORT'), config.get('DB_NAME'), config.get('DB_USER'))
+
+    def _get_pool(self, config, factory, ping):
+        """Obtener (o crear perezosamente) el pool para la configuración dada"""
+        key = self._pool_key(config)
+        pool = self._pools.get(key)
+        if pool is None:
+            with self._pools_lock:
+                pool = self._pools.get(key)
+                if pool is None:
+                    pool = ConnectionPool(
+                        factory,
+                        ping,
+                        max_size=config.get('DB_POOL_SIZE', 5),
+                        max_lifetime=config.get('DB_POOL_MAX_LIFETIME', 1800),
+                        timeout=config.get('DB_POOL_TIMEOUT', 10),
+                        ping_interval=config.get('DB_POOL_PING_INTERVAL', 0),
+                    )
+                    self._pools[key] = pool
+        return pool
+
+    def pool_stats(self, config=None):
+        """Estadísticas del pool activo (None si no se usa pool)"""
+        config = config or current_app.config
+        if not config.get('DB_POOL_ENABLED', True):
+            return None
+        pool = self._pools.get(self._pool_key(config))
+        return pool.stats() if pool else {'max_size': config.get('DB_POOL_SIZE', 5), 'size': 0, 'idle': 0, 'in_use': 0}
     
-    def _get_sqlite_connection(self):
-        """Crear conexión SQLite"""
-        db_path = current_app.config.get('SQLITE_DB_PATH', 'dh2ocol_dev.db')
-        connection = sqlite3.connect(db_path)
-        # Configurar row_factory para que devuelva objetos Row (compatibles con dict)
-        connection.row_factory = sqlite3.Row
-        return SQLiteWrapper(connection)
-    
-    def _get_mysql_connection(self):
-        """Crear conexión MySQL"""
-        conn = pymysql.connect(
-            host=current_app.config['DB_HOST'],
-            user=current_app.config['DB_USER'],
-            password=current_app.config['DB_PASSWORD'],
-            database=current_app.config['DB_NAME'],
-            port=current_app.config['DB_PORT'],
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor
-        )
-        return MySQLWrapper(conn)
+    def _sqlite_factory(self, config):
+        """Fábrica de conexiones SQLite"""
+        db_path = config.get('SQLITE_DB_PATH', 'dh2ocol_dev.db')
+
+        def factory():
+            # check_same_thread=False: la conexión puede volver al pool y usarse desde otro hilo
+            # Filas como tuplas: SQLiteCursorWrapper las envuelve en Row (ver sql_rows.py)
+            return sqlite3.connect(db_path, check_same_thread=False)
+        return factory
+    
+    def _mysql_factory(self, config):
+        """Fábrica de conexiones MySQL"""
+        def factory():
+            return pymysql.connect(
+                host=config['DB_HOST'],
+                user=config['DB_USER'],
+                password=config['DB_PASSWORD'],
+                database=config['DB_NAME'],
+                port=config['DB_PORT'],
+                charset='utf8mb4',
+                cursorclass=pymysql.cursors.DictCursor
+            )
+        return factory
+
+    @staticmethod
+    def _ping_sqlite(connection):
+        connection.execute('SELECT 1')
+
+    @staticmethod
+    def _ping_mysql(connection):
+        # Sin reconexión automática: si falla, el pool descarta la conexión
+        connection.ping(reconnect=False)
     
     def close_db(self, error):
-        """Cerrar conexión a la base de datos"""
+        """Cerrar (o devolver al pool) la conexión de la petición"""
         db = g.pop('db', None)
         if db is not None:
             db.close()
@@ -64,11 +269,19 @@ class DatabaseAdapter:
 class DatabaseWrapper:
     """Clase base para wrappers de base de datos"""
     
-    def __init__(self, connection):
+    def __init__(self, connection, pool=None, created_at=None):
         self.connection = connection
+        self.pool = pool
+        self.created_at = created_at
     
-    def cursor(self):
-        """Obtener cursor de la base de datos"""
+    def cursor(self, streaming=False):
+        """Obtener cursor de la base de datos
+
+        streaming=True devuelve un cursor sin buffer: las filas se leen del
+        servidor a medida que se piden (fetchmany/iterrows) en lugar de
+        cargarse todas al ejecutar. Mientras no se agote o se cierre, la
+        conexión no admite otras consultas; usarlo con `with`.
+        """
         raise NotImplementedError
     
     def commit(self):
@@ -80,98 +293,162 @@ class DatabaseWrapper:
         self.connection.rollback()
     
     def close(self):
-        """Cerrar conexión"""
-        self.connection.close()
+        """Cerrar conexión o devolverla al pool"""
+        if self.pool is not None:
+            pool, self.pool = self.pool, None
+            pool.release(self.connection, self.created_at)
+        else:
+            self.connection.close()
 
 
 class SQLiteWrapper(DatabaseWrapper):
     """Wrapper para SQLite que emula el comportamiento de MySQL"""
     
-    def cursor(self):
-        """Obtener cursor SQLite con comportamiento similar a MySQL"""
+    def cursor(self, streaming=False):
+        """Obtener cursor SQLite con comportamiento similar a MySQL
+
+        sqlite3 ya avanza la sentencia fila a fila al leer, así que el cursor
+        de streaming es el mismo.
+        """
         return SQLiteCursorWrapper(self.connection.cursor())
 
 
 class MySQLWrapper(DatabaseWrapper):
     """Wrapper para MySQL"""
     
-    def cursor(self):
-        """Obtener cursor MySQL"""
-        return MySQLCursorWrapper(self.connection.cursor())
+    def cursor(self, streaming=False):
+        """Obtener cursor MySQL (filas como tuplas, envueltas en Row por el wrapper)
+
+        streaming=True usa SSCursor: PyMySQL lee el resultado del socket por
+        partes en lugar de cargarlo completo en memoria.
+        """
+        cursor_class = pymysql.cursors.SSCursor if streaming else pymysql.cursors.Cursor
+        return MySQLCursorWrapper(self.connection.cursor(cursor_class))
 
 
 class CursorWrapper:
     """Clase base para wrappers de cursor"""
     
+    # Dialecto de las consultas con nombre (ver sql_queries.py)
+    dialecto = None
+    
     def __init__(self, cursor):
         self.cursor = cursor
+        self._row = None
+    
+    def _run(self, query, params):
+        """Ejecutar en el cursor nativo y preparar el tipo Row de sus columnas"""
+        if params:
+            result = self.cursor.execute(query, params)
+        else:
+            result = self.cursor.execute(query)
+        description = self.cursor.description
+        self._row = row_class(tuple(col[0] for col in description)) if description else None
+        return result
     
     def execute(self, query, params=None):
         """Ejecutar consulta"""
         raise NotImplementedError
     
-    def fetchone(self):
-        """Obtener una fila"""
+    def execute_named(self, nombre, params=None, filtros=()):
+        """Ejecutar una consulta registrada en sql_queries (ya compilada para este dialecto)"""
+        return self._run(sql_queries.sentencia(self.dialecto, nombre, filtros), params)
+    
+    def executemany_named(self, nombre, seq_of_params):
+        """executemany de una consulta registrada en sql_queries"""
+        return self.cursor.executemany(sql_queries.sentencia(self.dialecto, nombre), seq_of_params)
+    
+    def executemany(self, query, seq_of_params):
+        """Ejecutar una sentencia para varios juegos de parámetros"""
         raise NotImplementedError
     
+    def fetchone(self):
+        """Obtener una fila (Row) o None"""
+        row = self.cursor.fetchone()
+        return None if row is None else self._row(row)
+    
+    def fetchmany(self, size=FETCH_BATCH_SIZE):
+        """Obtener hasta size filas (lista de Row, vacía al terminar)"""
+        return list(map(self._row, self.cursor.fetchmany(size)))
+    
     def fetchall(self):
-        """Obtener todas las filas"""
-        raise NotImplementedError
+        """Obtener todas las filas como lista de Row"""
+        return list(map(self._row, self.cursor.fetchall()))
+    
+    def iterrows(self, batch_size=FETCH_BATCH_SIZE):
+        """Recorrer las filas (Row) por lotes de fetchmany sin construir la lista completa
+
+        Con un cursor de streaming la memoria queda acotada por batch_size
+        sea cual sea el tamaño del resultado.
+        """
+        row = self._row
+        while True:
+            batch = self.cursor.fetchmany(batch_size)
+            if not batch:
+                return
+            for values in batch:
+                yield row(values)
+
+    @property
+    def description(self):
+        """Columnas del último resultado (formato DB-API)"""
+        return self.cursor.description
+
+    @property
+    def rowcount(self):
+        """Número de filas afectadas por la última sentencia"""
+        return self.cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        """Id autoincremental generado por el último INSERT"""
+        return self.cursor.lastrowid
     
     def close(self):
-        """Cerrar cursor"""
+        """Cerrar cursor (en MySQL, uno de streaming descarta antes las filas no leídas)"""
         self.cursor.close()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
 
 class SQLiteCursorWrapper(CursorWrapper):
     """Wrapper para cursor SQLite que convierte sintaxis MySQL a SQLite"""
     
+    dialecto = 'sqlite'
+    
+    @staticmethod
+    def _translate(query):
+        """Convertir sintaxis MySQL a SQLite (memorizado, ver sql_dialect.py)"""
+        return traducir_a_sqlite(query)
+    
     def execute(self, query, params=None):
         """Ejecutar consulta convirtiendo sintaxis MySQL a SQLite"""
-        # Convertir placeholders de MySQL (%s) a SQLite (?)
-        sqlite_query = query.replace('%s', '?')
-        
-        # Convertir algunas funciones específicas de MySQL
-        sqlite_query = sqlite_query.replace('AUTO_INCREMENT', 'AUTOINCREMENT')
-        sqlite_query = sqlite_query.replace('BOOLEAN', 'INTEGER')
-        sqlite_query = sqlite_query.replace('TRUE', '1')
-        sqlite_query = sqlite_query.replace('FALSE', '0')
-        
-        if params:
-            return self.cursor.execute(sqlite_query, params)
-        else:
-            return self.cursor.execute(sqlite_query)
-    
-    def fetchone(self):
-        """Obtener una fila como diccionario"""
-        row = self.cursor.fetchone()
-        if row:
-            return dict(row)
-        return None
+        return self._run(traducir_a_sqlite(query), params)
     
-    def fetchall(self):
-        """Obtener todas las filas como lista de diccionarios"""
-        rows = self.cursor.fetchall()
-        return [dict(row) for row in rows]
+    def executemany(self, query, seq_of_params):
+        """Ejecutar la misma sentencia para varios juegos de parámetros"""
+        return self.cursor.executemany(self._translate(query), seq_of_params)
 
 
 class MySQLCursorWrapper(CursorWrapper):
-    """Wrapper para cursor MySQL (sin cambios, mantiene comportamiento original)"""
+    """Wrapper para cursor MySQL (SQL sin traducir)"""
+    
+    dialecto = 'mysql'
     
     def execute(self, query, params=None):
         """Ejecutar consulta MySQL"""
-        if params:
-            return self.cursor.execute(query, params)
-        else:
-            return self.cursor.execute(query)
+        return self._run(query, params)
     
-    def fetchone(self):
-        """Obtener una fila"""
-        return self.cursor.fetchone()
-    
-    def fetchall(self):
-        """Obtener todas las filas"""
-        return self.cursor.fetchall()
+    def executemany(self, query, seq_of_params):
+        """Ejecutar la misma sentencia para varios juegos de parámetros
+
+        PyMySQL agrupa los INSERT ... VALUES en una única sentencia multi-fila.
+        """
+        return self.cursor.executemany(query, seq_of_params)
 
 
 # Función de conveniencia para obtener la base de datos
@@ -0,0 +1,439 @@
+"""
+Cola persistente de correos salientes para DH2OCOL
+
+Los correos de contacto, cotización y restablecimiento de contraseña se guardan
+en la tabla email_outbox y la petición HTTP responde en cuanto el INSERT se
+confirma. Un hilo por worker reclama los pendientes (UPDATE condicionado, así
+dos workers nunca envían el mismo), descarga los adjuntos y los entrega por
+SMTP. Los fallos se reintentan con espera exponencial; tras
+EMAIL_OUTBOX_MAX_ATTEMPTS intentos el correo queda en estado 'fallido' (cola de
+mensajes muertos) para revisarlo a mano.
+"""
+
+import atexit
+import json
+import os
+import random
+import threading
+from datetime import datetime, timedelta
+
+from flask_mail import Message
+
+from attachment_utils import descargar_adjuntos
+from mail_transport import SMTPTransport
+
+# Estados de un correo en la cola
+ESTADO_PENDIENTE = 'pendiente'
+ESTADO_ENVIANDO = 'enviando'
+ESTADO_ENVIADO = 'enviado'
+ESTADO_FALLIDO = 'fallido'
+
+MYSQL_TABLE = """
+    CREATE TABLE IF NOT EXISTS email_outbox (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        tipo VARCHAR(50),
+        asunto VARCHAR(255) NOT NULL,
+        remitente VARCHAR(255),
+        destinatarios TEXT NOT NULL,
+        cuerpo_texto MEDIUMTEXT,
+        cuerpo_html MEDIUMTEXT,
+        adjuntos_urls TEXT,
+        estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',
+        intentos INT NOT NULL DEFAULT 0,
+        proximo_intento DATETIME NOT NULL,
+        bloqueado_hasta DATETIME NULL,
+        ultimo_error TEXT,
+        creado DATETIME NOT NULL,
+        enviado DATETIME NULL,
+        INDEX idx_email_outbox_estado (estado, proximo_intento)
+    )
+"""
+
+SQLITE_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS email_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tipo VARCHAR(50),
+        asunto VARCHAR(255) NOT NULL,
+        remitente VARCHAR(255),
+        destinatarios TEXT NOT NULL,
+        cuerpo_texto TEXT,
+        cuerpo_html TEXT,
+        adjuntos_urls TEXT,
+        estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',
+        intentos INTEGER NOT NULL DEFAULT 0,
+        proximo_intento DATETIME NOT NULL,
+        bloqueado_hasta DATETIME,
+        ultimo_error TEXT,
+        creado DATETIME NOT NULL,
+        enviado DATETIME
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_email_outbox_estado
+    ON email_outbox (estado, proximo_intento)
+    """,
+)
+
+
+class EmailOutbox:
+    """Tabla email_outbox + hilo de envío con reintentos (uno por proceso)"""
+
+    def __init__(self, app=None, adapter=None):
+        self.app = None
+        self.adapter = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._tables_ready = set()
+        self._transport = None
+        self._reset_counters()
+        if app is not None:
+            self.init_app(app, adapter)
+
+    def init_app(self, app, adapter):
+        """Asociar la aplicación y el adaptador de base de datos"""
+        self.app = app
+        self.adapter = adapter
+        app.extensions['email_outbox'] = self
+        if self.enabled:
+            # Arranca el hilo del worker con su primera petición: así recoge
+            # también los reintentos pendientes tras un reinicio
+            app.before_request(self._ensure_started)
+
+    def _reset_counters(self):
+        self.counters = {
+            'enqueued': 0,
+            'sent': 0,
+            'retried': 0,
+            'dead': 0,
+            'last_send': None,
+            'last_error': None,
+        }
+
+    @property
+    def config(self):
+        return self.app.config
+
+    @property
+    def db_type(self):
+        return self.config.get('DATABASE_TYPE', 'mysql').lower()
+
+    @property
+    def enabled(self):
+        return self.config.get('EMAIL_OUTBOX_ENABLED', True)
+
+    def _count(self, nombre, valor=1):
+        with self._lock:
+            self.counters[nombre] += valor
+
+    # =====================
+    # Tabla
+    # =====================
+
+    def ensure_table(self, cursor):
+        """Crear la tabla de la cola una sola vez por proceso"""
+        db_type = self.db_type
+        if db_type in self._tables_ready:
+            return
+        for ddl in (SQLITE_TABLES if db_type == 'sqlite' else (MYSQL_TABLE,)):
+            cursor.execute(ddl)
+        self._tables_ready.add(db_type)
+
+    # =====================
+    # Encolado
+    # =====================
+
+    def enqueue(self, msg, adjuntos_urls=None, tipo=None, db=None):
+        """Guardar un flask_mail.Message en la cola y despertar al hilo de envío
+
+        Los adjuntos se pasan como URLs y se descargan al enviar. Devuelve el id
+        del correo encolado (None si la cola está desactivada y se envió en línea).
+        """
+        adjuntos_urls = list(adjuntos_urls or [])
+        if not self.enabled:
+            self.deliver(msg, adjuntos_urls)
+            return None
+
+        db = db or self.adapter.get_db()
+        now = datetime.now()
+        cursor = db.cursor()
+        try:
+            self.ensure_table(cursor)
+            cursor.execute("""
+                INSERT INTO email_outbox
+                (tipo, asunto, remitente, destinatarios, cuerpo_texto, cuerpo_html,
+                 adjuntos_urls, estado, intentos, proximo_intento, creado)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 0, %s, %s)
+            """, (
+                tipo, msg.subject, self._remitente(msg.sender), json.dumps(list(msg.recipients)),
+                msg.body, msg.html, json.dumps(adjuntos_urls) if adjuntos_urls else None,
+                ESTADO_PENDIENTE, now, now
+            ))
+            email_id = cursor.lastrowid
+            db.commit()
+        finally:
+            cursor.close()
+
+        self._count('enqueued')
+        self._ensure_started()
+        self._wake.set()
+        return email_id
+
+    @staticmethod
+    def _remitente(sender):
+        """flask_mail admite el remitente como tupla (nombre, email)"""
+        if isinstance(sender, (tuple, list)):
+            return json.dumps(list(sender))
+        return sender
+
+    # =====================
+    # Ciclo de vida del hilo
+    # =====================
+
+    def _ensure_started(self):
+        """Arrancar el hilo de envío en este proceso (ver visitor_ingest.py)"""
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == pid and self._thread is not None and self._thread.is_alive():
+                return
+            if self._pid != pid:
+                self._stop = threading.Event()
+                self._wake = threading.Event()
+                self._reset_counters()
+                self._pid = pid
+            self._thread = threading.Thread(
+                target=self._run, name='email-outbox', daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Detener el hilo al salir; lo no enviado sigue en la tabla"""
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._wake.set()
+        if self._transport is not None:
+            self._transport.close()
+
+    def _run(self):
+        interval = self.config.get('EMAIL_OUTBOX_POLL_INTERVAL', 10)
+        batch_size = self.config.get('EMAIL_OUTBOX_BATCH_SIZE', 10)
+        while not self._stop.is_set():
+            try:
+                procesados = self.process_due(batch_size)
+            except Exception as e:
+                print(f"Error procesando la cola de correos: {e}")
+                procesados = 0
+            if procesados < batch_size:
+                if not procesados and self._transport is not None:
+                    self._transport.close_if_idle()
+                self._wake.wait(interval)
+                self._wake.clear()
+
+    # =====================
+    # Envío
+    # =====================
+
+    def _claim(self, batch_size):
+        """Reclamar hasta batch_size correos vencidos para este worker
+
+        Incluye los que quedaron 'enviando' con el bloqueo caducado (worker
+        muerto a mitad de envío).
+        """
+        now = datetime.now()
+        lease = timedelta(seconds=self.config.get('EMAIL_OUTBOX_LEASE_SECONDS', 300))
+        db = self.adapter.connect(self.config)
+        cursor = db.cursor()
+        try:
+            self.ensure_table(cursor)
+            cursor.execute("""
+                SELECT id FROM email_outbox
+                WHERE (estado = %s AND proximo_intento <= %s)
+                   OR (estado = %s AND bloqueado_hasta < %s)
+                ORDER BY id
+                LIMIT %s
+            """, (ESTADO_PENDIENTE, now, ESTADO_ENVIANDO, now, batch_size))
+            candidatos = [row['id'] for row in cursor.fetchall()]
+
+            reclamados = []
+            for email_id in candidatos:
+                cursor.execute("""
+                    UPDATE email_outbox SET estado = %s, bloqueado_hasta = %s
+                    WHERE id = %s
+                      AND ((estado = %s AND proximo_intento <= %s)
+                           OR (estado = %s AND bloqueado_hasta < %s))
+                """, (ESTADO_ENVIANDO, now + lease, email_id,
+                      ESTADO_PENDIENTE, now, ESTADO_ENVIANDO, now))
+                if cursor.rowcount == 1:
+                    reclamados.append(email_id)
+            db.commit()
+
+            if not reclamados:
+                return []
+            placeholders = ', '.join(['%s'] * len(reclamados))
+            cursor.execute(
+                f"SELECT * FROM email_outbox WHERE id IN ({placeholders}) ORDER BY id",
+                tuple(reclamados)
+            )
+            return cursor.fetchall()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            cursor.close()
+            db.close()
+
+    def process_due(self, batch_size=None):
+        """Enviar los correos vencidos; devuelve cuántos se procesaron"""
+        batch_size = batch_size or self.config.get('EMAIL_OUTBOX_BATCH_SIZE', 10)
+        filas = self._claim(batch_size)
+        for fila in filas:
+            try:
+                self.deliver(self._message(fila), json.loads(fila['adjuntos_urls'] or '[]'))
+            except Exception as e:
+                print(f"Error enviando correo {fila['id']} ({fila['asunto']}): {e}")
+                self._fail(fila, e)
+            else:
+                self._mark_sent(fila)
+        return len(filas)
+
+    def _message(self, fila):
+        """Reconstruir el flask_mail.Message guardado en la fila"""
+        remitente = fila['remitente']
+        if remitente and remitente.startswith('['):
+            remitente = tuple(json.loads(remitente))
+        return Message(
+            fila['asunto'],
+            sender=remitente,
+            recipients=json.loads(fila['destinatarios']),
+            body=fila['cuerpo_texto'],
+            html=fila['cuerpo_html']
+        )
+
+    def attach_urls(self, msg, urls):
+        """Descargar (en paralelo) y adjuntar las imágenes; una URL caída no impide el envío"""
+        config = self.config
+        adjuntos, errores = descargar_adjuntos(
+            urls,
+            max_workers=config.get('QUOTE_ATTACHMENT_WORKERS', 4),
+            deadline_seconds=config.get('QUOTE_ATTACHMENT_DEADLINE', 20),
+            max_bytes=config.get('QUOTE_ATTACHMENT_MAX_BYTES', 5 * 1024 * 1024),
+            cache_ttl=config.get('QUOTE_UPLOAD_CACHE_TTL', 3600)
+        )
+        for url, error in errores.items():
+            print(f"No se pudo adjuntar imagen {url}: {error}")
+        for nombre, content_type, data in adjuntos:
+            msg.attach(filename=nombre, content_type=content_type, data=data)
+
+    def transport(self, mail_ext):
+        """Transporte SMTP persistente de este proceso (ver mail_transport.py)"""
+        if self._transport is None or self._transport.mail is not mail_ext:
+            with self._lock:
+                if self._transport is None or self._transport.mail is not mail_ext:
+                    self._transport = SMTPTransport(
+                        mail_ext, idle_timeout=self.config.get('MAIL_KEEPALIVE_IDLE', 30)
+                    )
+        return self._transport
+
+    def deliver(self, msg, adjuntos_urls=None):
+        """Enviar un mensaje por SMTP con la extensión Flask-Mail de la app"""
+        if adjuntos_urls:
+            self.attach_urls(msg, adjuntos_urls)
+        with self.app.app_context():
+            mail_ext = self.app.extensions.get('mail')
+            if not mail_ext:
+                raise RuntimeError('Extensión de mail no inicializada')
+            if self.config.get('MAIL_KEEPALIVE', True):
+                self.transport(mail_ext).send(msg)
+            else:
+                mail_ext.send(msg)
+
+    def _update(self, query, params):
+        db = self.adapter.connect(self.config)
+        cursor = db.cursor()
+        try:
+            cursor.execute(query, params)
+            db.commit()
+        finally:
+            cursor.close()
+            db.close()
+
+    def _mark_sent(self, fila):
+        try:
+            self._update("""
+                UPDATE email_outbox
+                SET estado = %s, intentos = intentos + 1, enviado = %s,
+                    bloqueado_hasta = NULL, ultimo_error = NULL
+                WHERE id = %s
+            """, (ESTADO_ENVIADO, datetime.now(), fila['id']))
+        except Exception as e:
+            # El correo ya salió: si no se puede marcar, el bloqueo caducará y
+            # se reenviaría, pero no hay forma segura de evitarlo sin la base
+            print(f"Error marcando correo {fila['id']} como enviado: {e}")
+        with self._lock:
+            self.counters['sent'] += 1
+            self.counters['last_send'] = datetime.now().isoformat()
+
+    def backoff(self, intentos):
+        """Espera antes del siguiente intento: base * 2^(intentos-1), con tope y jitter"""
+        base = self.config.get('EMAIL_OUTBOX_BACKOFF_BASE', 30)
+        tope = self.config.get('EMAIL_OUTBOX_BACKOFF_MAX', 3600)
+        espera = min(base * (2 ** max(intentos - 1, 0)), tope)
+        return espera + random.uniform(0, espera * 0.1)
+
+    def _fail(self, fila, error):
+        intentos = (fila['intentos'] or 0) + 1
+        max_intentos = self.config.get('EMAIL_OUTBOX_MAX_ATTEMPTS', 6)
+        muerto = intentos >= max_intentos
+        estado = ESTADO_FALLIDO if muerto else ESTADO_PENDIENTE
+        proximo = datetime.now() + timedelta(seconds=self.backoff(intentos))
+        try:
+            self._update("""
+                UPDATE email_outbox
+                SET estado = %s, intentos = %s, proximo_intento = %s,
+                    bloqueado_hasta = NULL, ultimo_error = %s
+                WHERE id = %s
+            """, (estado, intentos, proximo, str(error)[:1000], fila['id']))
+        except Exception as e:
+            print(f"Error registrando fallo del correo {fila['id']}: {e}")
+        with self._lock:
+            self.counters['dead' if muerto else 'retried'] += 1
+            self.counters['last_error'] = str(error)
+
+    # =====================
+    # Consulta
+    # =====================
+
+    def counts(self, db):
+        """Número de correos por estado en la tabla"""
+        cursor = db.cursor()
+        try:
+            self.ensure_table(cursor)
+            cursor.execute("SELECT estado, COUNT(*) AS total FROM email_outbox GROUP BY estado")
+            return {row['estado']: row['total'] for row in cursor.fetchall()}
+        finally:
+            cursor.close()
+
+    def stats(self):
+        """Contadores del hilo de envío de este worker"""
+        with self._lock:
+            stats = dict(self.counters)
+        stats.update({
+            'enabled': self.enabled,
+            'pid': os.getpid(),
+            'thread_alive': bool(self._thread is not None and self._thread.is_alive()
+                                 and self._pid == os.getpid()),
+            'smtp': dict(self._transport.counters) if self._transport is not None else None,
+        })
+        return stats
+
+
+email_outbox = EmailOutbox()
+
+# Despertar al hilo para que termine limpio cuando el worker sale
+atexit.register(email_outbox.stop)
@@ -4,7 +4,7 @@ Utilidades para envío de emails
 
 from flask import current_app
 from flask_mail import Message
-from app import mail
+from email_outbox import email_outbox
 import logging
 
 def send_password_reset_email(user_email, reset_token, username):
@@ -17,12 +17,12 @@ def send_password_reset_email(user_email, reset_token, username):
         username (str): Nombre de usuario
     
     Returns:
-        bool: True si el email se envió correctamente, False en caso contrario
+        bool: True si el email quedó en la cola de envío, False en caso contrario
     """
     try:
         from flask import url_for
         
-        # Generar URL de restablecimiento
+        # Generar URL de restablecimiento (en la petición: el hilo de envío no tiene contexto de request)
         reset_url = url_for('admin.reset_password', token=reset_token, _external=True)
         
         # Crear mensaje
@@ -128,12 +128,12 @@ def send_password_reset_email(user_email, reset_token, username):
         Equipo DH2OCOL
         """
         
-        # Enviar email
-        mail.send(msg)
+        # Encolar email (lo envía el hilo de email_outbox.py)
+        email_outbox.enqueue(msg, tipo='reset_password')
         return True
         
     except Exception as e:
-        logging.error(f"Error al enviar email de restablecimiento: {e}")
+        logging.error(f"Error al encolar email de restablecimiento: {e}")
         return False
 
 def send_contact_email(nombre, email, telefono, empresa, mensaje):
@@ -148,7 +148,7 @@ def send_contact_email(nombre, email, telefono, empresa, mensaje):
         mensaje (str): Mensaje del contacto
     
     Returns:
-        bool: True si el email se envió correctamente, False en caso contrario
+        bool: True si los emails quedaron en la cola de envío, False en caso contrario
     """
     try:
         # Email de notificación para el administrador
@@ -223,8 +223,8 @@ def send_contact_email(nombre, email, telefono, empresa, mensaje):
         Responde a este contacto lo antes posible.
         """
         
-        # Enviar email al administrador
-        mail.send(msg_admin)
+        # Encolar email al administrador
+        email_outbox.enqueue(msg_admin, tipo='contacto')
         
         # Email de confirmación para el cliente
         msg_cliente = Message(
@@ -321,13 +321,13 @@ def send_contact_email(nombre, email, telefono, empresa, mensaje):
         Equipo DH2OCOL
         """
         
-        # Enviar email de confirmación al cliente
-        mail.send(msg_cliente)
+        # Encolar email de confirmación al cliente
+        email_outbox.enqueue(msg_cliente, tipo='contacto_confirmacion')
         
         return True
         
     except Exception as e:
-        logging.error(f"Error al enviar email de contacto: {e}")
+        logging.error(f"Error al encolar email de contacto: {e}")
         return False
 
 def test_email_configuration():
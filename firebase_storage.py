@@ -1,25 +1,32 @@
 """
 Firebase Storage utilities for DH2OCOL application
 Handles file uploads, downloads, and management operations
+
+The global firebase_storage instance is the backend selected by
+STORAGE_BACKEND (Firebase by default, local disk with 'local').
 """
 
 import os
 import json
-import uuid
 from datetime import datetime, timedelta
-from typing import Optional, Tuple, List
+from typing import Callable, Optional, Tuple, List
 import firebase_admin
 from firebase_admin import credentials, storage
+from google.api_core.exceptions import BadRequest
 from werkzeug.datastructures import FileStorage
-from PIL import Image
-import io
+from storage_backend import StorageBackend, CACHE_CONTROL
+
 
-class FirebaseStorageManager:
+class FirebaseStorageManager(StorageBackend):
     """Manages Firebase Storage operations for the application"""
     
+    label = "Firebase"
+    
     def __init__(self):
         self.bucket = None
         self.initialized = False
+        # Cleared the first time the bucket rejects predefined ACLs (uniform bucket-level access)
+        self.predefined_acl_supported = True
         self._initialize_firebase()
     
     def _initialize_firebase(self):
@@ -78,316 +85,60 @@ class FirebaseStorageManager:
         """Check if Firebase Storage is properly initialized"""
         return self.initialized and self.bucket is not None
     
-    def _generate_unique_filename(self, original_filename: str, folder: str = "") -> str:
-        """Generate a unique filename to avoid conflicts"""
-        # Get file extension
-        name, ext = os.path.splitext(original_filename)
-        
-        # Generate unique identifier
-        unique_id = str(uuid.uuid4())[:8]
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        
-        # Create unique filename
-        unique_filename = f"{name}_{timestamp}_{unique_id}{ext}"
-        
-        # Add folder prefix if specified
-        if folder:
-            unique_filename = f"{folder}/{unique_filename}"
-        
-        return unique_filename
-    
-    def _optimize_image(self, file_data: bytes, max_size: Tuple[int, int] = (500, 375), quality: int = 90) -> bytes:
-        """Optimize image for web usage with better sizing for product cards"""
+    def existing_public_url(self, filename: str) -> Optional[str]:
+        """Public URL of a blob if it is already stored (one metadata request)"""
         try:
-            # Open image
-            image = Image.open(io.BytesIO(file_data))
-            
-            # Convert to RGB if necessary
-            if image.mode in ('RGBA', 'LA', 'P'):
-                background = Image.new('RGB', image.size, (255, 255, 255))
-                if image.mode == 'P':
-                    image = image.convert('RGBA')
-                background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-                image = background
-            elif image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Correct orientation based on EXIF data
-            from PIL import ImageOps
-            image = ImageOps.exif_transpose(image)
-            
-            # Calculate optimal size maintaining aspect ratio
-            original_width, original_height = image.size
-            target_width, target_height = max_size
-            
-            # Calculate scaling factor to fit within target size
-            scale_factor = min(target_width / original_width, target_height / original_height)
-            
-            if scale_factor < 1:  # Only resize if image is larger than target
-                new_width = int(original_width * scale_factor)
-                new_height = int(original_height * scale_factor)
-                image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # Create final image with white background centered
-            final_image = Image.new('RGB', max_size, (255, 255, 255))
-            x_offset = (max_size[0] - image.width) // 2
-            y_offset = (max_size[1] - image.height) // 2
-            final_image.paste(image, (x_offset, y_offset))
-            
-            # Save optimized image
-            output = io.BytesIO()
-            final_image.save(output, format='JPEG', quality=quality, optimize=True)
-            
-            return output.getvalue()
+            blob = self.bucket.get_blob(filename)
         except Exception as e:
-            print(f"Error optimizing image: {str(e)}")
-            return file_data
+            print(f"Firebase: Could not check {filename}: {str(e)}")
+            return None
+        return blob.public_url if blob is not None else None
 
-    def _optimize_carousel_image(self, file_data: bytes, max_size: Tuple[int, int] = (1920, 1080), quality: int = 95) -> bytes:
-        """Optimize image specifically for carousel usage with higher quality preservation"""
-        try:
-            # Open image
-            image = Image.open(io.BytesIO(file_data))
-            
-            # Preserve original format if possible
-            original_format = image.format
-            
-            # Correct orientation based on EXIF data first
-            from PIL import ImageOps
-            image = ImageOps.exif_transpose(image)
-            
-            # Get original dimensions
-            original_width, original_height = image.size
-            target_width, target_height = max_size
-            
-            # Only resize if image is significantly larger than target
-            # Allow some tolerance to avoid unnecessary resizing
-            scale_factor = min(target_width / original_width, target_height / original_height)
-            
-            if scale_factor < 0.8:  # Only resize if image is much larger than target
-                new_width = int(original_width * scale_factor)
-                new_height = int(original_height * scale_factor)
-                # Use LANCZOS for high-quality resizing
-                image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # Determine best output format
-            output = io.BytesIO()
-            
-            # For carousel images, prefer to keep original format if it's high quality
-            if original_format in ['PNG', 'WEBP'] and image.mode in ['RGBA', 'LA']:
-                # Keep transparency for PNG/WEBP
-                if original_format == 'PNG':
-                    image.save(output, format='PNG', optimize=True, compress_level=6)
-                else:
-                    # Convert to RGB for JPEG with high quality
-                    if image.mode in ('RGBA', 'LA', 'P'):
-                        background = Image.new('RGB', image.size, (255, 255, 255))
-                        if image.mode == 'P':
-                            image = image.convert('RGBA')
-                        background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-                        image = background
-                    elif image.mode != 'RGB':
-                        image = image.convert('RGB')
-                    
-                    image.save(output, format='JPEG', quality=quality, optimize=True)
-            else:
-                # Convert to RGB for JPEG
-                if image.mode in ('RGBA', 'LA', 'P'):
-                    background = Image.new('RGB', image.size, (255, 255, 255))
-                    if image.mode == 'P':
-                        image = image.convert('RGBA')
-                    background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-                    image = background
-                elif image.mode != 'RGB':
-                    image = image.convert('RGB')
-                
-                # Use higher quality for carousel images
-                image.save(output, format='JPEG', quality=quality, optimize=True)
-            
-            return output.getvalue()
-        except Exception as e:
-            print(f"Error optimizing carousel image: {str(e)}")
-            return file_data
+    def _list_names(self, prefix: str) -> List[Tuple[str, str]]:
+        """(name, public_url) of the blobs under a prefix (one listing request)"""
+        return [(blob.name, blob.public_url) for blob in self.bucket.list_blobs(prefix=prefix)]
 
-    def _optimize_product_image_by_category(self, file_data: bytes, category: str) -> bytes:
-        """Optimize product images based on their category with specific parameters"""
-        try:
-            # Define category-specific optimization parameters
-            category_settings = {
-                'Tanques': {
-                    'max_size': (800, 600),
-                    'quality': 92,
-                    'description': 'High resolution for detailed tank views'
-                },
-                'Bombas': {
-                    'max_size': (700, 525),
-                    'quality': 90,
-                    'description': 'Good detail for mechanical components'
-                },
-                'Filtros': {
-                    'max_size': (600, 450),
-                    'quality': 88,
-                    'description': 'Clear view of filter systems'
-                },
-                'Accesorios': {
-                    'max_size': (500, 375),
-                    'quality': 85,
-                    'description': 'Compact size for small accessories'
-                },
-                'Químicos': {
-                    'max_size': (550, 400),
-                    'quality': 87,
-                    'description': 'Clear product labeling visibility'
-                },
-                'Herramientas': {
-                    'max_size': (650, 500),
-                    'quality': 89,
-                    'description': 'Good detail for tool identification'
-                }
-            }
-            
-            # Get settings for the category, default to Accesorios if not found
-            settings = category_settings.get(category, category_settings['Accesorios'])
-            max_size = settings['max_size']
-            quality = settings['quality']
-            
-            print(f"Optimizing {category} product image: {settings['description']} - {max_size} at {quality}% quality")
-            
-            # Open image
-            image = Image.open(io.BytesIO(file_data))
-            
-            # Correct orientation based on EXIF data
-            from PIL import ImageOps
-            image = ImageOps.exif_transpose(image)
-            
-            # Convert to RGB if necessary, but preserve quality
-            if image.mode in ('RGBA', 'LA', 'P'):
-                background = Image.new('RGB', image.size, (255, 255, 255))
-                if image.mode == 'P':
-                    image = image.convert('RGBA')
-                background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-                image = background
-            elif image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Calculate optimal size maintaining aspect ratio
-            original_width, original_height = image.size
-            target_width, target_height = max_size
-            
-            # Calculate scaling factor to fit within target size
-            scale_factor = min(target_width / original_width, target_height / original_height)
-            
-            # Only resize if image is larger than target (avoid upscaling)
-            if scale_factor < 1:
-                new_width = int(original_width * scale_factor)
-                new_height = int(original_height * scale_factor)
-                # Use LANCZOS for high-quality resizing
-                image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # For product images, maintain aspect ratio without adding background
-            # This preserves the natural proportions of the product
-            
-            # Save optimized image
-            output = io.BytesIO()
-            image.save(output, format='JPEG', quality=quality, optimize=True)
-            
-            return output.getvalue()
-        except Exception as e:
-            print(f"Error optimizing {category} product image: {str(e)}")
-            return file_data
-    
-    def upload_file(self, file: FileStorage, folder: str = "", optimize_image: bool = True, product_category: str = None) -> Optional[str]:
+    def upload_named(self, file_data: bytes, filename: str, content_type: Optional[str]) -> str:
         """
-        Upload a file to Firebase Storage
-        
-        Args:
-            file: FileStorage object from Flask
-            folder: Folder path in storage (e.g., 'productos', 'servicios', 'carousel')
-            optimize_image: Whether to optimize images before upload
-            product_category: Product category for category-specific optimization (Tanques, Bombas, etc.)
+        Upload bytes as a public blob under an exact name (e.g. a size variant
+        derived from a content-addressed name)
         
         Returns:
-            Public URL of uploaded file or None if failed
+            Public URL of the uploaded blob (raises on storage errors)
         """
-        if not self.is_initialized():
-            print("Firebase Storage not initialized")
-            return None
-
-        if not file or not file.filename:
-            print("No file provided")
-            return None
-
-        print(f"Firebase: Uploading file {file.filename} to folder '{folder}'")
-        print(f"Firebase: Content type: {file.content_type}")
-        print(f"Firebase: Product category: {product_category}")
+        # Upload to Firebase Storage
+        blob = self.bucket.blob(filename)
+        self._upload_public(blob, file_data, content_type)
+        print(f"Firebase: File uploaded successfully")
+        
+        # Return public URL
+        public_url = blob.public_url
+        print(f"Firebase: Public URL: {public_url}")
+        return public_url
 
-        try:
-            # Generate unique filename
-            filename = self._generate_unique_filename(file.filename, folder)
-            print(f"Firebase: Generated filename: {filename}")
-            
-            # Read file data
-            file_data = file.read()
-            print(f"Firebase: File data size: {len(file_data)} bytes")
-            
-            if len(file_data) == 0:
-                print("Firebase: Error - File data is empty")
-                return None
-            
-            # Validate image format if it's supposed to be an image
-            if file.content_type and file.content_type.startswith('image/'):
-                try:
-                    # Try to open the image to validate it
-                    img = Image.open(io.BytesIO(file_data))
-                    img.verify()  # Verify that it's a valid image
-                    print(f"Firebase: Image validation successful - Format: {img.format}, Size: {img.size}")
-                except Exception as img_error:
-                    print(f"Firebase: Image validation failed: {img_error}")
-                    return None
-            
-            # Optimize image if it's an image file and optimization is enabled
-            if optimize_image and file.content_type and file.content_type.startswith('image/'):
-                # Use specific optimization based on folder/purpose
-                if folder == 'carousel':
-                    # Use high-quality optimization for carousel images
-                    file_data = self._optimize_carousel_image(file_data)
-                    print(f"Firebase: Optimizing carousel image with high quality settings")
-                elif folder == 'productos' and product_category:
-                    # Use category-specific optimization for product images
-                    file_data = self._optimize_product_image_by_category(file_data, product_category)
-                    print(f"Firebase: Optimizing product image for category: {product_category}")
-                else:
-                    # Use standard optimization for other images (services, general, etc.)
-                    file_data = self._optimize_image(file_data)
-                    print(f"Firebase: Optimizing image with standard settings for folder: {folder}")
-                
-                print(f"Firebase: Optimized file data size: {len(file_data)} bytes")
-            
-            # Upload to Firebase Storage
-            blob = self.bucket.blob(filename)
-            blob.upload_from_string(file_data, content_type=file.content_type)
-            # Add long-lived caching for static media assets
-            blob.cache_control = "public, max-age=31536000, immutable"
+    def _upload_public(self, blob, file_data: bytes, content_type: Optional[str]) -> None:
+        """
+        Upload a blob as public with its cache headers in a single request
+        
+        cache_control set before the upload travels in the same request as the
+        content type, and predefined_acl='publicRead' replaces the separate
+        make_public() call. Buckets with uniform bucket-level access reject
+        predefined ACLs; then (and for every later upload) fall back to a plain
+        upload followed by make_public().
+        """
+        blob.cache_control = CACHE_CONTROL
+        if self.predefined_acl_supported:
             try:
-                blob.patch()
-            except Exception:
-                pass
-            print(f"Firebase: File uploaded successfully")
-            
-            # Make the file publicly accessible
-            blob.make_public()
-            print(f"Firebase: File made public")
-            
-            # Return public URL
-            public_url = blob.public_url
-            print(f"Firebase: Public URL: {public_url}")
-            return public_url
-            
-        except Exception as e:
-            print(f"Firebase: Error uploading file: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            return None
+                blob.upload_from_string(file_data, content_type=content_type, predefined_acl='publicRead')
+                return
+            except (BadRequest, TypeError) as e:
+                print(f"Firebase: Predefined ACL not supported ({e}), falling back to make_public()")
+                self.predefined_acl_supported = False
+
+        blob.upload_from_string(file_data, content_type=content_type)
+        # Make the file publicly accessible
+        blob.make_public()
+        print(f"Firebase: File made public")
     
     def delete_file(self, file_url: str) -> bool:
         """
@@ -503,13 +254,30 @@ class FirebaseStorageManager:
             print(f"Error generating signed URL: {str(e)}")
             return None
 
-# Global instance
-firebase_storage = FirebaseStorageManager()
+def create_storage_backend() -> StorageBackend:
+    """
+    Storage backend selected by STORAGE_BACKEND: 'firebase' (default) or
+    'local' (files on this host under LOCAL_STORAGE_ROOT, see local_storage.py)
+    """
+    backend = os.getenv('STORAGE_BACKEND', 'firebase').strip().lower()
+    if backend == 'local':
+        from local_storage import LocalStorageBackend
+        return LocalStorageBackend(
+            os.getenv('LOCAL_STORAGE_ROOT') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media'),
+            os.getenv('LOCAL_STORAGE_URL', '/media')
+        )
+    if backend != 'firebase':
+        print(f"Unknown STORAGE_BACKEND '{backend}', using Firebase")
+    return FirebaseStorageManager()
+
+# Global instance (keeps its name whatever the backend: every module imports it from here)
+firebase_storage = create_storage_backend()
 
 # Utility functions for easy access
-def upload_file(file: FileStorage, folder: str = "", optimize_image: bool = True, product_category: str = None) -> Optional[str]:
+def upload_file(file: FileStorage, folder: str = "", optimize_image: bool = True, product_category: str = None,
+                on_upload: Optional[Callable[[str, bytes, str], None]] = None) -> Optional[str]:
     """Upload a file to Firebase Storage"""
-    return firebase_storage.upload_file(file, folder, optimize_image, product_category)
+    return firebase_storage.upload_file(file, folder, optimize_image, product_category, on_upload)
 
 def delete_file(file_url: str) -> bool:
     """Delete a file from Firebase Storage"""
@@ -553,9 +321,6 @@ def upload_file_from_path(local_file_path: str, folder: str = "", optimize_image
         if not content_type:
             content_type = 'application/octet-stream'
         
-        # Generate unique filename
-        unique_filename = firebase_storage._generate_unique_filename(filename, folder)
-        
         # Read file data
         with open(local_file_path, 'rb') as f:
             file_data = f.read()
@@ -564,26 +329,13 @@ def upload_file_from_path(local_file_path: str, folder: str = "", optimize_image
         if optimize_image and content_type.startswith('image/'):
             file_data = firebase_storage._optimize_image(file_data)
         
-        # Upload to Firebase Storage
-        blob = firebase_storage.bucket.blob(unique_filename)
-        blob.upload_from_string(file_data, content_type=content_type)
-        # Add long-lived caching for static media assets
-        blob.cache_control = "public, max-age=31536000, immutable"
-        try:
-            blob.patch()
-        except Exception:
-            pass
-        
-        # Make the file publicly accessible
-        blob.make_public()
-        
-        # Return public URL
-        return blob.public_url
+        # Upload to Firebase Storage and return public URL
+        return firebase_storage.upload_bytes(file_data, filename, content_type, folder)
         
     except Exception as e:
         print(f"Error uploading file from path: {str(e)}")
         return None
 
 def is_firebase_available() -> bool:
-    """Check if Firebase Storage is available"""
-    return firebase_storage.is_initialized()
\ No newline at end of file
+    """Check if the storage backend (Firebase or local) is available"""
+    return firebase_storage.is_initialized()
@@ -0,0 +1,93 @@
+"""
+Request-count check for FirebaseStorageManager uploads
+
+Runs upload_named against an in-memory bucket that records every request a
+blob would send to Cloud Storage, and checks how many requests each upload
+costs with fine-grained ACLs and with uniform bucket-level access.
+
+    python firebase_storage_check.py
+"""
+
+from collections import Counter
+
+from google.api_core.exceptions import BadRequest
+
+from firebase_storage import FirebaseStorageManager
+from storage_backend import CACHE_CONTROL
+
+
+class FakeBlob:
+    """Blob that records every request it would send to Cloud Storage"""
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.cache_control = None
+        self.public_url = f"https://storage.googleapis.com/fake-bucket/{name}"
+
+    def upload_from_string(self, data, content_type=None, predefined_acl=None):
+        self.bucket.calls['upload_from_string'] += 1
+        if predefined_acl and self.bucket.uniform_access:
+            raise BadRequest("Cannot use ACL API to set object policy when object policies are disabled.")
+        self.bucket.uploads.append({'name': self.name, 'content_type': content_type,
+                                    'cache_control': self.cache_control, 'predefined_acl': predefined_acl})
+
+    def make_public(self):
+        self.bucket.calls['make_public'] += 1
+
+
+class FakeBucket:
+    """Bucket with no stored blobs; uniform_access=True rejects predefined ACLs"""
+
+    def __init__(self, uniform_access=False):
+        self.uniform_access = uniform_access
+        self.calls = Counter()
+        self.uploads = []
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        self.calls['get_blob'] += 1
+        return None
+
+
+def fake_manager(bucket):
+    """FirebaseStorageManager bound to bucket, without Firebase credentials"""
+    manager = FirebaseStorageManager.__new__(FirebaseStorageManager)
+    manager.bucket = bucket
+    manager.initialized = True
+    manager.predefined_acl_supported = True
+    return manager
+
+
+def check_acl_bucket(uploads=3):
+    """Bucket with fine-grained ACLs: one request carries content, headers and ACL"""
+    bucket = FakeBucket()
+    manager = fake_manager(bucket)
+    for i in range(uploads):
+        manager.upload_named(f"file {i}".encode(), f"productos/{i}.jpg", 'image/jpeg')
+    print(f"ACL bucket, {uploads} uploads: {dict(bucket.calls)}")
+    assert bucket.calls == {'upload_from_string': uploads}
+    assert all(u == {'name': f"productos/{i}.jpg", 'content_type': 'image/jpeg',
+                     'cache_control': CACHE_CONTROL, 'predefined_acl': 'publicRead'}
+               for i, u in enumerate(bucket.uploads))
+
+
+def check_uniform_bucket(uploads=3):
+    """Uniform bucket-level access: one rejected request, then upload + make_public"""
+    bucket = FakeBucket(uniform_access=True)
+    manager = fake_manager(bucket)
+    for i in range(uploads):
+        manager.upload_named(f"file {i}".encode(), f"productos/{i}.jpg", 'image/jpeg')
+    print(f"Uniform bucket, {uploads} uploads: {dict(bucket.calls)}")
+    assert not manager.predefined_acl_supported
+    assert bucket.calls == {'upload_from_string': uploads + 1, 'make_public': uploads}
+    assert all(u['predefined_acl'] is None and u['cache_control'] == CACHE_CONTROL and u['content_type'] == 'image/jpeg'
+               for u in bucket.uploads)
+
+
+if __name__ == '__main__':
+    check_acl_bucket()
+    check_uniform_bucket()
+    print("OK")
@@ -9,7 +9,10 @@ backlog = 2048
 
 # Worker processes
 workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"
+# gthread: cada worker atiende varias peticiones en hilos, de modo que una
+# respuesta en streaming (chatbot SSE) no bloquea el proceso completo
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
 worker_connections = 1000
 timeout = 30
 keepalive = 2
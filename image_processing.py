@@ -0,0 +1,460 @@
+"""
+Image processing helpers for DH2OCOL uploads
+
+Pure functions over bytes (no Firebase or Flask imports) so they can run in a
+worker process of the upload pipeline as well as inline.
+
+Each upload is decoded exactly once: decode_image() opens the bytes, asks the
+JPEG decoder for a reduced-scale draft when the target is much smaller than
+the photo, loads the pixels (a corrupt or truncated file fails here, which is
+the validation) and applies the EXIF orientation in place. Resizing uses
+reduce() through resize(reducing_gap=...) before the final LANCZOS pass, and
+the output is encoded from that same image.
+
+Carousel, product and card images can also be emitted as responsive variants:
+the final frame re-encoded at a few smaller widths in WebP (and AVIF when the
+installed Pillow has an AVIF encoder), plus JPEG/PNG fallbacks, for srcset.
+"""
+
+import io
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+# Same default as Image.thumbnail(): draft/reduce down to 2x the target, then LANCZOS
+REDUCING_GAP = 2.0
+
+# EXIF orientations that swap width and height
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+# Category-specific optimization parameters for product images
+PRODUCT_IMAGE_SETTINGS = {
+    'Tanques': {
+        'max_size': (800, 600),
+        'quality': 92,
+        'description': 'High resolution for detailed tank views'
+    },
+    'Bombas': {
+        'max_size': (700, 525),
+        'quality': 90,
+        'description': 'Good detail for mechanical components'
+    },
+    'Filtros': {
+        'max_size': (600, 450),
+        'quality': 88,
+        'description': 'Clear view of filter systems'
+    },
+    'Accesorios': {
+        'max_size': (500, 375),
+        'quality': 85,
+        'description': 'Compact size for small accessories'
+    },
+    'Químicos': {
+        'max_size': (550, 400),
+        'quality': 87,
+        'description': 'Clear product labeling visibility'
+    },
+    'Herramientas': {
+        'max_size': (650, 500),
+        'quality': 89,
+        'description': 'Good detail for tool identification'
+    }
+}
+
+
+# Part of every content-addressed blob name (see processing_profile): bump it
+# whenever the optimization output changes so old blobs are not reused
+PROCESSING_VERSION = 1
+
+# Responsive widths per destination folder; the full-size frame is always a variant too
+VARIANT_WIDTHS = {
+    'carousel': (480, 960, 1440),
+    'productos': (320, 480),
+    'default': (250,),
+}
+
+# Modern formats tried in order of preference: (Pillow format, MIME type, save params)
+MODERN_FORMATS = (
+    ('AVIF', 'image/avif', {'quality': 60, 'speed': 8}),
+    ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+)
+
+
+class InvalidImageError(ValueError):
+    """The uploaded bytes are not a valid image"""
+
+
+class EmptyFileError(ValueError):
+    """The upload has no data"""
+
+
+# =====================
+# Decode / resize / encode
+# =====================
+
+def decode_image(file_data: bytes, max_size: Optional[Tuple[int, int]] = None) -> Image.Image:
+    """
+    Decode an image once, validated and upright
+
+    Args:
+        file_data: Raw uploaded bytes
+        max_size: Bounding box the image will be fitted into, if known. JPEGs
+            much larger than it are decoded at a reduced DCT scale (draft).
+
+    Returns:
+        Loaded image with EXIF orientation applied; its original format is
+        kept in image.format
+    """
+    try:
+        image = Image.open(io.BytesIO(file_data))
+        original_format = image.format
+
+        if max_size and original_format == 'JPEG':
+            target = max_size
+            if image.getexif().get(0x0112) in _TRANSPOSED_ORIENTATIONS:
+                # Draft works on stored pixels, before the rotation
+                target = (max_size[1], max_size[0])
+            scale = min(target[0] / image.width, target[1] / image.height)
+            if scale < 1:
+                image.draft('RGB', (int(image.width * scale * REDUCING_GAP),
+                                    int(image.height * scale * REDUCING_GAP)))
+
+        # Full decode: corrupt or truncated data raises here
+        image.load()
+    except Exception as e:
+        raise InvalidImageError(str(e)) from e
+
+    ImageOps.exif_transpose(image, in_place=True)
+    image.format = original_format
+    return image
+
+
+def validate_image(file_data: bytes) -> None:
+    """Raise InvalidImageError if the bytes cannot be parsed as an image"""
+    try:
+        img = Image.open(io.BytesIO(file_data))
+        img.verify()  # Verify that it's a valid image (headers only, no pixel decode)
+    except Exception as e:
+        raise InvalidImageError(str(e)) from e
+
+
+def to_rgb(image: Image.Image) -> Image.Image:
+    """Flatten transparency onto white and convert to RGB for JPEG output"""
+    if image.mode in ('RGBA', 'LA', 'P'):
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        return background
+    if image.mode != 'RGB':
+        return image.convert('RGB')
+    return image
+
+
+def fit_within(image: Image.Image, max_size: Tuple[int, int], min_scale_to_resize: float = 1.0) -> Image.Image:
+    """Downscale to fit max_size keeping the aspect ratio (never upscales)
+
+    Only resizes when the scale factor is below min_scale_to_resize.
+    """
+    scale_factor = min(max_size[0] / image.width, max_size[1] / image.height)
+    if scale_factor >= min_scale_to_resize or scale_factor >= 1:
+        return image
+    new_size = (max(1, int(image.width * scale_factor)), max(1, int(image.height * scale_factor)))
+    return image.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+
+
+def encode(image: Image.Image, format: str = 'JPEG', **params) -> bytes:
+    output = io.BytesIO()
+    image.save(output, format=format, **params)
+    return output.getvalue()
+
+
+# =====================
+# Optimization profiles (decoded image -> bytes)
+# =====================
+
+def standard_frame(image: Image.Image, max_size: Tuple[int, int] = (500, 375)) -> Image.Image:
+    """Image centered on a white canvas of exactly max_size"""
+    image = fit_within(to_rgb(image), max_size)
+    final_image = Image.new('RGB', max_size, (255, 255, 255))
+    x_offset = (max_size[0] - image.width) // 2
+    y_offset = (max_size[1] - image.height) // 2
+    final_image.paste(image, (x_offset, y_offset))
+    return final_image
+
+
+def standard_image(image: Image.Image, max_size: Tuple[int, int] = (500, 375), quality: int = 90) -> bytes:
+    """Card-sized JPEG centered on a white canvas of exactly max_size"""
+    return encode(standard_frame(image, max_size), 'JPEG', quality=quality, optimize=True)
+
+
+def carousel_frame(image: Image.Image, max_size: Tuple[int, int] = (1920, 1080)) -> Image.Image:
+    """Carousel pixels: transparent PNGs keep their alpha, everything else is RGB"""
+    keep_alpha = image.format == 'PNG' and image.mode in ('RGBA', 'LA')
+    # Only resize if image is much larger than target
+    image = fit_within(image, max_size, min_scale_to_resize=0.8)
+    return image if keep_alpha else to_rgb(image)
+
+
+def carousel_image(image: Image.Image, max_size: Tuple[int, int] = (1920, 1080), quality: int = 95) -> bytes:
+    """High quality carousel image; transparent PNGs stay PNG"""
+    return encode_fallback(carousel_frame(image, max_size), quality)
+
+
+def product_frame(image: Image.Image, category: str) -> Image.Image:
+    """Product image sized for its category, keeping natural proportions"""
+    settings = PRODUCT_IMAGE_SETTINGS.get(category, PRODUCT_IMAGE_SETTINGS['Accesorios'])
+    print(f"Optimizing {category} product image: {settings['description']} - "
+          f"{settings['max_size']} at {settings['quality']}% quality")
+    return fit_within(to_rgb(image), settings['max_size'])
+
+
+def product_image(image: Image.Image, category: str) -> bytes:
+    """Product JPEG sized for its category, keeping natural proportions"""
+    quality = PRODUCT_IMAGE_SETTINGS.get(category, PRODUCT_IMAGE_SETTINGS['Accesorios'])['quality']
+    return encode(product_frame(image, category), 'JPEG', quality=quality, optimize=True)
+
+
+def encode_fallback(frame: Image.Image, quality: int) -> bytes:
+    """Universally supported encoding of a frame: PNG if it has alpha, else JPEG"""
+    if frame.mode in ('RGBA', 'LA'):
+        # Keep transparency for PNG
+        return encode(frame, 'PNG', optimize=True, compress_level=6)
+    return encode(frame, 'JPEG', quality=quality, optimize=True)
+
+
+def _profile(folder: str, product_category: Optional[str]):
+    """(target box for decoding, frame builder, fallback JPEG quality, variant widths) for a folder"""
+    if folder == 'carousel':
+        return (1920, 1080), carousel_frame, 95, VARIANT_WIDTHS['carousel']
+    if folder == 'productos' and product_category:
+        settings = PRODUCT_IMAGE_SETTINGS.get(product_category, PRODUCT_IMAGE_SETTINGS['Accesorios'])
+        return (settings['max_size'], lambda image: product_frame(image, product_category),
+                settings['quality'], VARIANT_WIDTHS['productos'])
+    return (500, 375), standard_frame, 90, VARIANT_WIDTHS['default']
+
+
+def processing_profile(content_type: Optional[str], folder: str = "", optimize: bool = True,
+                       product_category: str = None) -> str:
+    """Identifier of what prepare_file_data will do to an upload
+
+    Identical bytes with the same profile always produce the same output, so
+    the pair can name the stored blob before any decoding happens.
+    """
+    if not optimize or not (content_type and content_type.startswith('image/')):
+        return 'original'
+    return f"v{PROCESSING_VERSION}:{folder}:{product_category or ''}"
+
+
+# =====================
+# Responsive variants
+# =====================
+
+@lru_cache(maxsize=None)
+def modern_formats() -> Tuple[Tuple[str, str, dict], ...]:
+    """MODERN_FORMATS the installed Pillow can encode (AVIF needs Pillow 11.2+ or pillow-avif-plugin)"""
+    try:
+        import pillow_avif  # noqa: F401  (registers the AVIF encoder on older Pillow)
+    except ImportError:
+        pass
+    Image.init()
+    return tuple(fmt for fmt in MODERN_FORMATS if fmt[0] in Image.SAVE)
+
+
+def build_variants(frame: Image.Image, widths, quality: int = 85) -> List[Dict]:
+    """
+    Encode a final frame at several widths for srcset
+
+    Every width below the frame width plus the frame width itself is encoded
+    in each modern format; the smaller widths also get a JPEG (or PNG if the
+    frame has alpha) fallback, the full-size fallback being the main upload.
+    Each smaller size is resized from the frame, not from the original photo.
+
+    Returns:
+        List of {'width', 'height', 'content_type', 'ext', 'data'}
+    """
+    sizes = sorted({w for w in widths if w < frame.width} | {frame.width})
+    formats = modern_formats()
+    variants = []
+    for width in sizes:
+        if width == frame.width:
+            image = frame
+        else:
+            height = max(1, round(frame.height * width / frame.width))
+            image = frame.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+        encodings = list(formats)
+        if width != frame.width:
+            if image.mode in ('RGBA', 'LA'):
+                encodings.append(('PNG', 'image/png', {'optimize': True, 'compress_level': 6}))
+            else:
+                encodings.append(('JPEG', 'image/jpeg', {'quality': quality, 'optimize': True, 'progressive': True}))
+        for fmt, mime, params in encodings:
+            try:
+                data = encode(image, fmt, **params)
+            except Exception as e:
+                print(f"Error encoding {width}px {fmt} variant: {str(e)}")
+                continue
+            variants.append({
+                'width': image.width,
+                'height': image.height,
+                'content_type': mime,
+                'ext': '.' + fmt.lower().replace('jpeg', 'jpg'),
+                'data': data,
+            })
+    return variants
+
+
+# =====================
+# Bytes API (kept for existing callers; fall back to the original bytes on errors)
+# =====================
+
+def optimize_image(file_data: bytes, max_size: Tuple[int, int] = (500, 375), quality: int = 90) -> bytes:
+    """Optimize image for web usage with better sizing for product cards"""
+    try:
+        return standard_image(decode_image(file_data, max_size), max_size, quality)
+    except Exception as e:
+        print(f"Error optimizing image: {str(e)}")
+        return file_data
+
+
+def optimize_carousel_image(file_data: bytes, max_size: Tuple[int, int] = (1920, 1080), quality: int = 95) -> bytes:
+    """Optimize image specifically for carousel usage with higher quality preservation"""
+    try:
+        return carousel_image(decode_image(file_data, max_size), max_size, quality)
+    except Exception as e:
+        print(f"Error optimizing carousel image: {str(e)}")
+        return file_data
+
+
+def optimize_product_image_by_category(file_data: bytes, category: str) -> bytes:
+    """Optimize product images based on their category with specific parameters"""
+    try:
+        max_size = _profile('productos', category)[0]
+        return product_image(decode_image(file_data, max_size), category)
+    except Exception as e:
+        print(f"Error optimizing {category} product image: {str(e)}")
+        return file_data
+
+
+def prepare_file_data(file_data: bytes, content_type: Optional[str], folder: str = "",
+                      optimize: bool = True, product_category: str = None) -> Tuple[bytes, Optional[str]]:
+    """Validate and optimize an upload before it is sent to storage
+
+    Images are decoded once (which validates them) and, if optimize is set,
+    re-encoded with the settings for their destination folder; other files are
+    returned unchanged.
+
+    Returns:
+        (bytes, content_type): the content type of the returned bytes, which
+        for optimized images is JPEG or PNG whatever the upload was
+    """
+    if not file_data:
+        raise EmptyFileError("File data is empty")
+    if not (content_type and content_type.startswith('image/')):
+        return file_data, content_type
+    if not optimize:
+        validate_image(file_data)
+        return file_data, content_type
+
+    main, main_type, _ = prepare_image_variants(file_data, content_type, folder, product_category, with_variants=False)
+    return main, main_type
+
+
+def prepare_image_variants(file_data: bytes, content_type: Optional[str], folder: str = "",
+                           product_category: str = None, with_variants: bool = True):
+    """Optimized main image plus its responsive variants, from a single decode
+
+    Returns:
+        (main_bytes, main_content_type, variants) where variants is the list
+        from build_variants (empty for non-images or if optimization failed)
+    """
+    if not file_data:
+        raise EmptyFileError("File data is empty")
+    if not (content_type and content_type.startswith('image/')):
+        return file_data, content_type, []
+
+    max_size, build_frame, quality, widths = _profile(folder, product_category)
+    image = decode_image(file_data, max_size)
+    try:
+        frame = build_frame(image)
+        main = encode_fallback(frame, quality)
+    except Exception as e:
+        print(f"Error optimizing image: {str(e)}")
+        return file_data, content_type, []
+    main_type = 'image/png' if frame.mode in ('RGBA', 'LA') else 'image/jpeg'
+    if not with_variants:
+        return main, main_type, []
+    return main, main_type, build_variants(frame, widths, min(quality, 85))
+
+
+if __name__ == '__main__':
+    # Benchmark over large phone photos: python image_processing.py [fotos] [iteraciones]
+    # Each variant runs in its own process so peak RSS is comparable.
+    import os
+    import resource
+    import subprocess
+    import sys
+    import tempfile
+    import time
+
+    def legacy_prepare(file_data: bytes) -> bytes:
+        """Previous upload path: verify twice, then decode at full size"""
+        for _ in range(2):
+            Image.open(io.BytesIO(file_data)).verify()
+        image = Image.open(io.BytesIO(file_data)).convert('RGB')
+        image = ImageOps.exif_transpose(image)
+        scale = min(500 / image.width, 375 / image.height)
+        if scale < 1:
+            image = image.resize((int(image.width * scale), int(image.height * scale)), Image.Resampling.LANCZOS)
+        final_image = Image.new('RGB', (500, 375), (255, 255, 255))
+        final_image.paste(image, ((500 - image.width) // 2, (375 - image.height) // 2))
+        return encode(final_image, 'JPEG', quality=90, optimize=True)
+
+    def peak_rss_kb() -> int:
+        """Peak resident memory of this process image (ru_maxrss survives exec on Linux)"""
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def phone_photos(count: int):
+        """12 MP JPEGs with camera-like noise, some rotated via EXIF"""
+        photos = []
+        for i in range(count):
+            image = Image.merge('RGB', [Image.effect_noise((4032, 3024), 30 + 10 * c) for c in range(3)])
+            exif = Image.Exif()
+            exif[0x0112] = 6 if i % 2 else 1
+            photos.append(encode(image, 'JPEG', quality=92, exif=exif.tobytes()))
+        return photos
+
+    if len(sys.argv) > 1 and sys.argv[1] in ('legacy', 'decode-once'):
+        variant, photo_dir, iterations = sys.argv[1], sys.argv[2], int(sys.argv[3])
+        photos = []
+        for name in sorted(os.listdir(photo_dir)):
+            with open(os.path.join(photo_dir, name), 'rb') as f:
+                photos.append(f.read())
+        base_rss = peak_rss_kb()
+        run = legacy_prepare if variant == 'legacy' else (lambda data: prepare_file_data(data, 'image/jpeg', 'cotizaciones'))
+        cpu = time.process_time()
+        for _ in range(iterations):
+            for data in photos:
+                run(data)
+        cpu = time.process_time() - cpu
+        peak = peak_rss_kb()
+        print(f"{variant:12s} CPU {cpu / (len(photos) * iterations) * 1000:7.1f} ms/photo   "
+              f"peak RSS {peak / 1024:6.1f} MB (+{(peak - base_rss) / 1024:.1f} MB over the loaded photos)")
+    else:
+        count = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+        iterations = sys.argv[2] if len(sys.argv) > 2 else '2'
+        with tempfile.TemporaryDirectory() as photo_dir:
+            for i, data in enumerate(phone_photos(count)):
+                with open(os.path.join(photo_dir, f'photo_{i}.jpg'), 'wb') as f:
+                    f.write(data)
+            print(f"{count} photos 4032x3024, {iterations} iterations, target 500x375")
+            for variant in ('legacy', 'decode-once'):
+                subprocess.run([sys.executable, __file__, variant, photo_dir, iterations], check=True)
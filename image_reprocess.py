@@ -0,0 +1,533 @@
+"""
+Reprocesado de imágenes de productos en segundo plano para DH2OCOL
+
+"Reprocesar Imágenes" en el admin ya no trabaja dentro de la petición HTTP:
+crea un trabajo en reproceso_imagenes y una fila por producto en
+reproceso_imagenes_items (el punto de control) y responde al momento. Un hilo
+por worker reclama lotes de productos con un UPDATE condicionado (como
+email_outbox.py, así dos workers nunca procesan el mismo) y los procesa en un
+pool de hilos: descarga la imagen, la optimiza con la configuración de su
+categoría, la sube con sus variantes responsive, actualiza el producto y borra
+la imagen anterior.
+
+Cada producto terminado queda marcado en su fila, de modo que un reinicio o un
+worker caído a mitad de lote no pierde lo hecho: los productos 'procesando' con
+el bloqueo caducado se vuelven a reclamar y el trabajo continúa donde quedó.
+Iniciar de nuevo mientras hay un trabajo en curso devuelve ese mismo trabajo.
+"""
+
+import atexit
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from werkzeug.datastructures import FileStorage
+
+from attachment_utils import get_session
+from cache_utils import invalidate_contenido
+from firebase_storage import firebase_storage, is_firebase_available
+from responsive_images import ensure_variantes_column, variantes_json, urls_variantes
+from storage_refs import borrar_si_no_usada
+from upload_pipeline import subir_con_variantes
+
+# Estados de un trabajo
+TRABAJO_EN_CURSO = 'en_curso'
+TRABAJO_COMPLETADO = 'completado'
+
+# Estados de cada producto del trabajo
+ITEM_PENDIENTE = 'pendiente'
+ITEM_PROCESANDO = 'procesando'
+ITEM_HECHO = 'hecho'
+ITEM_OMITIDO = 'omitido'
+ITEM_ERROR = 'error'
+ITEM_TERMINADOS = (ITEM_HECHO, ITEM_OMITIDO, ITEM_ERROR)
+
+MYSQL_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS reproceso_imagenes (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        estado VARCHAR(20) NOT NULL,
+        total INT NOT NULL DEFAULT 0,
+        creado DATETIME NOT NULL,
+        terminado DATETIME NULL,
+        INDEX idx_reproceso_imagenes_estado (estado)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS reproceso_imagenes_items (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        reproceso_id INT NOT NULL,
+        producto_id INT NOT NULL,
+        imagen_url VARCHAR(1000) NOT NULL,
+        categoria VARCHAR(100),
+        estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',
+        intentos INT NOT NULL DEFAULT 0,
+        bloqueado_hasta DATETIME NULL,
+        nueva_url VARCHAR(1000),
+        ultimo_error TEXT,
+        actualizado DATETIME NULL,
+        UNIQUE KEY uq_reproceso_producto (reproceso_id, producto_id),
+        INDEX idx_reproceso_items_estado (reproceso_id, estado)
+    )
+    """,
+)
+
+SQLITE_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS reproceso_imagenes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        estado VARCHAR(20) NOT NULL,
+        total INTEGER NOT NULL DEFAULT 0,
+        creado DATETIME NOT NULL,
+        terminado DATETIME
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_reproceso_imagenes_estado
+    ON reproceso_imagenes (estado)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS reproceso_imagenes_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        reproceso_id INTEGER NOT NULL,
+        producto_id INTEGER NOT NULL,
+        imagen_url VARCHAR(1000) NOT NULL,
+        categoria VARCHAR(100),
+        estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',
+        intentos INTEGER NOT NULL DEFAULT 0,
+        bloqueado_hasta DATETIME,
+        nueva_url VARCHAR(1000),
+        ultimo_error TEXT,
+        actualizado DATETIME,
+        UNIQUE (reproceso_id, producto_id)
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_reproceso_items_estado
+    ON reproceso_imagenes_items (reproceso_id, estado)
+    """,
+)
+
+
+class ImagenModificada(Exception):
+    """El producto cambió de imagen mientras se reprocesaba"""
+
+
+class ImageReprocessor:
+    """Tablas de reproceso + hilo que procesa los productos por lotes (uno por proceso)"""
+
+    def __init__(self, app=None, adapter=None):
+        self.app = None
+        self.adapter = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._pool = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._tables_ready = set()
+        if app is not None:
+            self.init_app(app, adapter)
+
+    def init_app(self, app, adapter):
+        """Asociar la aplicación y el adaptador de base de datos"""
+        self.app = app
+        self.adapter = adapter
+        app.extensions['image_reprocessor'] = self
+        # Con la primera petición de cada worker: retoma un trabajo a medias tras un reinicio
+        app.before_request(self._ensure_started)
+
+    @property
+    def config(self):
+        return self.app.config
+
+    @property
+    def db_type(self):
+        return self.config.get('DATABASE_TYPE', 'mysql').lower()
+
+    # =====================
+    # Tablas
+    # =====================
+
+    def ensure_tables(self, cursor):
+        """Crear las tablas del reproceso una sola vez por proceso"""
+        db_type = self.db_type
+        if db_type in self._tables_ready:
+            return
+        for ddl in (SQLITE_TABLES if db_type == 'sqlite' else MYSQL_TABLES):
+            cursor.execute(ddl)
+        ensure_variantes_column(cursor, db_type, 'productos')
+        self._tables_ready.add(db_type)
+
+    # =====================
+    # Trabajos
+    # =====================
+
+    def start_job(self, db):
+        """Crear un trabajo con todos los productos con imagen en Storage
+
+        Si ya hay uno en curso lo devuelve en lugar de crear otro, así repetir
+        la petición no duplica el trabajo. Devuelve el id del trabajo (None si
+        no hay imágenes que reprocesar).
+        """
+        cursor = db.cursor()
+        try:
+            self.ensure_tables(cursor)
+            cursor.execute(
+                "SELECT id FROM reproceso_imagenes WHERE estado = %s ORDER BY id DESC LIMIT 1",
+                (TRABAJO_EN_CURSO,)
+            )
+            activo = cursor.fetchone()
+            if activo:
+                trabajo_id = activo['id']
+            else:
+                cursor.execute(
+                    "SELECT id, imagen, categoria FROM productos "
+                    "WHERE imagen IS NOT NULL AND imagen LIKE %s ORDER BY id",
+                    ('https://%',)
+                )
+                productos = cursor.fetchall()
+                if not productos:
+                    return None
+                cursor.execute(
+                    "INSERT INTO reproceso_imagenes (estado, total, creado) VALUES (%s, %s, %s)",
+                    (TRABAJO_EN_CURSO, len(productos), datetime.now())
+                )
+                trabajo_id = cursor.lastrowid
+                cursor.executemany("""
+                    INSERT INTO reproceso_imagenes_items
+                    (reproceso_id, producto_id, imagen_url, categoria, estado)
+                    VALUES (%s, %s, %s, %s, %s)
+                """, [(trabajo_id, p['id'], p['imagen'], p['categoria'], ITEM_PENDIENTE) for p in productos])
+                db.commit()
+        finally:
+            cursor.close()
+
+        self._ensure_started()
+        self._wake.set()
+        return trabajo_id
+
+    def progress(self, db, trabajo_id=None):
+        """Estado de un trabajo (el último si no se indica) para la barra de progreso"""
+        cursor = db.cursor()
+        try:
+            self.ensure_tables(cursor)
+            if trabajo_id is None:
+                cursor.execute("SELECT * FROM reproceso_imagenes ORDER BY id DESC LIMIT 1")
+            else:
+                cursor.execute("SELECT * FROM reproceso_imagenes WHERE id = %s", (trabajo_id,))
+            trabajo = cursor.fetchone()
+            if not trabajo:
+                return None
+            cursor.execute("""
+                SELECT estado, COUNT(*) AS total FROM reproceso_imagenes_items
+                WHERE reproceso_id = %s GROUP BY estado
+            """, (trabajo['id'],))
+            por_estado = {row['estado']: row['total'] for row in cursor.fetchall()}
+            cursor.execute("""
+                SELECT producto_id, ultimo_error FROM reproceso_imagenes_items
+                WHERE reproceso_id = %s AND estado = %s ORDER BY producto_id LIMIT 20
+            """, (trabajo['id'], ITEM_ERROR))
+            errores = [{'producto_id': row['producto_id'], 'error': row['ultimo_error']}
+                       for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+        total = trabajo['total'] or 0
+        terminados = sum(por_estado.get(estado, 0) for estado in ITEM_TERMINADOS)
+        return {
+            'id': trabajo['id'],
+            'estado': trabajo['estado'],
+            'total': total,
+            'procesados': terminados,
+            'actualizados': por_estado.get(ITEM_HECHO, 0),
+            'omitidos': por_estado.get(ITEM_OMITIDO, 0),
+            'fallidos': por_estado.get(ITEM_ERROR, 0),
+            'pendientes': total - terminados,
+            'porcentaje': round(100 * terminados / total) if total else 100,
+            'creado': str(trabajo['creado']) if trabajo['creado'] else None,
+            'terminado': str(trabajo['terminado']) if trabajo['terminado'] else None,
+            'errores': errores,
+        }
+
+    # =====================
+    # Ciclo de vida del hilo
+    # =====================
+
+    def _ensure_started(self):
+        """Arrancar el hilo de reproceso en este proceso (ver visitor_ingest.py)"""
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == pid and self._thread is not None and self._thread.is_alive():
+                return
+            if self._pid != pid:
+                self._stop = threading.Event()
+                self._wake = threading.Event()
+                self._pool = None
+                self._pid = pid
+            self._thread = threading.Thread(
+                target=self._run, name='image-reprocess', daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Detener el hilo al salir; lo pendiente se retoma en el próximo arranque"""
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._wake.set()
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self):
+        interval = self.config.get('REPROCESS_POLL_INTERVAL', 30)
+        while not self._stop.is_set():
+            try:
+                procesados = self.process_batch()
+            except Exception as e:
+                print(f"Error en el reproceso de imágenes: {e}")
+                procesados = 0
+            if not procesados:
+                self._wake.wait(interval)
+                self._wake.clear()
+
+    # =====================
+    # Procesado
+    # =====================
+
+    def _claim(self, batch_size):
+        """Reclamar productos pendientes (o con el bloqueo caducado) de trabajos en curso"""
+        now = datetime.now()
+        lease = timedelta(seconds=self.config.get('REPROCESS_LEASE_SECONDS', 300))
+        db = self.adapter.connect(self.config)
+        cursor = db.cursor()
+        try:
+            self.ensure_tables(cursor)
+            cursor.execute("""
+                SELECT i.id FROM reproceso_imagenes_items i
+                JOIN reproceso_imagenes r ON r.id = i.reproceso_id
+                WHERE r.estado = %s
+                  AND (i.estado = %s OR (i.estado = %s AND i.bloqueado_hasta < %s))
+                ORDER BY i.id
+                LIMIT %s
+            """, (TRABAJO_EN_CURSO, ITEM_PENDIENTE, ITEM_PROCESANDO, now, batch_size))
+            candidatos = [row['id'] for row in cursor.fetchall()]
+
+            reclamados = []
+            for item_id in candidatos:
+                cursor.execute("""
+                    UPDATE reproceso_imagenes_items
+                    SET estado = %s, bloqueado_hasta = %s, intentos = intentos + 1
+                    WHERE id = %s
+                      AND (estado = %s OR (estado = %s AND bloqueado_hasta < %s))
+                """, (ITEM_PROCESANDO, now + lease, item_id,
+                      ITEM_PENDIENTE, ITEM_PROCESANDO, now))
+                if cursor.rowcount == 1:
+                    reclamados.append(item_id)
+            db.commit()
+
+            if not reclamados:
+                return []
+            placeholders = ', '.join(['%s'] * len(reclamados))
+            cursor.execute(
+                f"SELECT * FROM reproceso_imagenes_items WHERE id IN ({placeholders}) ORDER BY id",
+                tuple(reclamados)
+            )
+            return cursor.fetchall()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            cursor.close()
+            db.close()
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=self.config.get('REPROCESS_WORKERS', 4),
+                        thread_name_prefix='image-reprocess'
+                    )
+        return self._pool
+
+    def process_batch(self, batch_size=None):
+        """Reprocesar un lote de productos; devuelve cuántos se reclamaron"""
+        if not is_firebase_available():
+            return 0
+        batch_size = batch_size or self.config.get('REPROCESS_BATCH_SIZE', 8)
+        items = self._claim(batch_size)
+        if not items:
+            return 0
+
+        futuros = [(item, self._get_pool().submit(self.reprocess_image, item)) for item in items]
+        actualizados = 0
+        for item, futuro in futuros:
+            try:
+                futuro.result()
+            except ImagenModificada as e:
+                self._finish(item, ITEM_OMITIDO, error=str(e))
+            except Exception as e:
+                print(f"Error reprocesando imagen del producto {item['producto_id']}: {e}")
+                self._fail(item, e)
+            else:
+                actualizados += 1
+
+        if actualizados:
+            self._invalidate_pages()
+        self._complete_jobs({item['reproceso_id'] for item in items})
+        return len(items)
+
+    def _download(self, url):
+        # Con el almacenamiento local la imagen se lee del disco
+        local = firebase_storage.read_stored(url)
+        if local is not None:
+            return local
+        response = get_session().get(url, timeout=self.config.get('REPROCESS_DOWNLOAD_TIMEOUT', 30))
+        if response.status_code != 200:
+            raise IOError(f'HTTP {response.status_code} al descargar {url}')
+        return response.content, response.headers.get('Content-Type', 'image/jpeg')
+
+    def reprocess_image(self, item):
+        """Descargar, optimizar por categoría y volver a subir la imagen de un producto
+
+        El producto solo se actualiza si sigue teniendo la misma imagen que al
+        crear el trabajo; la imagen anterior y sus variantes se borran después
+        de confirmar el cambio.
+        """
+        datos, content_type = self._download(item['imagen_url'])
+        archivo = FileStorage(
+            stream=io.BytesIO(datos),
+            filename=f"producto_{item['producto_id']}.jpg",
+            content_type=content_type if content_type.startswith('image/') else 'image/jpeg'
+        )
+        nueva_url, variantes = subir_con_variantes(
+            archivo,
+            folder='productos',
+            product_category=item['categoria'] or 'Accesorios',
+            deadline_seconds=self.config.get('REPROCESS_ITEM_DEADLINE', 60),
+            cpu_workers=self.config.get('IMAGE_PROCESS_WORKERS', 0),
+            io_workers=self.config.get('STORAGE_IO_WORKERS', 4),
+        )
+        if not nueva_url:
+            raise RuntimeError('No se pudo optimizar o subir la imagen')
+
+        db = self.adapter.connect(self.config)
+        cursor = db.cursor()
+        try:
+            cursor.execute("SELECT * FROM productos WHERE id = %s", (item['producto_id'],))
+            producto = cursor.fetchone()
+            anteriores = producto.get('variantes') if producto else None
+            cursor.execute(
+                "UPDATE productos SET imagen = %s, variantes = %s WHERE id = %s AND imagen = %s",
+                (nueva_url, variantes_json(variantes), item['producto_id'], item['imagen_url'])
+            )
+            if cursor.rowcount != 1:
+                db.rollback()
+                modificada = True
+            else:
+                cursor.execute("""
+                    UPDATE reproceso_imagenes_items
+                    SET estado = %s, nueva_url = %s, bloqueado_hasta = NULL,
+                        ultimo_error = NULL, actualizado = %s
+                    WHERE id = %s
+                """, (ITEM_HECHO, nueva_url, datetime.now(), item['id']))
+                db.commit()
+                modificada = False
+        except Exception:
+            db.rollback()
+            self._release(nueva_url, variantes)
+            raise
+        finally:
+            cursor.close()
+            db.close()
+
+        if modificada:
+            self._release(nueva_url, variantes)
+            raise ImagenModificada('La imagen del producto cambió durante el reproceso')
+        self._release(item['imagen_url'], anteriores, conservar=nueva_url)
+        return nueva_url
+
+    def _release(self, url, variantes, conservar=None):
+        """Borrar una imagen y sus variantes si ya ninguna fila las usa
+
+        Los blobs se nombran por contenido y pueden estar compartidos con otro
+        producto o medio; un fallo aquí deja como mucho blobs huérfanos.
+        """
+        if not url or url == conservar:
+            return
+        db = self.adapter.connect(self.config)
+        cursor = db.cursor()
+        try:
+            extra = [u for u in urls_variantes(variantes) if u != conservar]
+            if not borrar_si_no_usada(cursor, url, extra):
+                print(f"Advertencia: No se pudo eliminar {url}")
+        except Exception as e:
+            print(f"Error al eliminar {url}: {e}")
+        finally:
+            cursor.close()
+            db.close()
+
+    def _update(self, query, params):
+        db = self.adapter.connect(self.config)
+        cursor = db.cursor()
+        try:
+            cursor.execute(query, params)
+            db.commit()
+        finally:
+            cursor.close()
+            db.close()
+
+    def _finish(self, item, estado, error=None):
+        try:
+            self._update("""
+                UPDATE reproceso_imagenes_items
+                SET estado = %s, bloqueado_hasta = NULL, ultimo_error = %s, actualizado = %s
+                WHERE id = %s
+            """, (estado, str(error)[:1000] if error else None, datetime.now(), item['id']))
+        except Exception as e:
+            # El bloqueo caducará y el producto se volverá a intentar
+            print(f"Error registrando el reproceso del producto {item['producto_id']}: {e}")
+
+    def _fail(self, item, error):
+        """Volver a dejarlo pendiente o, tras REPROCESS_MAX_ATTEMPTS intentos, en error"""
+        agotado = (item['intentos'] or 0) >= self.config.get('REPROCESS_MAX_ATTEMPTS', 3)
+        self._finish(item, ITEM_ERROR if agotado else ITEM_PENDIENTE, error)
+
+    def _complete_jobs(self, trabajo_ids):
+        """Marcar como completados los trabajos sin productos por terminar"""
+        terminados = ', '.join(['%s'] * len(ITEM_TERMINADOS))
+        for trabajo_id in trabajo_ids:
+            try:
+                self._update(f"""
+                    UPDATE reproceso_imagenes SET estado = %s, terminado = %s
+                    WHERE id = %s AND estado = %s
+                      AND NOT EXISTS (
+                          SELECT 1 FROM reproceso_imagenes_items
+                          WHERE reproceso_id = %s AND estado NOT IN ({terminados})
+                      )
+                """, (TRABAJO_COMPLETADO, datetime.now(), trabajo_id, TRABAJO_EN_CURSO,
+                      trabajo_id, *ITEM_TERMINADOS))
+            except Exception as e:
+                print(f"Error cerrando el trabajo de reproceso {trabajo_id}: {e}")
+
+    def _invalidate_pages(self):
+        """Las páginas públicas cacheadas muestran las URLs de las imágenes"""
+        db = self.adapter.connect(self.config)
+        try:
+            with self.app.app_context():
+                invalidate_contenido(db, commit=True)
+        except Exception as e:
+            print(f"Error invalidando caché de páginas: {e}")
+        finally:
+            db.close()
+
+
+image_reprocessor = ImageReprocessor()
+
+atexit.register(image_reprocessor.stop)
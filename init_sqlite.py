@@ -46,6 +46,7 @@ def get_sqlite_schema():
             precio DECIMAL(10,2),
             categoria VARCHAR(50),
             imagen VARCHAR(1000),
+            variantes TEXT,
             stock INTEGER DEFAULT 0,
             activo INTEGER DEFAULT 1,
             fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -87,9 +88,13 @@ def get_sqlite_schema():
             tamano INTEGER,
             descripcion TEXT,
             ruta VARCHAR(1000) NOT NULL,
+            variantes TEXT,
+            hash_contenido VARCHAR(64),
             fecha_subida TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )""",
         
+        """CREATE INDEX IF NOT EXISTS idx_medios_hash_contenido ON medios (hash_contenido)""",
+        
         # Tabla de configuración
         """CREATE TABLE IF NOT EXISTS configuracion (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
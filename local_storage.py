@@ -0,0 +1,242 @@
+"""
+Local-disk storage backend for DH2OCOL application
+Stores media on this host (STORAGE_BACKEND=local) with the same API as
+FirebaseStorageManager, so uploads need no network round trip
+"""
+
+import os
+import posixpath
+import tempfile
+import mimetypes
+import urllib.parse
+from datetime import datetime
+from typing import Optional, Tuple, List
+from flask import Response, abort, send_file
+from storage_backend import StorageBackend, CACHE_CONTROL, VARIANT_CONTENT_TYPES
+
+
+class LocalStorageBackend(StorageBackend):
+    """
+    Stores files under a root directory and serves them at base_url
+
+    A file named 'productos/<sha256>.jpg' lives at
+    <root>/productos/<sh>/<a2>/<sha256>.jpg: the first two pairs of characters
+    of the (content-addressed) name shard each folder so no directory grows to
+    hundreds of thousands of entries. Its responsive variants
+    ('<sha256>_w480.avif', ...) land in the same shard directory, so looking
+    them up is a single directory listing. Writes go to a temporary file in the
+    target directory followed by os.replace(), so a reader never sees a
+    partially written file.
+    """
+
+    label = "Local storage"
+
+    def __init__(self, root: str, base_url: str = '/media'):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip('/')
+        # Path part of base_url: the route that serves the files (see app.py)
+        self.url_path = urllib.parse.urlparse(self.base_url).path.rstrip('/') or '/media'
+        self.initialized = False
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            self.initialized = True
+            print(f"Local storage initialized at {self.root}")
+        except OSError as e:
+            print(f"Error initializing local storage at {self.root}: {str(e)}")
+
+    def is_initialized(self) -> bool:
+        """Check if the storage directory is usable"""
+        return self.initialized
+
+    # =====================
+    # Names, paths and URLs
+    # =====================
+
+    def relative_path(self, filename: str) -> Optional[str]:
+        """Sharded path of a file relative to root, or None for an invalid name"""
+        parts = filename.split('/')
+        if any(part in ('', '.', '..') or '\\' in part or part.startswith('.') for part in parts):
+            return None
+        base = parts[-1]
+        shard = (base + '__')[:4]
+        return posixpath.join(*parts[:-1], shard[:2], shard[2:4], base)
+
+    def file_path(self, filename: str) -> Optional[str]:
+        """Absolute path of a stored file, or None for an invalid name"""
+        relative = self.relative_path(filename)
+        if relative is None:
+            return None
+        return os.path.join(self.root, *relative.split('/'))
+
+    def public_url(self, filename: str) -> str:
+        return f"{self.base_url}/{urllib.parse.quote(filename)}"
+
+    def filename_from_url(self, file_url: str) -> Optional[str]:
+        """Stored name behind a public URL of this backend, or None"""
+        parsed = urllib.parse.urlparse(file_url)
+        base = urllib.parse.urlparse(self.base_url)
+        if parsed.netloc and base.netloc and parsed.netloc != base.netloc:
+            return None
+        prefix = self.url_path + '/'
+        if not parsed.path.startswith(prefix):
+            return None
+        return urllib.parse.unquote(parsed.path[len(prefix):]) or None
+
+    @staticmethod
+    def content_type_for(filename: str) -> str:
+        ext = os.path.splitext(filename)[1].lower()
+        return (VARIANT_CONTENT_TYPES.get(ext) or mimetypes.guess_type(filename)[0]
+                or 'application/octet-stream')
+
+    # =====================
+    # Storage operations
+    # =====================
+
+    def existing_public_url(self, filename: str) -> Optional[str]:
+        """Public URL of a stored file if it exists (one stat call)"""
+        path = self.file_path(filename)
+        return self.public_url(filename) if path and os.path.isfile(path) else None
+
+    def _list_names(self, prefix: str) -> List[Tuple[str, str]]:
+        """(name, public_url) of the files whose name starts with prefix"""
+        folder, base = posixpath.split(prefix)
+        if len(base) >= 4:
+            # Every name sharing the first four characters lives in one directory
+            directory = os.path.dirname(self.file_path(prefix) or '')
+            if not directory or not os.path.isdir(directory):
+                return []
+            names = [posixpath.join(folder, entry) for entry in os.listdir(directory)
+                     if entry.startswith(base)]
+        else:
+            names = [f['name'] for f in self.list_files(folder, limit=None)
+                     if posixpath.basename(f['name']).startswith(base)]
+        return [(name, self.public_url(name)) for name in names]
+
+    def upload_named(self, file_data: bytes, filename: str, content_type: Optional[str]) -> str:
+        """
+        Write bytes under an exact name atomically (temporary file + rename)
+
+        Returns:
+            Public URL of the stored file (raises on invalid names or I/O errors)
+        """
+        path = self.file_path(filename)
+        if path is None:
+            raise ValueError(f"Invalid storage name: {filename}")
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(file_data)
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp creates 0600 files; the web server must be able to read them
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        print(f"Local storage: File stored at {path}")
+        return self.public_url(filename)
+
+    def read_stored(self, file_url: str) -> Optional[Tuple[bytes, str]]:
+        """(bytes, content_type) of a file of this backend, read from disk"""
+        filename = self.filename_from_url(file_url)
+        path = self.file_path(filename) if filename else None
+        if not path or not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read(), self.content_type_for(filename)
+
+    def delete_file(self, file_url: str) -> bool:
+        """
+        Delete a file using its public URL
+
+        Returns:
+            True if deleted successfully, False otherwise
+        """
+        if not self.is_initialized():
+            return False
+        filename = self.filename_from_url(file_url)
+        path = self.file_path(filename) if filename else None
+        if not path:
+            print(f"Could not extract file name from URL: {file_url}")
+            return False
+        try:
+            os.remove(path)
+            return True
+        except OSError as e:
+            print(f"Error deleting file: {str(e)}")
+            return False
+
+    def list_files(self, folder: str = "", limit: Optional[int] = 100) -> List[dict]:
+        """
+        List files in a specific folder (and its subfolders)
+
+        Returns:
+            List of file information dictionaries
+        """
+        if not self.is_initialized():
+            return []
+        folder = folder.strip('/')
+        start = os.path.join(self.root, *folder.split('/')) if folder else self.root
+        files = []
+        try:
+            for directory, subdirs, entries in os.walk(start):
+                subdirs.sort()
+                relative = os.path.relpath(directory, self.root).replace(os.sep, '/').split('/')
+                # Drop the two shard levels to get back the stored name
+                name_folder = '/'.join(relative[:-2]) if len(relative) >= 2 and relative[0] != '.' else None
+                for entry in sorted(entries):
+                    if entry.startswith('.') or name_folder is None:
+                        continue
+                    name = posixpath.join(name_folder, entry) if name_folder else entry
+                    stat = os.stat(os.path.join(directory, entry))
+                    files.append({
+                        'name': name,
+                        'url': self.public_url(name),
+                        'size': stat.st_size,
+                        'created': datetime.fromtimestamp(stat.st_ctime),
+                        'updated': datetime.fromtimestamp(stat.st_mtime),
+                        'content_type': self.content_type_for(entry)
+                    })
+                    if limit is not None and len(files) >= limit:
+                        return files
+        except OSError as e:
+            print(f"Error listing files: {str(e)}")
+        return files
+
+    def get_signed_url(self, filename: str, expiration_hours: int = 1) -> Optional[str]:
+        """Local files are public: their URL needs no signature"""
+        if not self.is_initialized():
+            return None
+        return self.existing_public_url(filename)
+
+    # =====================
+    # Serving
+    # =====================
+
+    def serve(self, filename: str, x_accel_prefix: Optional[str] = None) -> Response:
+        """
+        Response for GET <url_path>/<filename> with immutable cache headers
+
+        With x_accel_prefix (an nginx 'internal' location aliased to root) the
+        body is left to nginx through X-Accel-Redirect; otherwise the file is
+        sent from Python with conditional/range support.
+        """
+        relative = self.relative_path(filename)
+        path = self.file_path(filename) if relative else None
+        if not path or not os.path.isfile(path):
+            abort(404)
+        content_type = self.content_type_for(filename)
+        if x_accel_prefix:
+            response = Response(status=200, mimetype=content_type)
+            response.headers['X-Accel-Redirect'] = f"{x_accel_prefix.rstrip('/')}/{urllib.parse.quote(relative)}"
+        else:
+            response = send_file(path, mimetype=content_type, conditional=True, etag=True,
+                                 max_age=31536000)
+        response.headers['Cache-Control'] = CACHE_CONTROL
+        return response
@@ -0,0 +1,140 @@
+"""
+Transporte SMTP con conexión persistente para DH2OCOL
+
+Mail.send() de Flask-Mail abre una conexión SMTP (y hace STARTTLS y login) por
+cada mensaje. SMTPTransport mantiene abierta una conexión de mail.connect() por
+proceso y envía por ella los mensajes sucesivos (p. ej. el lote que reclama el
+hilo de email_outbox.py). Si la conexión lleva inactiva más de
+MAIL_KEEPALIVE_IDLE segundos se renueva, y si el servidor la cerró se reconecta
+y se reintenta el mensaje una vez.
+"""
+
+import os
+import smtplib
+import threading
+import time
+
+# Errores tras los que la conexión ya no sirve y conviene reintentar en una nueva
+_ERRORES_DESCONEXION = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+def _es_desconexion(error):
+    if isinstance(error, _ERRORES_DESCONEXION):
+        return True
+    # 421: el servidor cierra el canal (límite de sesión, apagado...)
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code == 421
+
+
+class SMTPTransport:
+    """Una conexión SMTP keep-alive por proceso, compartida con un lock"""
+
+    def __init__(self, mail_ext, idle_timeout=30):
+        self.mail = mail_ext
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._pid = None
+        self._conn = None
+        self._last_used = 0.0
+        self.counters = {'sent': 0, 'connections': 0, 'reconnects': 0}
+
+    def _connect(self):
+        conn = self.mail.connect()
+        conn.__enter__()
+        self._conn = conn
+        self._pid = os.getpid()
+        self.counters['connections'] += 1
+        return conn
+
+    def _discard(self):
+        """Cerrar la conexión actual sin propagar errores"""
+        conn, self._conn = self._conn, None
+        if conn is None or self._pid != os.getpid():
+            return
+        try:
+            if conn.host is not None:
+                conn.host.quit()
+        except Exception:
+            try:
+                conn.host.close()
+            except Exception:
+                pass
+
+    def _connection(self):
+        """Conexión lista para usar: nueva tras un fork o tras mucho tiempo inactiva"""
+        if self._conn is not None and self._pid != os.getpid():
+            # Heredada del master: el socket no es nuestro
+            self._conn = None
+        if self._conn is not None and time.monotonic() - self._last_used > self.idle_timeout:
+            self._discard()
+        if self._conn is None:
+            self._connect()
+        return self._conn
+
+    def send(self, msg):
+        """Enviar un mensaje (requiere contexto de aplicación, como Mail.send)"""
+        with self._lock:
+            try:
+                self._connection().send(msg)
+            except Exception as e:
+                if not _es_desconexion(e):
+                    if not isinstance(e, smtplib.SMTPResponseException):
+                        # Estado de la sesión desconocido: mejor empezar de cero
+                        self._discard()
+                    raise
+                self._discard()
+                self.counters['reconnects'] += 1
+                self._connect().send(msg)
+            self._last_used = time.monotonic()
+            self.counters['sent'] += 1
+
+    def close(self):
+        with self._lock:
+            self._discard()
+
+    def close_if_idle(self):
+        """Cerrar la conexión si lleva más de idle_timeout sin usarse"""
+        if self._conn is None or time.monotonic() - self._last_used <= self.idle_timeout:
+            return
+        with self._lock:
+            if self._conn is not None and time.monotonic() - self._last_used > self.idle_timeout:
+                self._discard()
+
+
+if __name__ == '__main__':
+    # Comparar Mail.send() con el transporte persistente contra un servidor SMTP local:
+    #   python -m smtpd -n -c DebuggingServer 127.0.0.1:2525 > /dev/null
+    #   python mail_transport.py 127.0.0.1 2525 200
+    import sys
+
+    from flask import Flask
+    from flask_mail import Mail, Message
+
+    host = sys.argv[1] if len(sys.argv) > 1 else '127.0.0.1'
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 2525
+    total = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+    app = Flask(__name__)
+    app.config.update(MAIL_SERVER=host, MAIL_PORT=port, MAIL_USE_TLS=False,
+                      MAIL_DEFAULT_SENDER='noreply@dh2ocol.com')
+    mail = Mail(app)
+
+    def mensaje(i):
+        return Message(f'Prueba {i}', recipients=['admin@dh2ocol.com'], body='Hola ' * 200)
+
+    with app.app_context():
+        inicio = time.perf_counter()
+        for i in range(total):
+            mail.send(mensaje(i))
+        por_mensaje = time.perf_counter() - inicio
+
+        transport = SMTPTransport(mail)
+        inicio = time.perf_counter()
+        for i in range(total):
+            transport.send(mensaje(i))
+        persistente = time.perf_counter() - inicio
+        transport.close()
+
+    print(f"{total} mensajes")
+    print(f"  Mail.send (una conexión por mensaje): {por_mensaje:.3f} s  ({total / por_mensaje:.0f} msg/s)")
+    print(f"  SMTPTransport (conexión persistente): {persistente:.3f} s  ({total / persistente:.0f} msg/s)")
+    print(f"  Conexiones abiertas: {transport.counters['connections']}")
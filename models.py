@@ -32,6 +32,7 @@ class DatabaseManager:
                 nombre VARCHAR(255) NOT NULL,
                 descripcion TEXT,
                 imagen VARCHAR(1000),
+                variantes TEXT,
                 precio DECIMAL(10,2),
                 categoria VARCHAR(100),
                 stock INT DEFAULT 0,
@@ -276,6 +277,7 @@ def get_mysql_init_sql():
             precio DECIMAL(10,2),
             categoria VARCHAR(50),
             imagen VARCHAR(1000),
+            variantes TEXT,
             stock INT DEFAULT 0,
             activo BOOLEAN DEFAULT TRUE,
             fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -325,7 +327,10 @@ def get_mysql_init_sql():
             tamano INT,
             descripcion TEXT,
             ruta VARCHAR(1000) NOT NULL,
-            fecha_subida TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            variantes TEXT,
+            hash_contenido CHAR(64) NULL,
+            fecha_subida TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_medios_hash_contenido (hash_contenido)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci""",
         
         # Tabla de configuración del sitio
@@ -0,0 +1,97 @@
+"""
+Variantes responsive de imágenes para DH2OCOL
+
+Las imágenes del carrusel, de productos y de medios se suben junto con copias
+a varios anchos en WebP/AVIF y JPEG (ver image_processing.build_variants). Las
+URLs se guardan como JSON en la columna `variantes` de medios/productos:
+
+    {"image/avif": [{"w": 480, "url": "..."}, ...],
+     "image/webp": [...],
+     "image/jpeg": [...]}
+
+con cada lista ordenada por ancho. Las plantillas las convierten en srcset con
+los filtros firebase_srcset y variant_sources (app.py).
+"""
+
+import json
+
+# Formatos modernos en orden de preferencia para los <source> de <picture>
+TIPOS_MODERNOS = ('image/avif', 'image/webp')
+# Respaldo para navegadores sin WebP/AVIF (el srcset del <img>)
+TIPOS_RESPALDO = ('image/jpeg', 'image/png')
+
+TABLAS_CON_VARIANTES = ('medios', 'productos')
+
+_columnas_listas = set()
+
+
+def agrupar_variantes(subidas):
+    """Dict de variantes a partir de una lista de (ancho, content_type, url)"""
+    variantes = {}
+    for ancho, content_type, url in subidas:
+        variantes.setdefault(content_type, []).append({'w': ancho, 'url': url})
+    for lista in variantes.values():
+        lista.sort(key=lambda v: v['w'])
+    return variantes
+
+
+def variantes_json(variantes):
+    """Valor para la columna `variantes` (None si no hay variantes)"""
+    return json.dumps(variantes, separators=(',', ':')) if variantes else None
+
+
+def cargar_variantes(valor):
+    """Dict de variantes desde el valor de la columna (JSON, dict o vacío)"""
+    if not valor:
+        return {}
+    if isinstance(valor, dict):
+        return valor
+    try:
+        variantes = json.loads(valor)
+    except (TypeError, ValueError):
+        return {}
+    return variantes if isinstance(variantes, dict) else {}
+
+
+def tipos_modernos(valor):
+    """Tipos modernos disponibles, en orden de preferencia"""
+    variantes = cargar_variantes(valor)
+    return [tipo for tipo in TIPOS_MODERNOS if variantes.get(tipo)]
+
+
+def srcset(valor, content_type=None, resolver=None):
+    """Atributo srcset ("url 480w, url 960w") de un tipo; sin tipo, el de respaldo"""
+    variantes = cargar_variantes(valor)
+    if content_type is None:
+        content_type = next((t for t in TIPOS_RESPALDO if variantes.get(t)), None)
+    entradas = []
+    for variante in variantes.get(content_type) or []:
+        url = resolver(variante['url']) if resolver else variante['url']
+        if url:
+            entradas.append(f"{url} {int(variante['w'])}w")
+    return ', '.join(entradas)
+
+
+def urls_variantes(valor):
+    """Todas las URLs guardadas en las variantes (para borrarlas con la imagen)"""
+    return [v['url'] for lista in cargar_variantes(valor).values() for v in lista if v.get('url')]
+
+
+def ensure_variantes_column(cursor, db_type, tabla):
+    """Agregar la columna `variantes` a medios/productos una sola vez por proceso"""
+    if tabla not in TABLAS_CON_VARIANTES or (db_type, tabla) in _columnas_listas:
+        return
+    try:
+        if db_type == 'sqlite':
+            cursor.execute(f"PRAGMA table_info({tabla})")
+            cols = cursor.fetchall()
+            col_names = [c['name'] for c in cols]
+            if 'variantes' not in col_names:
+                cursor.execute(f"ALTER TABLE {tabla} ADD COLUMN variantes TEXT")
+        else:
+            cursor.execute(f"SHOW COLUMNS FROM {tabla} LIKE 'variantes'")
+            if not cursor.fetchone():
+                cursor.execute(f"ALTER TABLE {tabla} ADD COLUMN variantes TEXT NULL")
+        _columnas_listas.add((db_type, tabla))
+    except Exception as col_err:
+        print(f"Advertencia al agregar columna variantes a {tabla} ({db_type}): {col_err}")
@@ -0,0 +1,126 @@
+"""
+Traducción de SQL de MySQL a SQLite para DH2OCOL
+
+Las consultas del proyecto se escriben para MySQL (placeholders %s, TRUE/FALSE,
+BOOLEAN, AUTO_INCREMENT). En desarrollo SQLiteCursorWrapper las traduce con
+traducir_a_sqlite(), que recorre la sentencia una sola vez separando literales
+('...', "..."), identificadores (`...`) y comentarios del resto: solo se
+traduce el código SQL, nunca el contenido de un literal. El resultado se
+memoriza en una LRU acotada por el texto original, así que repetir una consulta
+cuesta una búsqueda en diccionario.
+
+    python sql_dialect.py    # benchmark sobre las consultas reales del proyecto
+"""
+
+import re
+from functools import lru_cache
+
+# Palabras (fuera de literales) que SQLite escribe distinto
+PALABRAS_SQLITE = {
+    'AUTO_INCREMENT': 'AUTOINCREMENT',
+    'BOOLEAN': 'INTEGER',
+    'TRUE': '1',
+    'FALSE': '0',
+}
+
+# Sentencias distintas que se memorizan (las IN (%s, %s, ...) varían en longitud)
+CACHE_SIZE = 1024
+
+_TOKEN = re.compile(r"""
+      (?P<literal>'(?:[^'\\]|\\.|'')*'?)      # 'texto' (con \\' o '' escapados)
+    | (?P<comillas>"(?:[^"\\]|\\.|"")*"?)     # "texto" (literal en MySQL)
+    | (?P<ident>`[^`]*`?)                     # `identificador`
+    | (?P<comentario>--[^\n]*|\#[^\n]*|/\*.*?(?:\*/|$))
+    | (?P<placeholder>%s)
+    | (?P<escape>%%)
+    | (?P<palabra>[A-Za-z_][A-Za-z0-9_$]*)
+""", re.VERBOSE | re.DOTALL)
+
+
+def _traducir(query):
+    """Traducir una sentencia token a token (sin caché)"""
+    partes = []
+    inicio = 0
+    for token in _TOKEN.finditer(query):
+        tipo = token.lastgroup
+        if tipo == 'placeholder':
+            partes.append(query[inicio:token.start()])
+            partes.append('?')
+            inicio = token.end()
+        elif tipo == 'palabra':
+            nueva = PALABRAS_SQLITE.get(token.group().upper())
+            if nueva is not None:
+                partes.append(query[inicio:token.start()])
+                partes.append(nueva)
+                inicio = token.end()
+        # Literales, identificadores, comentarios y %% quedan tal cual
+    partes.append(query[inicio:])
+    return ''.join(partes)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def traducir_a_sqlite(query):
+    """Sentencia MySQL traducida a SQLite (memorizada por su texto)"""
+    return _traducir(query)
+
+
+def estadisticas_cache():
+    """Aciertos, fallos y tamaño de la caché de traducciones"""
+    return traducir_a_sqlite.cache_info()._asdict()
+
+
+# =====================
+# Benchmark
+# =====================
+
+def _consultas_del_proyecto():
+    """Cadenas SQL literales de los módulos del proyecto"""
+    import ast
+    import glob
+    import os
+
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    archivos = glob.glob(os.path.join(raiz, '*.py')) + glob.glob(os.path.join(raiz, 'blueprints', '*.py'))
+    inicio_sql = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|CREATE|ALTER|REPLACE|SHOW|PRAGMA)\b')
+    consultas = []
+    for archivo in sorted(archivos):
+        with open(archivo, encoding='utf-8') as f:
+            arbol = ast.parse(f.read())
+        for nodo in ast.walk(arbol):
+            if isinstance(nodo, ast.Constant) and isinstance(nodo.value, str) and inicio_sql.match(nodo.value):
+                consultas.append(nodo.value)
+    return consultas
+
+
+def _traducir_con_replace(query):
+    """Traducción anterior (cinco str.replace sobre toda la sentencia), para comparar"""
+    query = query.replace('%s', '?')
+    query = query.replace('AUTO_INCREMENT', 'AUTOINCREMENT')
+    query = query.replace('BOOLEAN', 'INTEGER')
+    query = query.replace('TRUE', '1')
+    return query.replace('FALSE', '0')
+
+
+def _benchmark(repeticiones=200):
+    import timeit
+
+    consultas = _consultas_del_proyecto()
+    total = len(consultas) * repeticiones
+    print(f"{len(consultas)} consultas del proyecto x {repeticiones} repeticiones")
+
+    distintas = [q for q in consultas if _traducir(q) != _traducir_con_replace(q)]
+    print(f"Consultas cuya traducción cambia respecto a str.replace: {len(distintas)}")
+
+    def medir(nombre, funcion):
+        segundos = timeit.timeit(lambda: [funcion(q) for q in consultas], number=repeticiones)
+        print(f"  {nombre:<28} {segundos * 1e9 / total:8.0f} ns/consulta")
+
+    medir('str.replace (anterior)', _traducir_con_replace)
+    medir('tokenizador sin caché', _traducir)
+    traducir_a_sqlite.cache_clear()
+    medir('tokenizador con caché LRU', traducir_a_sqlite)
+    print(f"  caché: {estadisticas_cache()}")
+
+
+if __name__ == '__main__':
+    _benchmark()
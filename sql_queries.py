@@ -0,0 +1,197 @@
+"""
+Registro de consultas con nombre para DH2OCOL
+
+Las consultas de las rutas más frecuentes (páginas públicas, contador y
+registros de visitantes) se declaran aquí una sola vez, con su SQL por
+dialecto cuando MySQL y SQLite difieren. compilar() las deja listas al arrancar
+la aplicación (DatabaseAdapter.init_app): las de SQLite ya traducidas con
+sql_dialect, de modo que ejecutar una consulta es buscarla por nombre, sin
+construir cadenas ni ramificar por DATABASE_TYPE en cada petición:
+
+    cursor.execute_named('visitantes.hoy', (date.today(),))
+
+Las consultas con filtros opcionales declaran sus condiciones y se compilan
+todas las combinaciones; los parámetros van en el orden de declaración de los
+filtros activos:
+
+    cursor.execute_named('visitor_logs.listar', params, filtros=('desde', 'texto'))
+
+PyMySQL no tiene sentencias preparadas en el servidor (interpola los
+parámetros en el cliente), así que en MySQL compilar fija el texto de la
+sentencia pero el servidor la sigue analizando en cada ejecución.
+"""
+
+import threading
+from itertools import combinations
+
+from sql_dialect import traducir_a_sqlite
+
+DIALECTOS = ('mysql', 'sqlite')
+
+_COLUMNAS_LOG = ("id, timestamp, page, ip_address, referrer, user_agent, session_id, "
+                 "language, screen_resolution, timezone")
+
+_FILTROS_LOG = {
+    'desde': "timestamp >= %s",
+    'hasta': "timestamp <= %s",
+    'pagina': "page LIKE %s",
+    'texto': "(ip_address LIKE %s OR session_id LIKE %s OR user_agent LIKE %s)",
+}
+
+
+def _suma(tabla, clave, valor):
+    """Upsert que suma contadores {clave: n} (se ejecuta con executemany)"""
+    return {
+        'mysql': f"INSERT INTO {tabla} ({clave}, {valor}) VALUES (%s, %s) "
+                 f"ON DUPLICATE KEY UPDATE {valor} = {valor} + VALUES({valor})",
+        'sqlite': f"INSERT INTO {tabla} ({clave}, {valor}) VALUES (%s, %s) "
+                  f"ON CONFLICT({clave}) DO UPDATE SET {valor} = {valor} + excluded.{valor}",
+    }
+
+
+def _sketch(tabla, clave):
+    """Crear, leer (bloqueando la fila en MySQL) y guardar el sketch de una fila"""
+    return {
+        f'visitantes.{tabla}.crear': {
+            'mysql': f"INSERT IGNORE INTO {tabla} ({clave}, valor) VALUES (%s, 0)",
+            'sqlite': f"INSERT OR IGNORE INTO {tabla} ({clave}, valor) VALUES (%s, 0)",
+        },
+        f'visitantes.{tabla}.leer': {
+            'mysql': f"SELECT sketch FROM {tabla} WHERE {clave} = %s FOR UPDATE",
+            # En SQLite el INSERT anterior ya tomó el bloqueo de escritura de la base
+            'sqlite': f"SELECT sketch FROM {tabla} WHERE {clave} = %s",
+        },
+        f'visitantes.{tabla}.guardar': f"UPDATE {tabla} SET sketch = %s, valor = %s WHERE {clave} = %s",
+    }
+
+
+CONSULTAS = {
+    # Páginas públicas (blueprints/main.py)
+    'servicios.activos': "SELECT * FROM servicios WHERE activo = TRUE ORDER BY nombre",
+    'productos.activos': "SELECT * FROM productos WHERE activo = TRUE ORDER BY categoria, nombre",
+    'testimonios.activos': "SELECT * FROM testimonios WHERE activo = TRUE ORDER BY id DESC",
+    'medios.por_categoria': "SELECT * FROM medios WHERE categoria = %s ORDER BY fecha_subida DESC",
+    'medios.galeria': ("SELECT * FROM medios WHERE tipo IN ('image', 'video') AND categoria != 'carousel' "
+                       "ORDER BY fecha_subida DESC"),
+    # Listado de medios del panel con los nombres de campo que usa admin/medios.html
+    'medios.admin': {
+        'sql': ("SELECT id, nombre AS name, filename, tipo AS type, categoria AS category, tamano AS size, "
+                "descripcion AS description, ruta AS path, fecha_subida AS upload_date FROM medios"),
+        'filtros': {'categoria': "categoria = %s"},
+        'fin': " ORDER BY fecha_subida DESC",
+    },
+    'institucional.activas': "SELECT * FROM institucional_secciones WHERE activo = TRUE ORDER BY orden, id",
+    'institucional.por_clave': "SELECT * FROM institucional_secciones WHERE clave = %s AND activo = TRUE",
+    'institucional.por_claves': ("SELECT * FROM institucional_secciones WHERE clave IN (%s, %s) AND activo = TRUE "
+                                 "ORDER BY orden, id"),
+    'quiz.preguntas_activas': "SELECT * FROM quiz_preguntas WHERE activo = TRUE ORDER BY orden, id",
+
+    # Registros de visitantes (blueprints/admin.py, visitor_ingest.py)
+    'visitor_logs.insertar': """
+        INSERT INTO visitor_logs
+        (timestamp, ip_address, user_agent, referrer, page, session_id,
+         screen_resolution, language, timezone)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """,
+    'visitor_analytics.insertar': """
+        INSERT INTO visitor_analytics
+        (timestamp, page, referrer, user_agent, screen_resolution,
+         language, timezone, is_new_visitor, session_id, local_count, ip_address)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """,
+    'visitor_logs.listar': {
+        'sql': f"SELECT {_COLUMNAS_LOG} FROM visitor_logs",
+        'filtros': _FILTROS_LOG,
+        'fin': " ORDER BY timestamp DESC LIMIT %s",
+    },
+    'visitor_logs.exportar': {
+        'sql': f"SELECT {_COLUMNAS_LOG} FROM visitor_logs",
+        'filtros': _FILTROS_LOG,
+        'fin': " ORDER BY timestamp DESC",
+    },
+    'visitor_logs.limpiar': {
+        'mysql': "DELETE FROM visitor_logs WHERE timestamp < (NOW() - INTERVAL %s DAY)",
+        'sqlite': "DELETE FROM visitor_logs WHERE timestamp < datetime('now', '-' || %s || ' day')",
+    },
+
+    # Agregados de visitantes (visitor_stats.py)
+    'visitantes.sumar_totales': _suma('visitor_totales', 'clave', 'valor'),
+    'visitantes.sumar_diario': _suma('visitor_diario', 'fecha', 'visitas'),
+    'visitantes.sumar_horario': _suma('visitor_horario', 'hora', 'visitas'),
+    'visitantes.sumar_paginas': _suma('visitor_paginas', 'page', 'visitas'),
+    **_sketch('visitor_totales', 'clave'),
+    **_sketch('visitor_sesiones_slot', 'slot'),
+    'visitantes.borrar_franjas': "DELETE FROM visitor_sesiones_slot WHERE slot < %s",
+    'visitantes.total': "SELECT valor FROM visitor_totales WHERE clave = %s",
+    'visitantes.totales': "SELECT clave, valor FROM visitor_totales WHERE clave IN (%s, %s)",
+    'visitantes.hoy': "SELECT visitas FROM visitor_diario WHERE fecha = %s",
+    'visitantes.franjas_recientes': "SELECT sketch FROM visitor_sesiones_slot WHERE slot > %s",
+    'visitantes.top_paginas': "SELECT page, visitas as visits FROM visitor_paginas ORDER BY visitas DESC LIMIT %s",
+    'visitantes.cerrojo_volcado': {
+        'mysql': "INSERT IGNORE INTO visitor_totales (clave, valor) VALUES (%s, 1)",
+        'sqlite': "INSERT OR IGNORE INTO visitor_totales (clave, valor) VALUES (%s, 1)",
+    },
+    'visitantes.log_por_hora': {
+        'mysql': ("SELECT DATE_FORMAT(timestamp, '%Y-%m-%d %H:00:00') as hora, COUNT(*) as visitas "
+                  "FROM visitor_logs GROUP BY DATE_FORMAT(timestamp, '%Y-%m-%d %H:00:00')"),
+        'sqlite': ("SELECT strftime('%Y-%m-%d %H:00:00', timestamp) as hora, COUNT(*) as visitas "
+                   "FROM visitor_logs GROUP BY strftime('%Y-%m-%d %H:00:00', timestamp)"),
+    },
+}
+
+_lock = threading.Lock()
+_compiladas = {}
+
+
+def _texto(definicion, dialecto):
+    """SQL de un dialecto: una cadena común o {'mysql': ..., 'sqlite': ...}"""
+    return definicion[dialecto] if isinstance(definicion, dict) else definicion
+
+
+def _preparar(sql, dialecto):
+    return traducir_a_sqlite(sql) if dialecto == 'sqlite' else sql
+
+
+def _con_filtros(definicion, dialecto):
+    """Una sentencia por cada combinación de filtros activos, indexada por frozenset"""
+    base = _texto(definicion['sql'], dialecto)
+    filtros = definicion['filtros']
+    variantes = {}
+    for n in range(len(filtros) + 1):
+        for activos in combinations(filtros, n):
+            sql = base
+            if activos:
+                sql += " WHERE " + " AND ".join(filtros[f] for f in activos)
+            variantes[frozenset(activos)] = _preparar(sql + definicion.get('fin', ''), dialecto)
+    return variantes
+
+
+def compilar(dialecto):
+    """Compilar (una vez por proceso) todas las consultas de un dialecto"""
+    dialecto = dialecto.lower()
+    if dialecto not in DIALECTOS:
+        raise ValueError(f"Dialecto SQL no soportado: {dialecto}")
+    compiladas = _compiladas.get(dialecto)
+    if compiladas is None:
+        with _lock:
+            compiladas = _compiladas.get(dialecto)
+            if compiladas is None:
+                compiladas = {}
+                for nombre, definicion in CONSULTAS.items():
+                    if isinstance(definicion, dict) and 'filtros' in definicion:
+                        compiladas[nombre] = _con_filtros(definicion, dialecto)
+                    else:
+                        compiladas[nombre] = _preparar(_texto(definicion, dialecto), dialecto)
+                _compiladas[dialecto] = compiladas
+    return compiladas
+
+
+def sentencia(dialecto, nombre, filtros=()):
+    """Texto compilado de una consulta (con los filtros activos si los admite)"""
+    compiladas = _compiladas.get(dialecto) or compilar(dialecto)
+    sql = compiladas[nombre]
+    if isinstance(sql, dict):
+        return sql[frozenset(filtros)]
+    if filtros:
+        raise ValueError(f"La consulta {nombre} no admite filtros")
+    return sql
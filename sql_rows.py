@@ -0,0 +1,172 @@
+"""
+Filas de resultado compactas para DH2OCOL
+
+Los cursores del adaptador (database_adapter.py) devuelven cada fila como un
+Row: una tupla con los valores de la fila, sin diccionario propio, cuyo tipo
+guarda una sola vez por conjunto de columnas la correspondencia
+nombre -> posición. Se lee igual que el diccionario que devolvía antes el
+adaptador (fila['nombre'], fila.get('imagen'), 'id' in fila, dict(fila)) y
+también por posición (fila[0]); en las plantillas Jinja, medio.ruta funciona
+porque Jinja recurre a medio['ruta'].
+
+Diferencias con dict: iterar una fila recorre sus valores (como una tupla) y
+las filas son de solo lectura; para una copia modificable usar dict(fila).
+
+    python sql_rows.py    # memoria de 100.000 filas de visitor_logs: dict frente a Row
+"""
+
+from functools import lru_cache
+
+from flask.json.provider import DefaultJSONProvider
+
+
+class Row(tuple):
+    """Tupla de valores con acceso por nombre de columna"""
+
+    __slots__ = ()
+
+    # Definidos por row_class() para cada conjunto de columnas
+    _columnas = ()
+    _indices = {}
+
+    def __getitem__(self, clave):
+        if type(clave) is str:
+            try:
+                clave = self._indices[clave]
+            except KeyError:
+                raise KeyError(clave) from None
+        return tuple.__getitem__(self, clave)
+
+    def get(self, clave, default=None):
+        indice = self._indices.get(clave)
+        return default if indice is None else tuple.__getitem__(self, indice)
+
+    def __contains__(self, clave):
+        return clave in self._indices
+
+    def keys(self):
+        return self._columnas
+
+    def values(self):
+        return tuple(self)
+
+    def items(self):
+        return zip(self._columnas, self)
+
+    def _asdict(self):
+        return dict(zip(self._columnas, self))
+
+    def __repr__(self):
+        return f"Row({self._asdict()!r})"
+
+    def __reduce__(self):
+        # Los tipos por columnas se crean al vuelo: se serializan como (columnas, valores)
+        return _reconstruir, (self._columnas, tuple(self))
+
+
+@lru_cache(maxsize=256)
+def row_class(columnas):
+    """Subclase de Row para una tupla de nombres de columna (una por conjunto distinto)"""
+    indices = {}
+    for posicion, nombre in enumerate(columnas):
+        # Columnas repetidas (SELECT * con JOIN): gana la primera, como en DictCursor
+        indices.setdefault(nombre, posicion)
+    return type('Row', (Row,), {'__slots__': (), '_columnas': columnas, '_indices': indices})
+
+
+def _reconstruir(columnas, valores):
+    return row_class(columnas)(valores)
+
+
+def para_json(obj):
+    """Copia de obj con cada Row convertida en diccionario (para serializar a JSON)"""
+    if isinstance(obj, Row):
+        return {clave: para_json(valor) for clave, valor in zip(obj._columnas, obj)}
+    if isinstance(obj, dict):
+        return {clave: para_json(valor) for clave, valor in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [para_json(valor) for valor in obj]
+    return obj
+
+
+class RowJSONProvider(DefaultJSONProvider):
+    """Proveedor JSON de Flask que serializa las filas Row como objetos
+
+    El codificador de json trata cualquier tupla como array antes de consultar
+    default(), así que las filas se convierten al serializar (jsonify, tojson).
+    """
+
+    def dumps(self, obj, **kwargs):
+        return super().dumps(para_json(obj), **kwargs)
+
+
+# =====================
+# Benchmark
+# =====================
+
+def _benchmark(filas=100_000):
+    import gc
+    import sqlite3
+    import time
+    import tracemalloc
+    from datetime import datetime, timedelta
+
+    import sql_queries
+    from database_adapter import SQLiteCursorWrapper
+    from visitor_ingest import SQLITE_TABLES
+
+    conexion = sqlite3.connect(':memory:')
+    conexion.execute(SQLITE_TABLES[0])
+    cursor = SQLiteCursorWrapper(conexion.cursor())
+    sql_queries.compilar('sqlite')
+    inicio = datetime(2024, 1, 1)
+    cursor.executemany_named('visitor_logs.insertar', [
+        (inicio + timedelta(seconds=i), f'181.49.{i % 256}.{i % 200}',
+         'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0',
+         'https://www.google.com/', f'/servicios/{i % 40}', f'sess-{i // 5:08d}',
+         '1920x1080', 'es-CO', 'America/Bogota')
+        for i in range(filas)
+    ])
+    conexion.commit()
+    print(f"visitor_logs: {filas} filas")
+
+    def medir(nombre, leer):
+        gc.collect()
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        resultado = leer()
+        segundos = time.perf_counter() - t0
+        retenido, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"  {nombre:<34} retenido {retenido / 2**20:7.1f} MiB ({retenido / filas:5.0f} B/fila)"
+              f"  pico {pico / 2**20:7.1f} MiB  {segundos:6.2f} s")
+        return resultado
+
+    def dict_por_fila():
+        # Comportamiento anterior: sqlite3.Row -> dict en fetchall
+        conexion.row_factory = sqlite3.Row
+        try:
+            c = conexion.execute(sql_queries.sentencia('sqlite', 'visitor_logs.exportar'))
+            return [dict(fila) for fila in c.fetchall()]
+        finally:
+            conexion.row_factory = None
+
+    def filas_row():
+        cursor.execute_named('visitor_logs.exportar')
+        return cursor.fetchall()
+
+    def recorrer_iterrows():
+        cursor.execute_named('visitor_logs.exportar')
+        return sum(1 for _ in cursor.iterrows())
+
+    print("fetchall() de visitor_logs.exportar:")
+    antes = medir('dict por fila (anterior)', dict_por_fila)
+    del antes
+    ahora = medir('Row (tupla con nombres)', filas_row)
+    assert ahora[0]['page'] == ahora[0][2] and dict(ahora[0])['id'] == ahora[0].get('id')
+    del ahora
+    medir('iterrows() sin materializar', recorrer_iterrows)
+
+
+if __name__ == '__main__':
+    _benchmark()
@@ -174,28 +174,22 @@ class TanquiBot {
                 this.showTypingIndicator();
                 
                 // Enviar mensaje al servidor con token de reCAPTCHA
-                const response = await fetch('/api/chatbot/mensaje', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify({
-                        mensaje: message,
-                        session_id: this.sessionId,
-                        recaptcha_token: recaptchaToken
-                    })
+                const data = await this.requestReply({
+                    mensaje: message,
+                    session_id: this.sessionId,
+                    recaptcha_token: recaptchaToken
                 });
                 
-                const data = await response.json();
-                
                 // Ocultar indicador de escritura
                 this.hideTypingIndicator();
                 
                 if (data.success) {
-                    // Agregar respuesta del bot
-                    setTimeout(() => {
-                        this.addBotMessage(data.respuesta);
-                    }, 500);
+                    // Agregar respuesta del bot (la respuesta en streaming ya está pintada)
+                    if (!data.streamed) {
+                        setTimeout(() => {
+                            this.addBotMessage(data.respuesta);
+                        }, 500);
+                    }
                 } else {
                     this.addBotMessage(data.mensaje || 'Lo siento, ocurrió un error. Por favor, intenta nuevamente o contáctanos directamente.');
                 }
@@ -219,27 +213,21 @@ class TanquiBot {
             
             try {
                 // Enviar mensaje al servidor
-                const response = await fetch('/api/chatbot/mensaje', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify({
-                        mensaje: message,
-                        session_id: this.sessionId
-                    })
+                const data = await this.requestReply({
+                    mensaje: message,
+                    session_id: this.sessionId
                 });
                 
-                const data = await response.json();
-                
                 // Ocultar indicador de escritura
                 this.hideTypingIndicator();
                 
                 if (data.success) {
-                    // Agregar respuesta del bot
-                    setTimeout(() => {
-                        this.addBotMessage(data.respuesta);
-                    }, 500);
+                    // Agregar respuesta del bot (la respuesta en streaming ya está pintada)
+                    if (!data.streamed) {
+                        setTimeout(() => {
+                            this.addBotMessage(data.respuesta);
+                        }, 500);
+                    }
                 } else {
                     this.addBotMessage('Lo siento, ocurrió un error. Por favor, intenta nuevamente o contáctanos directamente.');
                 }
@@ -257,6 +245,94 @@ class TanquiBot {
         }, 1000);
     }
 
+    /**
+     * Enviar el mensaje y obtener la respuesta.
+     * Usa el endpoint SSE y pinta el texto a medida que llega; si el navegador
+     * no soporta streams de fetch, recurre al endpoint JSON clásico.
+     */
+    async requestReply(payload) {
+        if (!window.ReadableStream || !window.TextDecoder) {
+            const response = await fetch('/api/chatbot/mensaje', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify(payload)
+            });
+            return response.json();
+        }
+
+        const response = await fetch('/api/chatbot/mensaje/stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream'
+            },
+            body: JSON.stringify(payload)
+        });
+
+        const contentType = response.headers.get('Content-Type') || '';
+        if (!response.ok || !response.body || !contentType.includes('text/event-stream')) {
+            return response.json().catch(() => ({ success: false }));
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let texto = '';
+        let content = null;
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let separator;
+            while ((separator = buffer.indexOf('\n\n')) !== -1) {
+                const evento = this.parseSseEvent(buffer.slice(0, separator));
+                buffer = buffer.slice(separator + 2);
+
+                if (evento.event === 'delta') {
+                    if (!content) {
+                        this.hideTypingIndicator();
+                        content = this.addBotMessage('');
+                    }
+                    texto += evento.data.texto;
+                    content.textContent = texto;
+                    this.scrollToBottom();
+                } else if (evento.event === 'done') {
+                    if (!content) {
+                        this.hideTypingIndicator();
+                        this.addBotMessage(evento.data.respuesta);
+                    }
+                    return { success: true, respuesta: evento.data.respuesta, streamed: true };
+                }
+            }
+        }
+
+        return { success: texto.length > 0, respuesta: texto, streamed: content !== null };
+    }
+
+    parseSseEvent(raw) {
+        const evento = { event: 'message', data: {} };
+        const dataLines = [];
+        raw.split('\n').forEach(line => {
+            if (line.startsWith('event:')) {
+                evento.event = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).trim());
+            }
+        });
+        if (dataLines.length) {
+            try {
+                evento.data = JSON.parse(dataLines.join('\n'));
+            } catch (error) {
+                console.error('Evento SSE inválido:', error);
+            }
+        }
+        return evento;
+    }
+
     addUserMessage(message) {
         const messagesContainer = document.getElementById('chatbot-messages');
         const messageHTML = `
@@ -280,6 +356,7 @@ class TanquiBot {
         `;
         messagesContainer.insertAdjacentHTML('beforeend', messageHTML);
         this.scrollToBottom();
+        return messagesContainer.lastElementChild.querySelector('.message-content');
     }
 
     showTypingIndicator() {
@@ -579,7 +579,10 @@
         renderImagePreviews(which, state.imageUrlsBySource[key]);
         updateQuoteUI();
         updateSendLinks();
-        setUploadProgress(which, true, `Imágenes subidas (${data.urls.length}).`);
+        const failed = Array.isArray(data.errors) ? data.errors.length : 0;
+        setUploadProgress(which, true, failed
+          ? `Imágenes subidas (${data.urls.length}), ${failed} con error.`
+          : `Imágenes subidas (${data.urls.length}).`);
         // Ocultar la barra después de un breve tiempo
         setTimeout(() => setUploadProgress(which, false), 1200);
       } else {
@@ -0,0 +1,227 @@
+"""
+Storage backend interface for DH2OCOL application
+Shared upload logic for every backend (Firebase bucket, local disk)
+"""
+
+import os
+import hashlib
+from typing import Callable, Optional, Tuple, List
+from werkzeug.datastructures import FileStorage
+import image_processing
+
+# Long-lived caching for static media assets (a name never changes content)
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Content types of the responsive variant extensions (see image_processing.build_variants)
+VARIANT_CONTENT_TYPES = {
+    '.avif': 'image/avif',
+    '.webp': 'image/webp',
+    '.jpg': 'image/jpeg',
+    '.png': 'image/png',
+}
+
+
+# Extension of each stored content type (any other file keeps its original extension)
+STORED_EXTENSIONS = {**{content_type: ext for ext, content_type in VARIANT_CONTENT_TYPES.items()},
+                     'image/gif': '.gif'}
+
+
+def stored_extension(content_type: Optional[str], original_filename: str) -> str:
+    """Extension of a stored file: the one of its real content type, else the original one"""
+    ext = STORED_EXTENSIONS.get(content_type)
+    if ext is None:
+        ext = os.path.splitext(original_filename)[1].lower()
+    return '.jpg' if ext == '.jpeg' else ext
+
+
+def content_hash(file_data: bytes, profile: str) -> str:
+    """SHA-256 of the uploaded bytes together with their processing profile"""
+    digest = hashlib.sha256(profile.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(file_data)
+    return digest.hexdigest()
+
+
+class StorageBackend:
+    """
+    Base class for media storage backends
+
+    Subclasses implement the storage primitives (is_initialized,
+    existing_public_url, upload_named, delete_file, list_files, get_signed_url
+    and _list_names); naming, deduplication and optimization live here so every
+    backend stores the same content under the same name.
+    """
+
+    # Prefix of the log lines
+    label = "Storage"
+
+    def is_initialized(self) -> bool:
+        """Check if the backend can store files"""
+        raise NotImplementedError
+
+    def existing_public_url(self, filename: str) -> Optional[str]:
+        """Public URL of a stored file, or None if it does not exist"""
+        raise NotImplementedError
+
+    def upload_named(self, file_data: bytes, filename: str, content_type: Optional[str]) -> str:
+        """Store bytes as a public file under an exact name (raises on storage errors)"""
+        raise NotImplementedError
+
+    def delete_file(self, file_url: str) -> bool:
+        """Delete a file by its public URL"""
+        raise NotImplementedError
+
+    def list_files(self, folder: str = "", limit: int = 100) -> List[dict]:
+        """List files in a folder as dictionaries (name, url, size, created, updated, content_type)"""
+        raise NotImplementedError
+
+    def get_signed_url(self, filename: str, expiration_hours: int = 1) -> Optional[str]:
+        """Temporary URL for a stored file"""
+        raise NotImplementedError
+
+    def _list_names(self, prefix: str) -> List[Tuple[str, str]]:
+        """(name, public_url) of the stored files whose name starts with prefix"""
+        raise NotImplementedError
+
+    def read_stored(self, file_url: str) -> Optional[Tuple[bytes, str]]:
+        """
+        (bytes, content_type) of a stored file when it can be read without a
+        network round trip, None otherwise (callers then download the URL)
+        """
+        return None
+
+    def content_basename(self, file_data: bytes, folder: str = "", profile: str = 'original') -> str:
+        """
+        Content-addressed blob name without extension: the same bytes uploaded
+        to the same folder with the same processing always map to the same
+        name. The extension (stored_extension) depends on the stored content
+        type, which for optimized images is only known after processing.
+        """
+        filename = content_hash(file_data, profile)
+        return f"{folder}/{filename}" if folder else filename
+
+    def existing_variants(self, base: str) -> Optional[Tuple[str, List[Tuple[int, str, str]]]]:
+        """
+        Look up a stored file by its content-addressed base name (whatever its
+        extension) and its responsive variants with a single listing; a full
+        file name is accepted too (its extension is ignored)
+
+        Returns:
+            (public_url, [(width, content_type, url), ...]) or None if the main
+            file does not exist
+        """
+        base = os.path.splitext(base)[0]
+        try:
+            names = self._list_names(base)
+        except Exception as e:
+            print(f"{self.label}: Could not list {base}: {str(e)}")
+            return None
+        main_url = None
+        variants = []
+        for name, url in names:
+            stem, ext = os.path.splitext(name)
+            if stem == base:
+                main_url = url
+                continue
+            width = stem[len(base):]
+            if width.startswith('_w') and width[2:].isdigit() and ext in VARIANT_CONTENT_TYPES:
+                variants.append((int(width[2:]), VARIANT_CONTENT_TYPES[ext], url))
+        if main_url is None:
+            return None
+        return main_url, variants
+
+    def existing_content_url(self, base: str) -> Optional[str]:
+        """Public URL of the file stored under a content-addressed base name, or None"""
+        existing = self.existing_variants(base)
+        return existing[0] if existing else None
+
+    def _optimize_image(self, file_data: bytes, max_size: Tuple[int, int] = (500, 375), quality: int = 90) -> bytes:
+        """Optimize image for web usage with better sizing for product cards"""
+        return image_processing.optimize_image(file_data, max_size, quality)
+
+    def _optimize_carousel_image(self, file_data: bytes, max_size: Tuple[int, int] = (1920, 1080), quality: int = 95) -> bytes:
+        """Optimize image specifically for carousel usage with higher quality preservation"""
+        return image_processing.optimize_carousel_image(file_data, max_size, quality)
+
+    def _optimize_product_image_by_category(self, file_data: bytes, category: str) -> bytes:
+        """Optimize product images based on their category with specific parameters"""
+        return image_processing.optimize_product_image_by_category(file_data, category)
+
+    def upload_file(self, file: FileStorage, folder: str = "", optimize_image: bool = True, product_category: str = None,
+                    on_upload: Optional[Callable[[str, bytes, str], None]] = None) -> Optional[str]:
+        """
+        Upload a file to storage
+
+        Args:
+            file: FileStorage object from Flask
+            folder: Folder path in storage (e.g., 'productos', 'servicios', 'carousel')
+            optimize_image: Whether to optimize images before upload
+            product_category: Product category for category-specific optimization (Tanques, Bombas, etc.)
+            on_upload: Optional callback receiving (public_url, uploaded_bytes, content_type)
+
+        Returns:
+            Public URL of uploaded file or None if failed
+        """
+        if not self.is_initialized():
+            print(f"{self.label} Storage not initialized")
+            return None
+
+        if not file or not file.filename:
+            print("No file provided")
+            return None
+
+        print(f"{self.label}: Uploading file {file.filename} to folder '{folder}'")
+        print(f"{self.label}: Content type: {file.content_type}")
+        print(f"{self.label}: Product category: {product_category}")
+
+        try:
+            # Read file data
+            file_data = file.read()
+            print(f"{self.label}: File data size: {len(file_data)} bytes")
+
+            # Identical content already stored: reuse it without optimizing or uploading
+            base = self.content_basename(
+                file_data, folder,
+                image_processing.processing_profile(file.content_type, folder, optimize_image, product_category)
+            )
+            existing_url = self.existing_content_url(base)
+            if existing_url:
+                print(f"{self.label}: Identical content already stored: {existing_url}")
+                return existing_url
+
+            # Validate and optimize (see image_processing.py)
+            try:
+                file_data, content_type = image_processing.prepare_file_data(
+                    file_data, file.content_type, folder, optimize_image, product_category
+                )
+            except ValueError as e:
+                print(f"{self.label}: Invalid file {file.filename}: {e}")
+                return None
+            print(f"{self.label}: Prepared file data size: {len(file_data)} bytes ({content_type})")
+
+            filename = base + stored_extension(content_type, file.filename)
+            public_url = self.upload_named(file_data, filename, content_type)
+            if on_upload:
+                on_upload(public_url, file_data, content_type)
+            return public_url
+
+        except Exception as e:
+            print(f"{self.label}: Error uploading file: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            return None
+
+    def upload_bytes(self, file_data: bytes, original_filename: str, content_type: Optional[str], folder: str = "") -> str:
+        """
+        Upload already prepared bytes under their content-addressed name and
+        make them public; identical bytes already stored are not uploaded again
+
+        Returns:
+            Public URL of the file (raises on storage errors)
+        """
+        filename = self.content_basename(file_data, folder) + stored_extension(content_type, original_filename)
+        print(f"{self.label}: Content-addressed filename: {filename}")
+        existing_url = self.existing_public_url(filename)
+        if existing_url:
+            return existing_url
+        return self.upload_named(file_data, filename, content_type)
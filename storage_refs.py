@@ -0,0 +1,84 @@
+"""
+Referencias a blobs de Storage desde la base de datos de DH2OCOL
+
+Los blobs se nombran por su contenido (firebase_storage.content_basename), así
+que dos medios o productos con la misma foto comparten la misma URL. Antes de
+borrar un blob hay que comprobar que ninguna otra fila lo sigue usando.
+
+La tabla medios guarda además el hash del contenido subido (hash_contenido,
+indexado) para reconocer una subida repetida sin consultar Storage.
+"""
+
+from firebase_storage import delete_file
+
+# Columnas que guardan URLs de Storage
+REFERENCIAS = (
+    ('medios', 'ruta'),
+    ('productos', 'imagen'),
+    ('servicios', 'imagen'),
+    ('institucional_secciones', 'imagen'),
+)
+
+_columnas_listas = set()
+
+
+def url_en_uso(cursor, url, excluir=None):
+    """True si alguna fila (sin contar excluir=(tabla, id)) apunta a la URL"""
+    for tabla, columna in REFERENCIAS:
+        query = f"SELECT 1 FROM {tabla} WHERE {columna} = %s"
+        params = [url]
+        if excluir and excluir[0] == tabla:
+            query += " AND id != %s"
+            params.append(excluir[1])
+        try:
+            cursor.execute(query + " LIMIT 1", tuple(params))
+            if cursor.fetchone():
+                return True
+        except Exception as e:
+            # Tabla aún no creada (p. ej. institucional_secciones): no hay referencias
+            print(f"Advertencia al buscar referencias en {tabla}: {e}")
+    return False
+
+
+def borrar_si_no_usada(cursor, url, urls_extra=(), excluir=None):
+    """Borrar un blob (y sus variantes) de Storage si ninguna otra fila lo usa
+
+    excluir=(tabla, id) es la fila que deja de usarlo (la que se borra o cambia
+    de imagen). Devuelve True si se borró o si otra fila lo sigue usando (no
+    hay nada que hacer), False si falló el borrado del blob principal.
+    """
+    if not url or url_en_uso(cursor, url, excluir):
+        return True
+    ok = delete_file(url)
+    for extra in dict.fromkeys(urls_extra):
+        if extra and extra != url:
+            try:
+                if not delete_file(extra):
+                    print(f"Advertencia: No se pudo eliminar {extra}")
+            except Exception as e:
+                print(f"Error al eliminar {extra}: {e}")
+    return ok
+
+
+def ensure_hash_column(cursor, db_type):
+    """Agregar medios.hash_contenido y su índice una sola vez por proceso"""
+    if db_type in _columnas_listas:
+        return
+    try:
+        if db_type == 'sqlite':
+            cursor.execute("PRAGMA table_info(medios)")
+            cols = cursor.fetchall()
+            col_names = [c['name'] for c in cols]
+            if 'hash_contenido' not in col_names:
+                cursor.execute("ALTER TABLE medios ADD COLUMN hash_contenido VARCHAR(64)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_medios_hash_contenido ON medios (hash_contenido)")
+        else:
+            cursor.execute("SHOW COLUMNS FROM medios LIKE 'hash_contenido'")
+            if not cursor.fetchone():
+                cursor.execute("ALTER TABLE medios ADD COLUMN hash_contenido CHAR(64) NULL")
+            cursor.execute("SHOW INDEX FROM medios WHERE Key_name = 'idx_medios_hash_contenido'")
+            if not cursor.fetchone():
+                cursor.execute("CREATE INDEX idx_medios_hash_contenido ON medios (hash_contenido)")
+        _columnas_listas.add(db_type)
+    except Exception as col_err:
+        print(f"Advertencia al agregar columna hash_contenido ({db_type}): {col_err}")
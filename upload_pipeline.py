@@ -0,0 +1,263 @@
+"""
+Subida concurrente de varias imágenes a Firebase Storage
+
+La validación y optimización con Pillow (CPU) corre en un pool de procesos y la
+subida a Storage (E/S) en un pool de hilos, ambos reutilizados por worker. Cada
+archivo pasa a subirse en cuanto termina su optimización, todo el lote tiene un
+plazo máximo y el resultado conserva el orden de entrada con el error de cada
+archivo que falló.
+
+subir_con_variantes() sube además las variantes responsive de una imagen
+(anchos menores en WebP/AVIF/JPEG) por el mismo pool de hilos.
+
+Los blobs se nombran por el SHA-256 de los bytes subidos y su perfil de
+procesamiento: si ese nombre ya existe en Storage (la misma foto subida otra
+vez, p. ej. al reintentar el asistente de cotización) se reutiliza su URL sin
+optimizar ni subir nada. Por lo mismo, una subida que termina fuera de plazo
+(o las variantes de una imagen cuya subida principal falló) no se borra: otra
+petición con la misma foto puede haber escrito ese nombre y estar usando su
+URL, y un reintento reutilizará el blob en lugar de subirlo de nuevo.
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import image_processing
+from firebase_storage import firebase_storage
+from storage_backend import stored_extension
+from responsive_images import agrupar_variantes
+
+_lock = threading.Lock()
+_pools = {}
+
+
+def _get_pools(cpu_workers, io_workers):
+    """Pools de este proceso (los de otro pid son heredados del master y no sirven)
+
+    El pool de procesos usa 'spawn': el worker de gunicorn tiene hilos vivos y
+    hacer fork desde él no es seguro.
+    """
+    pid = os.getpid()
+    pools = _pools.get(pid)
+    if pools is None:
+        with _lock:
+            pools = _pools.get(pid)
+            if pools is None:
+                procesos = None
+                if cpu_workers > 0:
+                    procesos = ProcessPoolExecutor(
+                        max_workers=cpu_workers,
+                        mp_context=multiprocessing.get_context('spawn')
+                    )
+                hilos = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix='storage-upload')
+                pools = {'procesos': procesos, 'hilos': hilos}
+                _pools.clear()
+                _pools[pid] = pools
+    return pools
+
+
+def _descartar_pool_procesos(pools):
+    """Quitar un pool de procesos roto; el siguiente lote optimiza en los hilos"""
+    with _lock:
+        procesos, pools['procesos'] = pools['procesos'], None
+    if procesos is not None:
+        procesos.shutdown(wait=False, cancel_futures=True)
+
+
+def _preparar(pools, futuro_cpu, datos, content_type, folder, optimize_image, product_category, deadline):
+    """(bytes, content_type) listos para subir: del pool de procesos o, si no hay, en este hilo"""
+    if futuro_cpu is not None:
+        try:
+            return futuro_cpu.result(timeout=max(deadline - time.monotonic(), 0))
+        except BrokenProcessPool:
+            _descartar_pool_procesos(pools)
+    return image_processing.prepare_file_data(datos, content_type, folder, optimize_image, product_category)
+
+
+def _enviar_a_pool_cpu(pools, funcion, *args):
+    """Futuro del pool de procesos, o None si no hay (se hará en el hilo)"""
+    procesos = pools['procesos']
+    if procesos is None:
+        return None
+    try:
+        return procesos.submit(funcion, *args)
+    except BrokenProcessPool:
+        _descartar_pool_procesos(pools)
+        return None
+
+
+def _subir(pools, archivo, base, folder, optimize_image, product_category, deadline, on_upload):
+    """Subir un archivo con el nombre base de su contenido; devuelve (url, subido)
+
+    La extensión del blob sale del tipo real de los bytes preparados (una foto
+    optimizada es JPEG o PNG aunque se haya subido como otro formato).
+    """
+    nombre, content_type, datos = archivo
+    existente = firebase_storage.existing_content_url(base)
+    if existente:
+        return existente, False
+
+    futuro_cpu = _enviar_a_pool_cpu(pools, image_processing.prepare_file_data, datos, content_type,
+                                    folder, optimize_image, product_category)
+    preparado, tipo = _preparar(pools, futuro_cpu, datos, content_type, folder,
+                                optimize_image, product_category, deadline)
+    if time.monotonic() > deadline:
+        raise TimeoutError('Plazo agotado antes de subir')
+    url = firebase_storage.upload_named(preparado, base + stored_extension(tipo, nombre), tipo)
+    if on_upload:
+        on_upload(url, preparado, tipo)
+    return url, True
+
+
+def subir_archivos(files, folder="", optimize_image=True, product_category=None, deadline_seconds=25,
+                   cpu_workers=2, io_workers=4, on_upload=None):
+    """Optimizar y subir varios FileStorage en paralelo
+
+    Devuelve una lista en el orden de entrada con un dict por archivo:
+    {'filename', 'url', 'error'} (url None y error con el motivo si falló).
+    """
+    # El stream de la petición solo se puede leer en este hilo
+    archivos = [(f.filename, f.content_type, f.read()) for f in files]
+    if not archivos:
+        return []
+
+    deadline = time.monotonic() + deadline_seconds
+    pools = _get_pools(cpu_workers, io_workers)
+
+    # Archivos repetidos dentro del mismo lote comparten una sola subida
+    por_blob = {}
+    futuros = []
+    for nombre, content_type, datos in archivos:
+        perfil = image_processing.processing_profile(content_type, folder, optimize_image, product_category)
+        base = firebase_storage.content_basename(datos, folder, perfil)
+        if base not in por_blob:
+            por_blob[base] = pools['hilos'].submit(
+                _subir, pools, (nombre, content_type, datos), base, folder,
+                optimize_image, product_category, deadline, on_upload
+            )
+        futuros.append(por_blob[base])
+
+    wait(futuros, timeout=max(deadline - time.monotonic(), 0))
+
+    resultados = []
+    for (nombre, _, _), futuro in zip(archivos, futuros):
+        resultado = {'filename': nombre, 'url': None, 'error': None}
+        if not futuro.done():
+            resultado['error'] = 'Plazo agotado'
+            futuro.cancel()
+        else:
+            try:
+                resultado['url'] = futuro.result()[0]
+            except image_processing.InvalidImageError:
+                resultado['error'] = 'Imagen no válida'
+            except image_processing.EmptyFileError:
+                resultado['error'] = 'Archivo vacío'
+            except Exception as e:
+                print(f"Error subiendo {nombre}: {e}")
+                resultado['error'] = 'Error al subir'
+        resultados.append(resultado)
+    return resultados
+
+
+def nombre_variante(nombre_principal, ancho, extension):
+    """Nombre del blob de una variante: el de la imagen principal con sufijo de ancho"""
+    base, _ = os.path.splitext(nombre_principal)
+    return f"{base}_w{ancho}{extension}"
+
+
+def _subir_nombrado(datos, blob, content_type):
+    return firebase_storage.upload_named(datos, blob, content_type), True
+
+
+def _variantes_con_respaldo(subidas, ancho_completo, content_type, url):
+    """Agrupar las variantes añadiendo la imagen principal como respaldo a tamaño completo"""
+    if subidas:
+        subidas = [*subidas, (ancho_completo, content_type, url)]
+    return agrupar_variantes(subidas)
+
+
+def subir_con_variantes(file, folder="", product_category=None, deadline_seconds=25,
+                        cpu_workers=2, io_workers=4):
+    """Optimizar una imagen y subirla junto con sus variantes responsive
+
+    Si el mismo contenido ya está en Storage (un listado por el prefijo de su
+    nombre) se devuelven sus URLs sin decodificar ni subir nada. Si no, la
+    imagen se decodifica una sola vez (en el pool de procesos si lo hay) y la
+    principal y las variantes se suben en paralelo. Devuelve (url, variantes)
+    con variantes en el formato de responsive_images, o (None, None) si la
+    imagen no es válida o la subida principal falla; una variante que falla
+    solo se omite.
+    """
+    if not firebase_storage.is_initialized():
+        print("Firebase Storage not initialized")
+        return None, None
+    datos = file.read()
+    perfil = image_processing.processing_profile(file.content_type, folder, True, product_category)
+    base = firebase_storage.content_basename(datos, folder, perfil)
+
+    existente = firebase_storage.existing_variants(base)
+    if existente is not None:
+        url, subidas = existente
+        print(f"Contenido ya almacenado, se reutiliza {url}")
+        ancho_completo = max((ancho for ancho, _, _ in subidas), default=0)
+        # Las variantes de respaldo son PNG solo si la imagen tenía transparencia
+        content_type = 'image/png' if any(tipo == 'image/png' for _, tipo, _ in subidas) else 'image/jpeg'
+        return url, _variantes_con_respaldo(subidas, ancho_completo, content_type, url)
+
+    pools = _get_pools(cpu_workers, io_workers)
+    deadline = time.monotonic() + deadline_seconds
+    args = (datos, file.content_type, folder, product_category)
+
+    try:
+        resultado = None
+        futuro_cpu = _enviar_a_pool_cpu(pools, image_processing.prepare_image_variants, *args)
+        if futuro_cpu is not None:
+            try:
+                resultado = futuro_cpu.result(timeout=max(deadline - time.monotonic(), 0))
+            except BrokenProcessPool:
+                _descartar_pool_procesos(pools)
+        if resultado is None:
+            resultado = image_processing.prepare_image_variants(*args)
+    except ValueError as e:
+        print(f"Imagen no válida {file.filename}: {e}")
+        return None, None
+    except Exception as e:
+        print(f"Error optimizando {file.filename}: {e}")
+        return None, None
+    principal, content_type, variantes = resultado
+    nombre = base + stored_extension(content_type, file.filename)
+
+    futuro_principal = pools['hilos'].submit(_subir_nombrado, principal, nombre, content_type)
+    futuros = {
+        pools['hilos'].submit(
+            _subir_nombrado, v['data'], nombre_variante(nombre, v['width'], v['ext']), v['content_type']
+        ): v
+        for v in variantes
+    }
+    wait([futuro_principal, *futuros], timeout=max(deadline - time.monotonic(), 0))
+
+    subidas = []
+    for futuro, v in futuros.items():
+        if not futuro.done():
+            futuro.cancel()
+            continue
+        try:
+            subidas.append((v['width'], v['content_type'], futuro.result()[0]))
+        except Exception as e:
+            print(f"Error subiendo variante {v['width']}px {v['content_type']} de {file.filename}: {e}")
+
+    try:
+        if not futuro_principal.done():
+            futuro_principal.cancel()
+            raise TimeoutError('Plazo agotado')
+        url = futuro_principal.result()[0]
+    except Exception as e:
+        print(f"Error subiendo {file.filename}: {e}")
+        return None, None
+
+    ancho_completo = max((v['width'] for v in variantes), default=0)
+    return url, _variantes_con_respaldo(subidas, ancho_completo, content_type, url)
@@ -0,0 +1,327 @@
+"""
+Ingesta de eventos del contador de visitantes para DH2OCOL
+
+Las peticiones a /api/visitor-count y /api/analytics solo encolan el evento en
+una cola acotada en memoria; un hilo por worker lo vacía con INSERT multi-fila
+(executemany) cuando se alcanza el tamaño de lote o el intervalo de volcado.
+Así el tráfico de seguimiento no retiene un worker síncrono ni una conexión a
+la base de datos por cada visita.
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+
+import visitor_stats
+
+# Tipos de evento y su sentencia de inserción
+EVENTO_VISITA = 'visita'
+EVENTO_ANALYTICS = 'analytics'
+
+# Sentencia de cada tipo de evento (ver sql_queries.py)
+INSERT_SQL = {
+    EVENTO_VISITA: 'visitor_logs.insertar',
+    EVENTO_ANALYTICS: 'visitor_analytics.insertar',
+}
+
+SQLITE_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS visitor_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp DATETIME NOT NULL,
+        ip_address VARCHAR(45),
+        user_agent TEXT,
+        referrer TEXT,
+        page VARCHAR(255),
+        session_id VARCHAR(100),
+        screen_resolution VARCHAR(20),
+        language VARCHAR(10),
+        timezone VARCHAR(50),
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS visitor_analytics (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp DATETIME NOT NULL,
+        page VARCHAR(255),
+        referrer TEXT,
+        user_agent TEXT,
+        screen_resolution VARCHAR(20),
+        language VARCHAR(10),
+        timezone VARCHAR(50),
+        is_new_visitor BOOLEAN,
+        session_id VARCHAR(100),
+        local_count INTEGER,
+        ip_address VARCHAR(45),
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+)
+
+
+class VisitorIngestor:
+    """Cola acotada + hilo de volcado por lotes (uno por proceso)"""
+
+    def __init__(self, app=None, adapter=None):
+        self.app = None
+        self.adapter = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._tables_ready = set()
+        self._total_visitors = None
+        # Visitas en la cola (sin los eventos de analytics) para total_visitors()
+        self._queued_visits = 0
+        self._reset_counters()
+        if app is not None:
+            self.init_app(app, adapter)
+
+    def init_app(self, app, adapter):
+        """Asociar la aplicación y el adaptador de base de datos"""
+        self.app = app
+        self.adapter = adapter
+        app.extensions['visitor_ingest'] = self
+
+    def _reset_counters(self):
+        self.counters = {
+            'accepted': 0,
+            'dropped': 0,
+            'flushed': 0,
+            'failed': 0,
+            'batches': 0,
+            'last_flush': None,
+            'last_error': None,
+        }
+
+    @property
+    def config(self):
+        return self.app.config
+
+    @property
+    def db_type(self):
+        return self.config.get('DATABASE_TYPE', 'mysql').lower()
+
+    @property
+    def buffered(self):
+        return self.config.get('VISITOR_INGEST_MODE', 'buffered') == 'buffered'
+
+    # =====================
+    # Tablas
+    # =====================
+
+    def ensure_tables(self, cursor):
+        """Crear las tablas en SQLite una sola vez por proceso (en MySQL ya existen)"""
+        db_type = self.db_type
+        if db_type != 'sqlite' or db_type in self._tables_ready:
+            return
+        for ddl in SQLITE_TABLES:
+            cursor.execute(ddl)
+        self._tables_ready.add(db_type)
+
+    # =====================
+    # Cola y ciclo de vida del hilo
+    # =====================
+
+    def _ensure_started(self):
+        """Arrancar la cola y el hilo de volcado en este proceso
+
+        Con preload_app el módulo se importa en el master antes del fork: cada
+        worker detecta el cambio de pid y crea su propia cola e hilo.
+        """
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == pid and self._thread is not None and self._thread.is_alive():
+                return
+            if self._pid != pid:
+                self._queue = queue.Queue(maxsize=self.config.get('VISITOR_INGEST_QUEUE_SIZE', 10000))
+                self._stop = threading.Event()
+                self._queued_visits = 0
+                self._reset_counters()
+                self._pid = pid
+            self._thread = threading.Thread(
+                target=self._run, name='visitor-ingest', daemon=True
+            )
+            self._thread.start()
+
+    def submit(self, kind, row):
+        """Encolar un evento; devuelve False si la cola está llena y se descarta"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((kind, row))
+        except queue.Full:
+            with self._lock:
+                self.counters['dropped'] += 1
+            return False
+        with self._lock:
+            self.counters['accepted'] += 1
+            if kind == EVENTO_VISITA:
+                self._queued_visits += 1
+        return True
+
+    def _dequeued(self, batch):
+        """Descontar las visitas de un lote sacado de la cola"""
+        visits = sum(1 for kind, _ in batch if kind == EVENTO_VISITA)
+        if visits:
+            with self._lock:
+                self._queued_visits -= visits
+        return batch
+
+    def backpressure(self):
+        """True cuando la cola supera la marca de agua alta configurada"""
+        if self._queue is None or self._pid != os.getpid():
+            return False
+        high_water = self.config.get('VISITOR_INGEST_HIGH_WATER', 0.8)
+        return self._queue.qsize() >= self._queue.maxsize * high_water
+
+    def _run(self):
+        batch_size = self.config.get('VISITOR_INGEST_BATCH_SIZE', 200)
+        interval = self.config.get('VISITOR_INGEST_FLUSH_INTERVAL', 2.0)
+        while not self._stop.is_set():
+            batch = self._collect(batch_size, interval)
+            if batch:
+                self._flush(batch)
+
+    def _collect(self, batch_size, interval):
+        """Esperar eventos hasta completar un lote o agotar el intervalo"""
+        batch = []
+        deadline = time.monotonic() + interval
+        while len(batch) < batch_size and not self._stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                # Espera en tramos cortos para atender la parada al salir
+                batch.append(self._queue.get(timeout=min(remaining, 0.5)))
+            except queue.Empty:
+                continue
+        return self._dequeued(batch)
+
+    def drain(self):
+        """Volcar lo pendiente en la cola (al salir el proceso)"""
+        if self._queue is None or self._pid != os.getpid():
+            return
+        self._stop.set()
+        # El hilo vuelca el lote que tenga a medias antes de terminar
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout=self.config.get('VISITOR_INGEST_FLUSH_INTERVAL', 2.0) + 5)
+        batch_size = self.config.get('VISITOR_INGEST_BATCH_SIZE', 200)
+        while True:
+            batch = []
+            while len(batch) < batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._flush(self._dequeued(batch))
+
+    # =====================
+    # Escritura
+    # =====================
+
+    def write(self, db, events):
+        """Insertar eventos agrupados por tipo con una sentencia multi-fila cada uno"""
+        grouped = {}
+        for kind, row in events:
+            grouped.setdefault(kind, []).append(row)
+
+        db_type = self.db_type
+        cursor = db.cursor()
+        try:
+            self.ensure_tables(cursor)
+            visitor_stats.ensure_rollups(cursor, db_type)
+            for kind, rows in grouped.items():
+                cursor.executemany_named(INSERT_SQL[kind], rows)
+            # Agregados en la misma transacción que el log: nunca se desalinean
+            visitor_stats.apply_visits(cursor, grouped.get(EVENTO_VISITA))
+            db.commit()
+            visitor_stats.mark_ready(db_type)
+            if EVENTO_VISITA in grouped:
+                self._refresh_total(cursor)
+        finally:
+            cursor.close()
+
+    def _refresh_total(self, cursor):
+        """Leer el total materializado una vez por lote, no una vez por petición"""
+        try:
+            self._total_visitors = visitor_stats.read_total(cursor)
+        except Exception as e:
+            print(f"Error actualizando total de visitantes: {e}")
+
+    def read_stats(self, db, top_pages=5):
+        """Estadísticas del contador desde los agregados (ver visitor_stats.py)"""
+        cursor = db.cursor()
+        try:
+            self.ensure_tables(cursor)
+        finally:
+            cursor.close()
+        return visitor_stats.get_stats(db, self.db_type, top_pages=top_pages)
+
+    def _flush(self, batch):
+        db = None
+        try:
+            db = self.adapter.connect(self.config)
+            self.write(db, batch)
+            with self._lock:
+                self.counters['flushed'] += len(batch)
+                self.counters['batches'] += 1
+                self.counters['last_flush'] = time.time()
+        except Exception as e:
+            print(f"Error volcando {len(batch)} eventos de visitantes: {e}")
+            if db is not None:
+                try:
+                    db.rollback()
+                except Exception:
+                    pass
+            with self._lock:
+                self.counters['failed'] += len(batch)
+                self.counters['last_error'] = str(e)
+        finally:
+            if db is not None:
+                db.close()
+
+    # =====================
+    # Consulta
+    # =====================
+
+    def pending(self):
+        if self._queue is None or self._pid != os.getpid():
+            return 0
+        return self._queue.qsize()
+
+    def total_visitors(self):
+        """Total aproximado: último recuento del hilo de volcado + visitas encoladas"""
+        if self._total_visitors is None:
+            return None
+        queued = self._queued_visits if self._pid == os.getpid() else 0
+        return self._total_visitors + queued
+
+    def stats(self):
+        """Contadores de la ingesta de este worker"""
+        with self._lock:
+            stats = dict(self.counters)
+        stats.update({
+            'mode': 'buffered' if self.buffered else 'sync',
+            'pid': os.getpid(),
+            'queue_depth': self.pending(),
+            'queue_size': self._queue.maxsize if self._queue is not None else
+            self.config.get('VISITOR_INGEST_QUEUE_SIZE', 10000),
+            'backpressure': self.backpressure(),
+            'thread_alive': bool(self._thread is not None and self._thread.is_alive()
+                                 and self._pid == os.getpid()),
+        })
+        return stats
+
+
+visitor_ingestor = VisitorIngestor()
+
+# Volcar lo pendiente cuando el worker termina (max_requests, reinicio, SIGTERM)
+atexit.register(visitor_ingestor.drain)
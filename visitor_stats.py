@@ -0,0 +1,363 @@
+"""
+Contadores materializados de visitantes para DH2OCOL
+
+En lugar de recorrer visitor_logs con COUNT(*) / COUNT(DISTINCT) en cada
+consulta, la ingesta (visitor_ingest.py) actualiza en la misma transacción:
+
+- visitor_totales: total acumulado y sketch HyperLogLog de IPs únicas
+- visitor_diario / visitor_horario: visitas por día y por hora
+- visitor_paginas: visitas acumuladas por página
+- visitor_sesiones_slot: sketch de sesiones por franja de 10 minutos
+  ("en línea" = unión de las franjas de la última hora)
+
+Las lecturas tocan un número fijo de filas sea cual sea el tamaño del log.
+Los contadores son acumulados: limpiar registros antiguos de visitor_logs no
+los reduce. Las sentencias están en el registro de sql_queries.py
+('visitantes.*'), compiladas por dialecto al arrancar.
+"""
+
+import hashlib
+import math
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+# HyperLogLog con 2^12 registros de un byte (~1.6% de error típico, 4 KB por sketch)
+HLL_P = 12
+HLL_M = 1 << HLL_P
+_HLL_ALPHA = 0.7213 / (1 + 1.079 / HLL_M)
+_HLL_POW = [2.0 ** -i for i in range(65)]
+
+# Franjas de sesiones para el indicador "en línea"
+SLOT_SECONDS = 600
+ONLINE_SLOTS = 6
+SLOT_RETENTION = 12
+
+TOTAL_VISITAS = 'total'
+IPS_UNICAS = 'unique_ips'
+BACKFILL = 'backfill'
+
+_lock = threading.Lock()
+_tables_ready = set()
+_backfill_ready = set()
+
+
+# =====================
+# HyperLogLog
+# =====================
+
+def hll_new(blob=None):
+    """Registros de un sketch (vacío si el blob no existe o no es válido)"""
+    if blob and len(blob) == HLL_M:
+        return bytearray(blob)
+    return bytearray(HLL_M)
+
+
+def hll_add(registers, value):
+    """Añadir un valor al sketch"""
+    h = int.from_bytes(
+        hashlib.blake2b(str(value).encode('utf-8', 'ignore'), digest_size=8).digest(), 'big'
+    )
+    idx = h >> (64 - HLL_P)
+    rest = h & ((1 << (64 - HLL_P)) - 1)
+    rank = (64 - HLL_P) - rest.bit_length() + 1
+    if rank > registers[idx]:
+        registers[idx] = rank
+
+
+def hll_merge(registers, other):
+    """Unión de dos sketches (máximo registro a registro)"""
+    return bytearray(map(max, registers, other))
+
+
+def hll_count(registers):
+    """Estimación de elementos distintos"""
+    z = sum(map(_HLL_POW.__getitem__, registers))
+    estimate = _HLL_ALPHA * HLL_M * HLL_M / z
+    if estimate <= 2.5 * HLL_M:
+        zeros = registers.count(0)
+        if zeros:
+            estimate = HLL_M * math.log(HLL_M / zeros)
+    return int(round(estimate))
+
+
+# =====================
+# Tablas
+# =====================
+
+def _ddl(db_type):
+    if db_type == 'sqlite':
+        return (
+            """
+            CREATE TABLE IF NOT EXISTS visitor_totales (
+                clave VARCHAR(50) PRIMARY KEY,
+                valor INTEGER NOT NULL DEFAULT 0,
+                sketch BLOB
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS visitor_diario (
+                fecha DATE PRIMARY KEY,
+                visitas INTEGER NOT NULL DEFAULT 0
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS visitor_horario (
+                hora DATETIME PRIMARY KEY,
+                visitas INTEGER NOT NULL DEFAULT 0
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS visitor_paginas (
+                page VARCHAR(255) PRIMARY KEY,
+                visitas INTEGER NOT NULL DEFAULT 0
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_visitor_paginas_visitas ON visitor_paginas (visitas)",
+            """
+            CREATE TABLE IF NOT EXISTS visitor_sesiones_slot (
+                slot INTEGER PRIMARY KEY,
+                valor INTEGER NOT NULL DEFAULT 0,
+                sketch BLOB
+            )
+            """,
+        )
+    return (
+        """
+        CREATE TABLE IF NOT EXISTS visitor_totales (
+            clave VARCHAR(50) PRIMARY KEY,
+            valor BIGINT NOT NULL DEFAULT 0,
+            sketch BLOB NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS visitor_diario (
+            fecha DATE PRIMARY KEY,
+            visitas BIGINT NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS visitor_horario (
+            hora DATETIME PRIMARY KEY,
+            visitas BIGINT NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS visitor_paginas (
+            page VARCHAR(255) PRIMARY KEY,
+            visitas BIGINT NOT NULL DEFAULT 0,
+            INDEX idx_visitor_paginas_visitas (visitas)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS visitor_sesiones_slot (
+            slot BIGINT PRIMARY KEY,
+            valor BIGINT NOT NULL DEFAULT 0,
+            sketch BLOB NULL
+        )
+        """,
+    )
+
+
+def ensure_rollups(cursor, db_type):
+    """Crear las tablas de agregados y poblarlas desde visitor_logs si hace falta
+
+    Devuelve True si en esta transacción se ha hecho el volcado inicial; el
+    llamador debe confirmar (commit) y después llamar a mark_ready().
+    """
+    if db_type not in _tables_ready:
+        for ddl in _ddl(db_type):
+            cursor.execute(ddl)
+        with _lock:
+            _tables_ready.add(db_type)
+    if db_type in _backfill_ready:
+        return False
+    return _backfill(cursor)
+
+
+def mark_ready(db_type):
+    """Recordar (tras el commit) que los agregados ya están inicializados"""
+    with _lock:
+        _backfill_ready.add(db_type)
+
+
+def _increment(cursor, consulta, counts):
+    """Sumar contadores {clave: n} con un upsert multi-fila"""
+    if counts:
+        cursor.executemany_named(consulta, list(counts.items()))
+
+
+def _merge_sketch(cursor, table, key, values):
+    """Añadir valores al sketch guardado en una fila, bloqueándola mientras tanto"""
+    if not values:
+        return
+    cursor.execute_named(f'visitantes.{table}.crear', (key,))
+    cursor.execute_named(f'visitantes.{table}.leer', (key,))
+    row = cursor.fetchone()
+    registers = hll_new(row['sketch'] if row else None)
+    for value in values:
+        hll_add(registers, value)
+    cursor.execute_named(f'visitantes.{table}.guardar', (bytes(registers), hll_count(registers), key))
+
+
+def _slot_of(moment):
+    return int(moment.timestamp()) // SLOT_SECONDS
+
+
+def _as_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+
+# =====================
+# Actualización incremental
+# =====================
+
+def apply_visits(cursor, rows):
+    """Actualizar los agregados con un lote de filas de visitor_logs
+
+    Cada fila sigue el orden del INSERT de visitor_logs:
+    (timestamp, ip_address, user_agent, referrer, page, session_id, ...).
+    """
+    if not rows:
+        return
+    daily, hourly, pages = {}, {}, {}
+    ips = set()
+    sessions = {}
+    for row in rows:
+        moment = _as_datetime(row[0])
+        day = moment.date()
+        hour = moment.replace(minute=0, second=0, microsecond=0)
+        page = (row[4] or '/')[:255]
+        daily[day] = daily.get(day, 0) + 1
+        hourly[hour] = hourly.get(hour, 0) + 1
+        pages[page] = pages.get(page, 0) + 1
+        if row[1]:
+            ips.add(row[1])
+        if row[5]:
+            sessions.setdefault(_slot_of(moment), set()).add(row[5])
+
+    _increment(cursor, 'visitantes.sumar_totales', {TOTAL_VISITAS: len(rows)})
+    _increment(cursor, 'visitantes.sumar_diario', daily)
+    _increment(cursor, 'visitantes.sumar_horario', hourly)
+    _increment(cursor, 'visitantes.sumar_paginas', pages)
+    _merge_sketch(cursor, 'visitor_totales', IPS_UNICAS, ips)
+    for slot in sorted(sessions):
+        _merge_sketch(cursor, 'visitor_sesiones_slot', slot, sessions[slot])
+
+    # Las franjas antiguas ya no cuentan para "en línea"
+    cursor.execute_named('visitantes.borrar_franjas', (_slot_of(datetime.now()) - SLOT_RETENTION,))
+
+
+def _backfill(cursor):
+    """Poblar los agregados a partir de visitor_logs (una sola vez en total)
+
+    La fila 'backfill' de visitor_totales actúa como cerrojo: solo el primer
+    proceso que la inserta recorre el log; el resto espera a su commit.
+    """
+    cursor.execute_named('visitantes.cerrojo_volcado', (BACKFILL,))
+    if cursor.rowcount != 1:
+        return False
+
+    started = time.monotonic()
+    cursor.execute("SELECT COUNT(*) as total FROM visitor_logs")
+    result = cursor.fetchone()
+    total = result['total'] if result else 0
+    if not total:
+        return True
+
+    _increment(cursor, 'visitantes.sumar_totales', {TOTAL_VISITAS: total})
+
+    cursor.execute("SELECT DATE(timestamp) as fecha, COUNT(*) as visitas FROM visitor_logs GROUP BY DATE(timestamp)")
+    _increment(cursor, 'visitantes.sumar_diario',
+               {row['fecha']: row['visitas'] for row in cursor.fetchall()})
+
+    cursor.execute_named('visitantes.log_por_hora')
+    _increment(cursor, 'visitantes.sumar_horario',
+               {row['hora']: row['visitas'] for row in cursor.fetchall()})
+
+    cursor.execute("SELECT page, COUNT(*) as visitas FROM visitor_logs GROUP BY page")
+    _increment(cursor, 'visitantes.sumar_paginas',
+               {(row['page'] or '/')[:255]: row['visitas'] for row in cursor.fetchall()})
+
+    cursor.execute("SELECT DISTINCT ip_address FROM visitor_logs WHERE ip_address IS NOT NULL")
+    _merge_sketch(cursor, 'visitor_totales', IPS_UNICAS,
+                  [row['ip_address'] for row in cursor.fetchall()])
+
+    since = datetime.now() - timedelta(seconds=SLOT_SECONDS * ONLINE_SLOTS)
+    cursor.execute(
+        "SELECT timestamp, session_id FROM visitor_logs WHERE timestamp >= %s AND session_id <> ''",
+        (since,)
+    )
+    sessions = {}
+    for row in cursor.fetchall():
+        sessions.setdefault(_slot_of(_as_datetime(row['timestamp'])), set()).add(row['session_id'])
+    for slot in sorted(sessions):
+        _merge_sketch(cursor, 'visitor_sesiones_slot', slot, sessions[slot])
+
+    print(f"Agregados de visitantes inicializados desde {total} registros "
+          f"en {time.monotonic() - started:.1f}s")
+    return True
+
+
+# =====================
+# Lectura
+# =====================
+
+def read_total(cursor):
+    """Total acumulado de visitas"""
+    cursor.execute_named('visitantes.total', (TOTAL_VISITAS,))
+    row = cursor.fetchone()
+    return row['valor'] if row else 0
+
+
+def read_stats(cursor, top_pages=5):
+    """Estadísticas del contador leyendo solo filas de agregados"""
+    cursor.execute_named('visitantes.totales', (TOTAL_VISITAS, IPS_UNICAS))
+    totals = {row['clave']: row['valor'] for row in cursor.fetchall()}
+
+    cursor.execute_named('visitantes.hoy', (date.today(),))
+    row = cursor.fetchone()
+    today = row['visitas'] if row else 0
+
+    cursor.execute_named('visitantes.franjas_recientes', (_slot_of(datetime.now()) - ONLINE_SLOTS,))
+    registers = hll_new()
+    for row in cursor.fetchall():
+        if row['sketch']:
+            registers = hll_merge(registers, row['sketch'])
+    online = hll_count(registers) if any(registers) else 0
+
+    cursor.execute_named('visitantes.top_paginas', (top_pages,))
+    pages = [{'page': row['page'], 'visits': row['visits']} for row in cursor.fetchall()]
+
+    return {
+        'total': totals.get(TOTAL_VISITAS, 0),
+        'today': today,
+        'unique': totals.get(IPS_UNICAS, 0),
+        'online': online,
+        'top_pages': pages,
+    }
+
+
+def get_stats(db, db_type, top_pages=5):
+    """Asegurar los agregados y leerlos con la conexión de la petición"""
+    cursor = db.cursor()
+    try:
+        if db_type not in _backfill_ready:
+            ensure_rollups(cursor, db_type)
+            db.commit()
+            mark_ready(db_type)
+        return read_stats(cursor, top_pages=top_pages)
+    finally:
+        cursor.close()
+
+
+if __name__ == '__main__':
+    # Comprobación rápida de precisión del sketch
+    for n in (10, 1000, 100000):
+        regs = hll_new()
+        for i in range(n):
+            hll_add(regs, f"192.168.{i // 256}.{i % 256}-{i}")
+        est = hll_count(regs)
+        print(f"n={n:>7}  estimado={est:>7}  error={abs(est - n) / n:.2%}")